@@ -20,6 +20,10 @@ import logging
 import datetime
 import sys
 import threading
+import time
+import hmac
+import hashlib
+import base64
 from proton import DELEGATED, Url, timestamp, generate_uuid, utf82unicode
 from proton import Delivery, Message
 from proton.reactor import dispatch, Container, Selector
@@ -27,6 +31,12 @@ from proton.handlers import Handler, EndpointStateHandler
 from proton.handlers import IncomingMessageHandler
 from proton.handlers import CFlowController, OutgoingMessageHandler
 from ._impl import SenderHandler, ReceiverHandler, SessionPolicy, InjectorEvent
+from ._impl import BackoffPolicy, Backoff, CbsHandler
+
+try:
+    from urllib.parse import quote, quote_plus
+except ImportError:
+    from urllib import quote, quote_plus
 
 if sys.platform.startswith("win"):
     from ._win import EventInjector
@@ -40,19 +50,38 @@ class EventHubClient(object):
     The L{EventHubClient} class defines a high level interface for sending
     events to and receiving events from the Azure Event Hubs service.
     """
-    def __init__(self, address, **kwargs):
+    def __init__(self, address, backoff=None, sessions=None, token_provider=None, **kwargs):
         """
         Constructs a new L{EventHubClient} with the given address Url.
 
         @param address: the full Uri string of the event hub.
+
+        @param backoff: the L{BackoffPolicy} used to delay connection, session
+        and link recovery. Defaults to 1 to 60 seconds with full jitter. The
+        delays start over once a link is attached again.
+
+        @param sessions: the L{SessionPolicy} allocating AMQP sessions to links
+        and configuring their windows. Defaults to one shared session.
+
+        @param token_provider: a L{SasTokenProvider} or L{TokenCache}. When set, the
+        connection is authorized with CBS put-token instead of SASL PLAIN and the
+        address should not carry credentials.
         """
         self.container_id = "eventhubs.pycli-" + str(generate_uuid())[:8]
         self.address = Url(address)
+        self.backoff_policy = backoff or BackoffPolicy()
+        self.backoff = Backoff(self.backoff_policy)
+        self.cbs = None
+        if token_provider is not None:
+            if not isinstance(token_provider, TokenCache):
+                token_provider = TokenCache(token_provider)
+            audience = "sb://%s/%s" % (self.address.host, self.address.path)
+            self.cbs = CbsHandler(self, token_provider, audience, token_provider.token_type)
         self.injector = EventInjector()
         self.container = self._create_container(self.address, **kwargs)
         self.daemon = None
         self.connection = None
-        self.session_policy = None
+        self.session_policy = sessions or SessionPolicy()
         self.clients = []
         self.stopped = False
         log.info("%s: created the event hub client", self.container_id)
@@ -103,7 +132,21 @@ class EventHubClient(object):
         if offset is not None:
             selector = offset.selector()
         handler = ReceiverHandler(self, receiver, source, selector)
-        self.clients.append(handler)
+        self._add_client(handler)
+        return self
+
+    def unsubscribe(self, receiver):
+        """
+        Detaches a L{Receiver} registered with L{subscribe}. The connection and the
+        other senders and receivers keep running.
+
+        @param receiver: the receiver to detach.
+        """
+        for handler in [c for c in self.clients if getattr(c, "receiver", None) is receiver]:
+            if self.daemon is not None and not self.stopped:
+                self.injector.trigger(InjectorEvent(InjectorEvent.REMOVE_CLIENT, handler))
+            else:
+                self._remove_client(handler)
         return self
 
     def publish(self, sender, partition=None):
@@ -119,7 +162,7 @@ class EventHubClient(object):
         if partition:
             target += "/Partitions/" + partition
         handler = sender.handler(self, target)
-        self.clients.append(handler)
+        self._add_client(handler)
         return self
 
     @property
@@ -129,6 +172,26 @@ class EventHubClient(object):
         """
         return self.connection.remote_container if self.connection else None
 
+    def stats(self):
+        """
+        Returns a snapshot of the connection and link counters of this client.
+        The values are read without synchronizing with the reactor thread.
+        """
+        receivers = [c for c in self.clients if isinstance(c, ReceiverHandler)]
+        senders = [c for c in self.clients if isinstance(c, SenderHandler)]
+        return {
+            "container_id": self.container_id,
+            "remote_container": self.remote_container,
+            "connected": self.connection is not None,
+            "receivers": len(receivers),
+            "senders": len(senders),
+            "pending_sends": sum(s.queue.qsize() for s in senders),
+            "inflight_sends": sum(len(s.deliveries) for s in senders),
+            "connection_recovery": self.backoff.stats(),
+            "link_recovery_attempts": sum(c.backoff.total_attempts for c in self.clients),
+            "sessions": self.session_policy.stats()
+        }
+
     def on_reactor_init(self, event):
         """ Handles reactor init event. """
         log.info("%s: on_reactor_init", self.container_id)
@@ -140,16 +203,25 @@ class EventHubClient(object):
             properties["framework"] = "Python %d.%d.%d" % (sys.version_info[0], sys.version_info[1], sys.version_info[2])
             properties["platform"] = sys.platform
             self.connection = self.container.connect(self.address, reconnect=False, properties=properties)
-            self.session_policy = SessionPolicy()
             self.connection.__setattr__("_session_policy", self.session_policy)
+        if self.cbs and not self.cbs.authorized:
+            if self.cbs.sender is None:
+                self.cbs.start()
+            return
         for client in self.clients:
-            client.start()
+            if client.link is None:
+                client.start()
 
     def on_reactor_final(self, event):
         """ Handles reactor final event. """
         log.info("%s: reactor final", self.container_id)
         self.injector.free()
 
+    def on_connection_bound(self, event):
+        """Handles on_connection_bound event."""
+        if event.connection == self.connection and self.session_policy.max_frame_size:
+            event.transport.max_frame_size = self.session_policy.max_frame_size
+
     def on_connection_local_open(self, event):
         """Handles on_connection_local_open event."""
         log.info("%s: connection local open", event.connection.container)
@@ -186,7 +258,7 @@ class EventHubClient(object):
         self._close_clients(condition)
         self._close_session()
         self._close_connection()
-        self.container.schedule(1.0, self)
+        self._schedule_recovery()
 
     def on_session_remote_close(self, event):
         """Handles on_session_remote_close event."""
@@ -203,9 +275,12 @@ class EventHubClient(object):
             log.error("%s, session close %s",
                       self.container_id,
                       self.connection.remote_container)
-        self._close_clients(condition)
-        self._close_session()
-        self.container.schedule(1.0, self)
+        names = self.session_policy.links(event.session)
+        for client in self.clients:
+            if client.name in names:
+                client.stop(condition)
+        self.session_policy.close(event.session)
+        self._schedule_recovery()
 
     def on_transport_closed(self, event):
         """ Handles on_transport_closed event. """
@@ -217,13 +292,29 @@ class EventHubClient(object):
         self._close_clients(event.transport.condition)
         self._close_session()
         self._close_connection()
-        self.on_reactor_init(None)
+        self._schedule_recovery()
 
     def on_timer_task(self, event):
         """ Handles on_timer_task event. """
         if not self.stopped:
             self.on_reactor_init(None)
 
+    def on_cbs_authorized(self):
+        """ Called when the first token is accepted on a new connection. """
+        for client in self.clients:
+            if client.link is None:
+                client.start()
+
+    def on_cbs_failed(self, condition):
+        """ Called when a token is rejected or the CBS links are detached. """
+        if self.stopped or self.connection is None:
+            return
+        log.error("%s: cbs authorization failed %s", self.container_id, condition)
+        self._close_clients(condition)
+        self._close_session()
+        self._close_connection()
+        self._schedule_recovery()
+
     def on_stop_client(self, event):
         """ Handles on_stop_client event. """
         log.info("%s: on_stop_client", self.container_id)
@@ -232,6 +323,21 @@ class EventHubClient(object):
         self._close_session()
         self._close_connection()
 
+    def on_start_client(self, event):
+        """ Attaches a sender or receiver registered while the daemon runs. """
+        self.clients.append(event.subject)
+        if self.stopped or self.connection is None:
+            # attached by the connection recovery
+            return
+        if self.cbs and not self.cbs.authorized:
+            # attached by on_cbs_authorized
+            return
+        event.subject.start()
+
+    def on_remove_client(self, event):
+        """ Detaches a sender or receiver while the daemon runs. """
+        self._remove_client(event.subject)
+
     def on_send(self, event):
         """ Called when messages are available to send for a sender. """
         event.subject.on_sendable(None)
@@ -240,10 +346,15 @@ class EventHubClient(object):
         container = Container(self, **kwargs)
         container.container_id = self.container_id
         container.allow_insecure_mechs = True
-        container.allowed_mechs = 'PLAIN MSCBS'
+        container.allowed_mechs = 'ANONYMOUS MSCBS' if self.cbs or not address.username else 'PLAIN MSCBS'
         container.selectable(self.injector)
         return container
 
+    def _schedule_recovery(self):
+        delay = self.backoff.next()
+        log.info("%s: recovery attempt %d in %.3f seconds", self.container_id, self.backoff.attempts, delay)
+        self.container.schedule(delay, self)
+
     def _close_connection(self):
         if self.connection:
             self.connection.close()
@@ -254,10 +365,121 @@ class EventHubClient(object):
         if self.session_policy:
             self.session_policy.reset()
 
+    def _add_client(self, handler):
+        if self.daemon is not None and not self.stopped:
+            self.injector.trigger(InjectorEvent(InjectorEvent.START_CLIENT, handler))
+        else:
+            self.clients.append(handler)
+
+    def _remove_client(self, handler):
+        if handler in self.clients:
+            self.clients.remove(handler)
+        handler.stop(None)
+        self.session_policy.release(handler.name)
+
     def _close_clients(self, condition):
+        if self.cbs:
+            self.cbs.stop()
         for client in self.clients:
             client.stop(condition)
 
+class ShardedEventHubClient(object):
+    """
+    The L{ShardedEventHubClient} class spreads senders and receivers over a
+    number of L{EventHubClient} shards. Every shard has its own container,
+    connection, session and reactor thread, so AMQP framing for different
+    partitions is not serialized through a single reactor.
+    """
+    def __init__(self, address, shards=2, **kwargs):
+        """
+        Constructs a new L{ShardedEventHubClient}.
+
+        @param address: the full Uri string of the event hub.
+
+        @param shards: the number of connections to spread the entities over.
+
+        @param kwargs: passed to every L{EventHubClient} shard.
+        """
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        sessions = kwargs.pop("sessions", None) or SessionPolicy()
+        self.shards = [EventHubClient(address, sessions=sessions.clone(), **kwargs) for _ in range(shards)]
+        self.assignments = {}
+
+    def shard_for(self, partition):
+        """
+        Returns the L{EventHubClient} shard serving the given partition. A partition
+        is pinned to the least loaded shard the first time it is seen, so the sender
+        and receivers of the same partition share a connection. Entities without a
+        partition always go to the least loaded shard.
+
+        @param partition: the id of the event hub partition, or None.
+        """
+        if partition is not None and partition in self.assignments:
+            return self.shards[self.assignments[partition]]
+        index = min(range(len(self.shards)), key=lambda i: len(self.shards[i].clients))
+        if partition is not None:
+            self.assignments[partition] = index
+        return self.shards[index]
+
+    def subscribe(self, receiver, consumer_group, partition, offset=None):
+        """
+        Registers a L{Receiver} on the shard of the partition. See L{EventHubClient.subscribe}.
+        """
+        self.shard_for(partition).subscribe(receiver, consumer_group, partition, offset)
+        return self
+
+    def unsubscribe(self, receiver):
+        """
+        Detaches a L{Receiver} from its shard. See L{EventHubClient.unsubscribe}.
+        """
+        for shard in self.shards:
+            shard.unsubscribe(receiver)
+        return self
+
+    def publish(self, sender, partition=None):
+        """
+        Registers a L{Sender} on the shard of the partition. See L{EventHubClient.publish}.
+        """
+        self.shard_for(partition).publish(sender, partition)
+        return self
+
+    def run(self):
+        """
+        Run all shards and block until they are stopped.
+        """
+        self.run_daemon()
+        for shard in self.shards:
+            shard.daemon.join()
+
+    def run_daemon(self):
+        """
+        Run every shard in its own daemon thread.
+        """
+        for shard in self.shards:
+            shard.run_daemon()
+        return self
+
+    def stop(self):
+        """
+        Stop all shards.
+        """
+        for shard in self.shards:
+            shard.stop()
+
+    def stats(self):
+        """
+        Returns the L{EventHubClient.stats} of each shard with the shard index and
+        the partitions pinned to it.
+        """
+        result = []
+        for index, shard in enumerate(self.shards):
+            stats = shard.stats()
+            stats["shard"] = index
+            stats["partitions"] = sorted(p for p, i in self.assignments.items() if i == index)
+            result.append(stats)
+        return result
+
 class Entity(object):
     """
     The base class of a L{Sender} or L{Receiver}.
@@ -453,6 +675,68 @@ class Offset(object):
             operator = ">=" if self.inclusive else ">"
             return Selector(u"amqp.annotation.x-opt-offset " + operator + " '" + utf82unicode(self.value) + "'")
 
+class AccessToken(object):
+    """
+    A security token and its expiry in seconds since the epoch.
+    """
+    def __init__(self, token, expires_at):
+        self.token = token
+        self.expires_at = expires_at
+
+class SasTokenProvider(object):
+    """
+    Creates shared access signature tokens from a SAS policy name and key.
+    """
+    token_type = "servicebus.windows.net:sastoken"
+
+    def __init__(self, policy, key, ttl=3600):
+        """
+        @param policy: the name of the shared access policy.
+
+        @param key: the key of the shared access policy.
+
+        @param ttl: the lifetime of a token in seconds.
+        """
+        self.policy = policy
+        self.key = key
+        self.ttl = ttl
+
+    def get_token(self, audience):
+        """
+        Returns a new L{AccessToken} for the audience (resource Uri).
+        """
+        uri = quote_plus(audience)
+        expires_at = int(time.time() + self.ttl)
+        string_to_sign = ("%s\n%d" % (uri, expires_at)).encode("utf-8")
+        signed_hmac_sha256 = hmac.HMAC(self.key.encode("utf-8"), string_to_sign, hashlib.sha256)
+        signature = quote(base64.b64encode(signed_hmac_sha256.digest()))
+        token = "SharedAccessSignature sr=%s&sig=%s&se=%d&skn=%s" % (uri, signature, expires_at, self.policy)
+        return AccessToken(token, expires_at)
+
+class TokenCache(object):
+    """
+    Caches the tokens of a provider by audience and hands out a fresh one once
+    the cached token is within refresh_ahead seconds of its expiry. The cache can
+    be shared by AMQP connections (CBS) and REST calls.
+    """
+    def __init__(self, provider, refresh_ahead=300):
+        self.provider = provider
+        self.refresh_ahead = refresh_ahead
+        self.token_type = provider.token_type
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, audience):
+        """
+        Returns a cached L{AccessToken} for the audience, refreshing it if needed.
+        """
+        with self._lock:
+            token = self._tokens.get(audience)
+            if token is None or token.expires_at - time.time() <= self.refresh_ahead:
+                token = self.provider.get_token(audience)
+                self._tokens[audience] = token
+            return token
+
 class EventHubError(Exception):
     """
     Represents an error happened in the client.
@@ -15,10 +15,11 @@ for general purposes. Keep any service/broker specifics out of this file.
 # pylint: disable=W0702
 
 import logging
+import random
 import time
 import os
 from proton import PN_PYREF, DELEGATED, generate_uuid
-from proton import Delivery, EventBase, Condition
+from proton import Delivery, EventBase, Condition, Message
 from proton.handlers import Handler, EndpointStateHandler
 from proton.handlers import IncomingMessageHandler
 from proton.handlers import CFlowController, OutgoingMessageHandler
@@ -34,6 +35,8 @@ log = logging.getLogger("eventhubs")
 class InjectorEvent(EventBase):
     STOP_CLIENT = EventType("stop_client")
     SEND = EventType("send")
+    START_CLIENT = EventType("start_client")
+    REMOVE_CLIENT = EventType("remove_client")
 
     def __init__(self, event_type, subject=None):
         super(InjectorEvent, self).__init__(PN_PYREF, self, event_type)
@@ -48,11 +51,60 @@ class ReactorEventInjector(EventInjector):
         os.close(self.pipe[0])
         os.close(self.pipe[1])
 
+class BackoffPolicy(object):
+    """
+    Exponential backoff with full jitter. The delay before recovery attempt n
+    is drawn uniformly from [0, min(maximum, initial * multiplier ** n)].
+    """
+    def __init__(self, initial=1.0, maximum=60.0, multiplier=2.0, jitter=True):
+        if initial < 0 or maximum < initial or multiplier < 1.0:
+            raise ValueError("invalid backoff settings")
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        try:
+            ceiling = min(self.maximum, self.initial * self.multiplier ** attempt)
+        except OverflowError:
+            ceiling = self.maximum
+        return random.uniform(0, ceiling) if self.jitter else ceiling
+
+class Backoff(object):
+    """
+    Tracks the recovery attempts of one endpoint against a BackoffPolicy.
+    """
+    def __init__(self, policy):
+        self.policy = policy
+        self.attempts = 0
+        self.total_attempts = 0
+        self.recoveries = 0
+        self.last_delay = 0.0
+
+    def next(self):
+        self.last_delay = self.policy.delay(self.attempts)
+        self.attempts += 1
+        self.total_attempts += 1
+        return self.last_delay
+
+    def reset(self):
+        if self.attempts:
+            self.recoveries += 1
+        self.attempts = 0
+
+    def stats(self):
+        return {"attempts": self.attempts,
+                "total_attempts": self.total_attempts,
+                "recoveries": self.recoveries,
+                "last_delay": self.last_delay}
+
 class ClientHandler(Handler):
     def __init__(self, prefix, client):
         super(ClientHandler, self).__init__()
         self.name = "%s-%s" % (prefix, str(generate_uuid())[:8])
         self.client = client
+        self.backoff = Backoff(client.backoff_policy)
         self.link = None
         self.iteration = 0
         self.fatal_conditions = ["amqp:unauthorized-access", "amqp:not-found"]
@@ -80,6 +132,12 @@ class ClientHandler(Handler):
     def on_link_closed(self, condition):
         pass
 
+    def on_link_attached(self):
+        # A broker may accept the connection and session and then refuse the link, the
+        # connection backoff is only reset once a link is attached so it keeps growing then
+        self.backoff.reset()
+        self.client.backoff.reset()
+
     def on_link_remote_close(self, event):
         link = event.link
         if EndpointStateHandler.is_local_closed(link):
@@ -105,10 +163,10 @@ class ClientHandler(Handler):
             connection.close()
         elif link == self.link:
             self.link = None
-            event.reactor.schedule(1.0, self)
+            event.reactor.schedule(self.backoff.next(), self)
 
     def on_timer_task(self, event):
-        if self.link is None and not self.client.stopped:
+        if self.link is None and not self.client.stopped and self in self.client.clients:
             self.start()
 
 class ReceiverHandler(ClientHandler):
@@ -124,7 +182,7 @@ class ReceiverHandler(ClientHandler):
 
     def on_start(self):
         self.link = self.client.container.create_receiver(
-            self.client.connection,
+            self.client.session_policy.session(self.client.connection, self.name),
             self.source,
             name=self._get_link_name(),
             handler=self,
@@ -145,6 +203,7 @@ class ReceiverHandler(ClientHandler):
                      self.selector.filter_set["selector"].value)
 
     def on_link_remote_open(self, event):
+        self.on_link_attached()
         log.info("%s: link remote open. name=%s source=%s",
                      event.connection.container,
                      event.link.name,
@@ -202,7 +261,7 @@ class SenderHandler(ClientHandler):
 
     def on_start(self):
         self.link = self.client.container.create_sender(
-            self.client.connection,
+            self.client.session_policy.session(self.client.connection, self.name),
             self.target,
             name=self._get_link_name(),
             handler=self)
@@ -224,6 +283,7 @@ class SenderHandler(ClientHandler):
                  self.target)
 
     def on_link_remote_open(self, event):
+        self.on_link_attached()
         log.info("%s: link remote open. name=%s, credit=%d, queue=%d, map=%d",
                  event.connection.container,
                  event.link.name,
@@ -262,18 +322,168 @@ class SenderHandler(ClientHandler):
                 description="Send not complete after %d seconds. ref %s" % (SenderHandler.TIMEOUT, self.client.remote_container)))
         self.on_sendable(None)
 
-class SessionPolicy(object):
-    def __init__(self):
-        self._session = None
+class CbsHandler(Handler):
+    """
+    Authorizes a connection with AMQP claims-based security: tokens are put on the
+    $cbs node before any link is attached and put again ahead of their expiry.
+    """
+    NODE = "$cbs"
+
+    def __init__(self, client, token_provider, audience, token_type):
+        super(CbsHandler, self).__init__()
+        self.client = client
+        self.token_provider = token_provider
+        self.audience = audience
+        self.token_type = token_type
+        self.reply_to = "cbs-" + str(generate_uuid())[:8]
+        self.sender = None
+        self.receiver = None
+        self.pending = None
+        self.inflight = None
+        self.authorized = False
+        self.task = None
+        self.handlers = [CFlowController(10), IncomingMessageHandler(True, self), OutgoingMessageHandler(True, self)]
+
+    def start(self):
+        session = self.client.session_policy.session(self.client.connection)
+        self.sender = self.client.container.create_sender(session, CbsHandler.NODE, handler=self)
+        self.receiver = self.client.container.create_receiver(session, CbsHandler.NODE, target=self.reply_to, handler=self)
+        self.put_token()
+
+    def stop(self):
+        self.authorized = False
+        self.pending = None
+        self.inflight = None
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        for link in (self.sender, self.receiver):
+            if link:
+                link.close()
+                link.free()
+        self.sender = None
+        self.receiver = None
+
+    def put_token(self):
+        token = self.token_provider.get_token(self.audience)
+        self.pending = (str(generate_uuid()), token)
+        self.on_sendable(None)
 
-    def session(self, context):
-        if not self._session:
-            self._session = context.session()
-            self._session.open()
-        return self._session
+    def on_sendable(self, event):
+        if self.pending and self.sender and self.sender.credit:
+            correlation_id, token = self.pending
+            message = Message(body=token.token, reply_to=self.reply_to, correlation_id=correlation_id)
+            message.properties = {"operation": "put-token",
+                                  "type": self.token_type,
+                                  "name": self.audience,
+                                  "expiration": int(token.expires_at)}
+            message.send(self.sender)
+            self.inflight = self.pending
+            self.pending = None
+
+    def on_message(self, event):
+        message = event.message
+        if not self.inflight or message.correlation_id != self.inflight[0]:
+            return
+        token = self.inflight[1]
+        self.inflight = None
+        properties = message.properties or {}
+        status = properties.get("status-code")
+        if status in (200, 202):
+            log.info("%s: cbs token accepted for %s", self.client.container_id, self.audience)
+            delay = max(1.0, token.expires_at - time.time() - self.token_provider.refresh_ahead)
+            self.task = self.client.container.schedule(delay, self)
+            if not self.authorized:
+                self.authorized = True
+                self.client.on_cbs_authorized()
+        else:
+            condition = Condition("amqp:unauthorized-access",
+                                  description="put-token failed %s %s" % (status, properties.get("status-description")))
+            self.client.on_cbs_failed(condition)
+
+    def on_link_remote_close(self, event):
+        if EndpointStateHandler.is_local_closed(event.link):
+            return DELEGATED
+        self.client.on_cbs_failed(event.link.remote_condition)
+
+    def on_timer_task(self, event):
+        self.task = None
+        if self.sender and not self.client.stopped:
+            self.put_token()
+
+class SessionPolicy(object):
+    """
+    Allocates the sessions links are attached on. With links_per_session=0 all
+    links share one session; otherwise a new session is opened for every
+    links_per_session links. A link keeps its session across restarts.
+
+    incoming_capacity is the session incoming buffer in bytes (the advertised
+    incoming window is incoming_capacity / max frame size) and outgoing_window
+    is the outgoing window in transfer frames. max_frame_size is applied to the
+    connection transport because AMQP negotiates it per connection.
+    """
+    def __init__(self, links_per_session=0, incoming_capacity=None, outgoing_window=None, max_frame_size=None):
+        self.links_per_session = links_per_session
+        self.incoming_capacity = incoming_capacity
+        self.outgoing_window = outgoing_window
+        self.max_frame_size = max_frame_size
+        self._sessions = []
+        self._assignments = {}
+
+    def clone(self):
+        return SessionPolicy(self.links_per_session, self.incoming_capacity, self.outgoing_window, self.max_frame_size)
+
+    def session(self, context, name=None):
+        if name in self._assignments:
+            entry = self._sessions[self._assignments[name]]
+        elif self.links_per_session <= 0 or name is None:
+            entry = self._sessions[0] if self._sessions else self._open(context)
+        else:
+            candidates = [e for e in self._sessions if len(e[1]) < self.links_per_session]
+            entry = candidates[0] if candidates else self._open(context)
+        if name is not None:
+            entry[1].add(name)
+            self._assignments[name] = self._sessions.index(entry)
+        return entry[0]
+
+    def release(self, name):
+        if name in self._assignments:
+            self._sessions[self._assignments.pop(name)][1].discard(name)
+
+    def links(self, session):
+        for entry in self._sessions:
+            if entry[0] == session:
+                return set(entry[1])
+        return set()
+
+    def close(self, session):
+        for entry in self._sessions:
+            if entry[0] == session:
+                entry[0].close()
+                entry[0].free()
+                self._sessions.remove(entry)
+                self._assignments = dict((n, self._sessions.index(e)) for e in self._sessions for n in e[1])
+                return
 
     def reset(self):
-        if self._session:
-            self._session.close()
-            self._session.free()
-            self._session = None
+        for entry in self._sessions:
+            entry[0].close()
+            entry[0].free()
+        self._sessions = []
+        self._assignments = {}
+
+    def stats(self):
+        return [{"links": sorted(entry[1]),
+                 "incoming_capacity": entry[0].incoming_capacity,
+                 "outgoing_window": entry[0].outgoing_window} for entry in self._sessions]
+
+    def _open(self, context):
+        session = context.session()
+        if self.incoming_capacity is not None:
+            session.incoming_capacity = self.incoming_capacity
+        if self.outgoing_window is not None:
+            session.outgoing_window = self.outgoing_window
+        session.open()
+        entry = (session, set())
+        self._sessions.append(entry)
+        return entry
@@ -91,7 +91,12 @@ class AsyncReceiver(Receiver):
                 return
             waiter = self.waiter
             self.waiter = None
-        self.loop.call_soon_threadsafe(waiter.set_result, None)
+        self.loop.call_soon_threadsafe(self._wake, waiter)
+
+    def _wake(self, waiter):
+        # The waiter is cancelled when a receive timed out, the events stay queued
+        if not waiter.done():
+            waiter.set_result(None)
 
     def on_event_data(self, event_data):
         pass
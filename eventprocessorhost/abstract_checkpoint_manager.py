@@ -58,3 +58,11 @@ class AbstractCheckpointManager(ABC):
         for the given partition, that is treated as success.
         """
         pass
+
+    async def flush_async(self, partition_id=None):
+        """
+        Writes checkpoints held back by the manager to the store, those of the given
+        partition or of all partitions. Called when a pump closes and when the host
+        shuts down. Managers that write every checkpoint immediately have nothing to do.
+        """
+        pass
@@ -0,0 +1,32 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+from abc import ABC, abstractmethod
+
+class AbstractLeaseBalancer(ABC):
+    """
+    Decides which leases a host takes from others in each pass of the partition manager
+    run loop. Set an instance as EPHOptions.lease_balancer to change how fast the hosts
+    converge to an even distribution.
+    """
+
+    @abstractmethod
+    def leases_to_steal(self, host_name, stealable_leases, have_lease_count):
+        """
+        Chooses the leases to acquire from the leases this host does not hold.
+        stealable_leases may contain expired or unowned leases whose acquisition
+        failed earlier in the pass.
+        (Returns) list of leases to acquire, empty if the distribution is good enough
+        """
+        pass
+
+    def choose_leases(self, host_name, stealable_leases, own_leases):
+        """
+        Called by the partition manager with the leases this host holds, their load is
+        the current load of the partitions. Balancers that only count leases implement
+        leases_to_steal.
+        (Returns) list of leases to acquire, empty if the distribution is good enough
+        """
+        return self.leases_to_steal(host_name, stealable_leases, len(own_leases))
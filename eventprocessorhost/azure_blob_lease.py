@@ -18,6 +18,7 @@ class AzureBlobLease(Lease):
         super()
         Lease.__init__(self)
         self.offset = None
+        self.etag = None
         self.state = lambda: None
 
     def serializable(self):
@@ -26,6 +27,7 @@ class AzureBlobLease(Lease):
         """
         serial = self.__dict__.copy()
         del serial['state']
+        del serial['etag']
         return serial
 
     def with_lease(self, lease):
@@ -45,6 +47,33 @@ class AzureBlobLease(Lease):
         self.epoch = content["epoch"]
         self.offset = content["offset"]
         self.sequence_number = content["sequence_number"]
+        self.load = content.get("load", 0)
+        self.etag = blob.properties.etag
+        self.with_lease_state(blob.properties.lease.state)
+
+    def with_listing(self, blob):
+        """
+        Init Azure Blob Lease from a list_blobs entry without reading the blob content.
+        Owner, epoch and load come from the blob metadata, the token and offset stay unset.
+        """
+        self.partition_id = blob.name
+        self.owner = blob.metadata.get("owner") or None
+        self.epoch = int(blob.metadata["epoch"])
+        self.load = float(blob.metadata.get("load") or 0)
+        self.etag = blob.properties.etag
+        self.with_lease_state(blob.properties.lease.state)
+
+    def with_lease_state(self, lease_state):
+        """
+        Cache the blob lease state read from the store so is_expired needs no request
+        """
+        self.state = lambda: lease_state
+
+    def metadata(self):
+        """
+        Returns the blob metadata that lets a lease scan read owner, epoch and load from a listing
+        """
+        return {"owner": self.owner or "", "epoch": str(self.epoch), "load": str(self.load)}
 
     def with_source(self, lease):
         """
@@ -53,10 +82,11 @@ class AzureBlobLease(Lease):
         super().with_source(lease)
         self.offset = lease.offset
         self.sequence_number = lease.sequence_number
+        self.etag = lease.etag
 
     def is_expired(self):
         """
-        Check and return azure blob lease state using storage api
+        Check and return azure blob lease state as of the last read from the store
         """
         current_state = self.state()
         if current_state:
@@ -7,8 +7,9 @@ import re
 import json
 import uuid
 import logging
-import requests
-from azure.storage.blob import BlockBlobService
+import asyncio
+import functools
+import concurrent.futures
 from eventprocessorhost.azure_blob_lease import AzureBlobLease
 from eventprocessorhost.checkpoint import Checkpoint
 from eventprocessorhost.abstract_lease_manager import AbstractLeaseManager
@@ -32,8 +33,10 @@ class AzureStorageCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeas
         self.consumer_group_directory = None
         self.host = None
         self.storage_max_execution_time = 120
-        self.request_session = requests.Session()
-        self.request_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=100, pool_maxsize=100))
+        self.storage_max_workers = 32
+        self.storage_executor = None
+        self.request_session = None
+        self.owned_lease_tokens = {}
 
         # Validate storage inputs
         if not self.storage_account_name or not self.storage_account_key:
@@ -54,12 +57,30 @@ class AzureStorageCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeas
         constructor because it is still being constructed. Do other initialization here
         also because it might throw and hence we don't want it in the constructor.
         """
+        # requests and the storage SDK are slow to import, load them on first use
+        import requests
+        from azure.storage.blob import BlockBlobService
         self.host = host
+        self.request_session = requests.Session()
+        self.request_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=100, pool_maxsize=100))
         self.storage_client = BlockBlobService(account_name=self.storage_account_name,
                                                account_key=self.storage_account_key,
                                                request_session=self.request_session)
+        self.storage_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.storage_max_workers)
         self.consumer_group_directory = self.storage_blob_prefix + self.host.eh_config.consumer_group
 
+    async def run_storage_operation_async(self, func, *args, **kwargs):
+        """
+        The storage SDK is synchronous. Runs one of its calls on the storage executor so
+        the calling event loop (host or pump) keeps running, and raises asyncio.TimeoutError
+        if the call takes longer than storage_max_execution_time seconds.
+        (Returns) the result of the call
+        """
+        loop = asyncio.get_event_loop()
+        operation = loop.run_in_executor(self.storage_executor,
+                                         functools.partial(func, *args, **kwargs))
+        return await asyncio.wait_for(operation, self.storage_max_execution_time)
+
     # Checkpoint Managment Methods
 
     async def create_checkpoint_store_if_not_exists_async(self):
@@ -105,7 +126,10 @@ class AzureStorageCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeas
         new_lease.with_source(lease)
         new_lease.offset = checkpoint.offset
         new_lease.sequence_number = checkpoint.sequence_number
-        await self.update_lease_async(new_lease)
+        updated = await self.update_lease_async(new_lease)
+        # The next conditional write of this lease must match the blob just written
+        lease.etag = new_lease.etag
+        return updated
 
     async def delete_checkpoint_async(self, partition_id):
         """
@@ -122,7 +146,8 @@ class AzureStorageCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeas
         (Returns) true if the lease store already exists or was created successfully, false if not
         """
         try:
-            self.storage_client.create_container(self.lease_container_name)
+            await self.run_storage_operation_async(self.storage_client.create_container,
+                                                   self.lease_container_name)
 
         except Exception as err:
             logging.error(repr(err))
@@ -144,20 +169,10 @@ class AzureStorageCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeas
         (Returns) lease info for the partition, or null
         """
         try:
-            blob = self.storage_client.get_blob_to_text(self.lease_container_name, partition_id)
+            blob = await self.run_storage_operation_async(self.storage_client.get_blob_to_text,
+                                                          self.lease_container_name, partition_id)
             lease = AzureBlobLease()
             lease.with_blob(blob)
-            def state():
-                """
-                Allow lease to curry storage_client to get state
-                """
-                try:
-                    return self.storage_client.get_blob_properties(self.lease_container_name,
-                                                                   partition_id).properties.lease.state
-                except Exception as err:
-                    logging.error("Failed to get lease state %s %s", err, partition_id)
-
-            lease.state = state
             return lease
         except Exception as err:
             logging.error("Failed to get lease %s %s", err, partition_id)
@@ -165,14 +180,41 @@ class AzureStorageCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeas
     async def get_all_leases(self):
         """
         Return the lease info for all partitions.
-        A typical implementation could just call get_lease_async() on all partitions.
+        Reads the lease state, owner and epoch of every lease blob with a single listing.
+        Blob content is only read for leases this host owns but has no token for, and for
+        lease blobs written before owner and epoch were kept in the metadata.
         (Returns) list of lease info.
         """
-        lease_futures = []
         partition_ids = await self.host.partition_manager.get_partition_ids_async()
-        for partition_id in partition_ids:
-            lease_futures.append(self.get_lease_async(partition_id))
-        return lease_futures
+        listed = {}
+        try:
+            blobs = await self.run_storage_operation_async(self.list_lease_blobs)
+            listed = dict((blob.name, blob) for blob in blobs)
+        except Exception as err:
+            logging.error("Failed to list leases %s", repr(err))
+        return [self.get_listed_lease_async(partition_id, listed.get(partition_id))
+                for partition_id in partition_ids]
+
+    def list_lease_blobs(self):
+        """
+        Lists the lease blobs with their metadata, following continuation markers
+        """
+        return list(self.storage_client.list_blobs(self.lease_container_name, include="metadata"))
+
+    async def get_listed_lease_async(self, partition_id, blob):
+        """
+        Builds the lease for a partition from its listing entry.
+        (Returns) lease info for the partition, or null
+        """
+        if blob is None or "epoch" not in (blob.metadata or {}):
+            return await self.get_lease_async(partition_id)
+        lease = AzureBlobLease()
+        lease.with_listing(blob)
+        if lease.owner == self.host.host_name:
+            lease.token = self.owned_lease_tokens.get(partition_id)
+            if not lease.token:
+                return await self.get_lease_async(partition_id)
+        return lease
 
     async def create_lease_if_not_exists_async(self, partition_id):
         """
@@ -187,8 +229,10 @@ class AzureStorageCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeas
             json_lease = json.dumps(return_lease.serializable())
             logging.info("Creating Lease %s %s %s", self.lease_container_name,
                          partition_id, json_lease)
-            self.storage_client.create_blob_from_text(self.lease_container_name,
-                                                      partition_id, json_lease)
+            await self.run_storage_operation_async(self.storage_client.create_blob_from_text,
+                                                   self.lease_container_name,
+                                                   partition_id, json_lease,
+                                                   metadata=return_lease.metadata())
         except Exception:
             try:
                 return_lease = await self.get_lease_async(partition_id)
@@ -202,8 +246,10 @@ class AzureStorageCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeas
         Delete the lease info for the given partition from the store.
         If there is no stored lease for the given partition, that is treated as success.
         """
-        self.storage_client.delete_blob(self.lease_container_name, lease.partition_id,
-                                        lease_id=lease.token)
+        await self.run_storage_operation_async(self.storage_client.delete_blob,
+                                               self.lease_container_name, lease.partition_id,
+                                               lease_id=lease.token)
+        self.owned_lease_tokens.pop(lease.partition_id, None)
 
     async def acquire_lease_async(self, lease):
         """
@@ -212,44 +258,50 @@ class AzureStorageCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeas
         Lease-stealing is how partitions are redistributed when additional hosts are started.
         (Returns) true if the lease was acquired successfully, false if not
         """
-        retval = True
         new_lease_id = str(uuid.uuid4())
         partition_id = lease.partition_id
         try:
+            # The scan may not have read the content, the token and offset are needed to
+            # take over the lease, this also refreshes the lease state read by the scan
+            scanned_owner, scanned_epoch = lease.owner, lease.epoch
+            blob = await self.run_storage_operation_async(self.storage_client.get_blob_to_text,
+                                                          self.lease_container_name, partition_id)
+            lease.with_blob(blob)
             if lease.state() == "leased":
-                if not lease.token:
-                    # We reach here in a race condition: when this instance of EventProcessorHost
-                    # scanned the lease blobs, this partition was unowned (token is empty) but
-                    # between then and now, another instance of EPH has established a lease
-                    # (getLeaseState() is LEASED). We normally enforcethat we only steal the lease
-                    # if it is still owned by the instance which owned it when we scanned, but we
-                    # can't do that when we don't know who owns it. The safest thing to do is just
+                if not lease.token or (lease.owner, lease.epoch) != (scanned_owner, scanned_epoch):
+                    # We reach here in a race condition: between the scan and now, another
+                    # instance of EPH has established or stolen the lease, which increments the
+                    # epoch. We only steal the lease if it is still owned by the instance which
+                    # owned it when we scanned, otherwise two hosts stealing one after the other
+                    # would pass the partition back and forth. The safest thing to do is just
                     # fail the acquisition. If that means that one EPH instance gets more partitions
                     # than it should, rebalancing will take care of that quickly enough.
-                    retval = False
+                    logging.info("Lease %s changed owner since it was scanned", partition_id)
+                    return False
                 else:
                     logging.info("ChangingLease %s %s", self.host.guid, lease.partition_id)
-                    self.storage_client.change_blob_lease(self.lease_container_name,
-                                                          partition_id, lease.token,
-                                                          new_lease_id)
+                    await self.run_storage_operation_async(self.storage_client.change_blob_lease,
+                                                           self.lease_container_name,
+                                                           partition_id, lease.token,
+                                                           new_lease_id)
                     lease.token = new_lease_id
             else:
                 logging.info("AcquiringLease %s %s", self.host.guid, lease.partition_id)
-                lease.token = self.storage_client.acquire_blob_lease(self.lease_container_name,
-                                                                     partition_id,
-                                                                     self.lease_duration,
-                                                                     new_lease_id)
+                lease.token = await self.run_storage_operation_async(
+                    self.storage_client.acquire_blob_lease, self.lease_container_name,
+                    partition_id, self.lease_duration, new_lease_id)
             lease.owner = self.host.host_name
             lease.increment_epoch()
             #check if this solves the issue
             await self.update_lease_async(lease)
+            self.owned_lease_tokens[partition_id] = lease.token
         except Exception as err:
             logging.error("Failed to acquire lease %s %s %s", repr(err),
                           partition_id, lease.token)
             return False
         
 
-        return retval
+        return True
 
     async def renew_lease_async(self, lease):
         """
@@ -259,40 +311,54 @@ class AzureStorageCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeas
         (Returns) true if the lease was renewed successfully, false if not
         """
         try:
-            self.storage_client.renew_blob_lease(self.lease_container_name,
-                                                 lease.partition_id,
-                                                 lease_id=lease.token,
-                                                 timeout=self.lease_duration)
+            await self.run_storage_operation_async(self.storage_client.renew_blob_lease,
+                                                   self.lease_container_name,
+                                                   lease.partition_id,
+                                                   lease_id=lease.token,
+                                                   timeout=self.lease_duration)
         except Exception as err:
             if "LeaseIdMismatchWithLeaseOperation" in str(err):
                 logging.info("LeaseLost")
+                self.owned_lease_tokens.pop(lease.partition_id, None)
             else:
                 logging.error("Failed to renew lease on partition %s with token %s %s",
                               lease.partition_id, lease.token, repr(err))
             return False
+        # A restarted host renews the leases it held with the token stored in the blob
+        self.owned_lease_tokens[lease.partition_id] = lease.token
         return True
 
     async def release_lease_async(self, lease):
         """
         Give up a lease currently held by this host. If the lease has been stolen, or expired,
-        releasing it is unnecessary, and will fail if attempted.
+        releasing it is unnecessary, and will fail if attempted. The stored lease is read
+        back first, only its owner, token and load are cleared so the checkpoint is kept.
         (Returns) true if the lease was released successfully, false if not
         """
+        lease_id = lease.token
         try:
             logging.info("Releasing lease %s %s", self.host.guid, lease.partition_id)
-            lease_id = lease.token
+            # The lease may come from a listing, or be older than the last checkpoint
+            blob = await self.run_storage_operation_async(self.storage_client.get_blob_to_text,
+                                                          self.lease_container_name,
+                                                          lease.partition_id)
             released_copy = AzureBlobLease()
-            released_copy.with_lease(lease)
+            released_copy.with_blob(blob)
             released_copy.token = None
             released_copy.owner = None
+            released_copy.load = 0
             released_copy.state = None
-            self.storage_client.create_blob_from_text(self.lease_container_name,
-                                                      lease.partition_id,
-                                                      json.dumps(released_copy.serializable()),
-                                                      lease_id=lease_id)
-            self.storage_client.release_blob_lease(self.lease_container_name,
+            await self.run_storage_operation_async(self.storage_client.create_blob_from_text,
+                                                   self.lease_container_name,
+                                                   lease.partition_id,
+                                                   json.dumps(released_copy.serializable()),
+                                                   metadata=released_copy.metadata(),
+                                                   lease_id=lease_id)
+            await self.run_storage_operation_async(self.storage_client.release_blob_lease,
+                                                   self.lease_container_name,
                                                    lease.partition_id,
                                                    lease_id)
+            self.owned_lease_tokens.pop(lease.partition_id, None)
         except Exception as err:
             logging.error("Failed to release lease %s %s %s",
                           repr(err), lease.partition_id, lease_id)
@@ -304,8 +370,8 @@ class AzureStorageCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeas
         """
         Update the store with the information in the provided lease. It is necessary to currently
         hold a lease in order to update it. If the lease has been stolen, or expired, or released,
-        it cannot be updated. Updating should renew the lease before performing the update to
-        avoid lease expiration during the process.
+        it cannot be updated. The write is conditional on the lease id, which verifies ownership,
+        and on the ETag the lease was read or last written with, so it takes a single request.
         (Returns) true if the updated was performed successfully, false if not.
         """
         if lease is None:
@@ -316,18 +382,33 @@ class AzureStorageCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeas
 
         logging.debug("Updating lease %s %s", self.host.guid, lease.partition_id)
 
-        # First, renew the lease to make sure the update will go through.
-        if await self.renew_lease_async(lease):
+        for attempt in range(2):
             try:
-                self.storage_client.create_blob_from_text(self.lease_container_name,
-                                                          lease.partition_id,
-                                                          json.dumps(lease.serializable()),
-                                                          lease_id=lease.token)
-
+                properties = await self.run_storage_operation_async(
+                    self.storage_client.create_blob_from_text,
+                    self.lease_container_name,
+                    lease.partition_id,
+                    json.dumps(lease.serializable()),
+                    metadata=lease.metadata(),
+                    lease_id=lease.token,
+                    if_match=lease.etag)
+                lease.etag = properties.etag
+                return True
             except Exception as err:
-                logging.error("Failed to update lease %s %s %s", self.host.guid,
-                              lease.partition_id, repr(err))
-                raise err
-        else:
-            return False
-        return True
+                if "ConditionNotMet" in str(err) and attempt == 0:
+                    # The lease was read before a write of ours, refresh the ETag once
+                    logging.info("Stale ETag for lease %s %s", self.host.guid, lease.partition_id)
+                    blob = await self.run_storage_operation_async(
+                        self.storage_client.get_blob_properties,
+                        self.lease_container_name, lease.partition_id)
+                    lease.etag = blob.properties.etag
+                elif "LeaseIdMismatch" in str(err) or "LeaseLost" in str(err) \
+                     or "LeaseNotPresent" in str(err):
+                    logging.info("LeaseLost %s %s", self.host.guid, lease.partition_id)
+                    self.owned_lease_tokens.pop(lease.partition_id, None)
+                    return False
+                else:
+                    logging.error("Failed to update lease %s %s %s", self.host.guid,
+                                  lease.partition_id, repr(err))
+                    raise err
+        return False
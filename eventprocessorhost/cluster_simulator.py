@@ -0,0 +1,324 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+"""
+Runs a cluster of EventProcessorHost instances in one process against an in-memory
+lease store and a fake partition source, to evaluate lease balancing and renewal
+settings without storage accounts or an event hub. Example, 4 hosts on 32 partitions,
+two more join after 10 s and one crashes after 25 s:
+
+  python -m eventprocessorhost.cluster_simulator --hosts 4 --partitions 32 \\
+      --lease-renew-interval 1 --lease-duration 3 --join 10:2 --crash 25:1 --duration 40
+
+The report (JSON) contains the time to balanced ownership after every membership
+change, the processing gaps of each partition during handoffs and the store
+operations per second issued by each host.
+"""
+
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from eventprocessorhost.abstract_event_processor import AbstractEventProcessor
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryCheckpointLeaseManager
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryLeaseStore
+from eventprocessorhost.partition_manager import PartitionManager
+from eventprocessorhost.partition_pump import PartitionPump
+from eventprocessorhost.eph import EventProcessorHost, EPHOptions
+from eventprocessorhost.lease_balancer import ConservativeLeaseBalancer, FastLeaseBalancer
+from eventprocessorhost.lease_balancer import LoadAwareLeaseBalancer
+
+BALANCERS = {"conservative": ConservativeLeaseBalancer, "fast": FastLeaseBalancer,
+             "load": LoadAwareLeaseBalancer}
+
+class SimulatedConfig:
+    """
+    Stands in for EventHubConfig, the simulated pumps never connect.
+    """
+    def __init__(self, consumer_group="$default"):
+        self.consumer_group = consumer_group
+        self.client_address = "simulated"
+
+class SimulatedEvent:
+    """
+    Minimal event with the attributes PartitionContext reads.
+    """
+    def __init__(self, sequence_number):
+        self.sequence_number = sequence_number
+        self.offset = str(sequence_number)
+
+class SimulatedEventProcessor(AbstractEventProcessor):
+    """
+    Checkpoints every few batches like a typical processor.
+    """
+    def __init__(self, params=None):
+        self.simulator = params
+        self.batches = 0
+
+    async def open_async(self, context):
+        pass
+
+    async def close_async(self, context, reason):
+        pass
+
+    async def process_events_async(self, context, messages):
+        self.batches += 1
+        if self.batches % self.simulator.checkpoint_every == 0:
+            await context.checkpoint_async()
+
+    async def process_error_async(self, context, error):
+        logging.error("Simulated processor error %s %s", context.partition_id, repr(error))
+
+class SimulatedPartitionPump(PartitionPump):
+    """
+    Produces one event per event_interval until the pump is closed and records
+    when the partition was being processed.
+    """
+    def __init__(self, host, lease, simulator):
+        PartitionPump.__init__(self, host, lease)
+        self.simulator = simulator
+
+    async def on_open_async(self):
+        await self.partition_context.get_initial_offset_async()
+        sequence_number = max(0, int(self.partition_context.sequence_number or 0))
+        self.set_pump_status("Running")
+        self.simulator.pump_started(self.lease.partition_id, self.host.host_name)
+        while not self.is_closing():
+            await asyncio.sleep(self.simulator.event_interval)
+            sequence_number += 1
+            await self.process_events_async([SimulatedEvent(sequence_number)])
+
+    async def on_closing_async(self, reason):
+        self.simulator.pump_stopped(self.lease.partition_id, self.host.host_name)
+
+class SimulatedPartitionManager(PartitionManager):
+    """
+    PartitionManager with a fixed partition list and simulated pumps.
+    """
+    def __init__(self, host, simulator):
+        PartitionManager.__init__(self, host)
+        self.simulator = simulator
+
+    async def get_partition_ids_async(self):
+        return self.simulator.partition_ids
+
+    def create_pump(self, lease):
+        return SimulatedPartitionPump(self.host, lease, self.simulator)
+
+class ClusterSimulator:
+    """
+    Starts, crashes and observes simulated hosts that share one lease store.
+    """
+    def __init__(self, partition_count=32, lease_renew_interval=1, lease_duration=3,
+                 event_interval=0.1, checkpoint_every=10, loop=None, lease_balancer=None,
+                 pump_mode="thread"):
+        self.partition_ids = [str(p) for p in range(partition_count)]
+        self.lease_renew_interval = lease_renew_interval
+        self.lease_duration = lease_duration
+        self.event_interval = event_interval
+        self.checkpoint_every = checkpoint_every
+        self.lease_balancer = lease_balancer or ConservativeLeaseBalancer()
+        self.pump_mode = pump_mode
+        self.loop = loop or asyncio.get_event_loop()
+        self.store = InMemoryLeaseStore()
+        self.hosts = {}
+        self.lifetimes = {}
+        self.intervals = dict((p, []) for p in self.partition_ids)
+        self.balance_times = []
+        self.lock = threading.Lock()
+        self.started = None
+
+    def pump_started(self, partition_id, host_name):
+        """
+        Records that a host started processing a partition.
+        """
+        with self.lock:
+            self.intervals[partition_id].append([host_name, time.time(), None])
+
+    def pump_stopped(self, partition_id, host_name):
+        """
+        Records that a host stopped processing a partition.
+        """
+        with self.lock:
+            for interval in self.intervals[partition_id]:
+                if interval[0] == host_name and interval[2] is None:
+                    interval[2] = time.time()
+
+    def add_host(self):
+        """
+        Starts a new host and returns its name.
+        """
+        manager = InMemoryCheckpointLeaseManager(self.store, self.lease_renew_interval,
+                                                 self.lease_duration)
+        eph_options = EPHOptions()
+        eph_options.lease_balancer = self.lease_balancer
+        eph_options.pump_mode = self.pump_mode
+        # There is no runtime info to read for simulated partitions
+        eph_options.runtime_info_interval = None
+        host = EventProcessorHost(SimulatedEventProcessor, SimulatedConfig(), manager,
+                                  ep_params=self, eph_options=eph_options, loop=self.loop)
+        host.partition_manager = SimulatedPartitionManager(host, self)
+        self.hosts[host.host_name] = (host, self.loop.create_task(host.open_async()))
+        self.lifetimes[host.host_name] = [time.time(), None]
+        logging.info("Simulated host joined %s", host.host_name)
+        return host.host_name
+
+    def crash_host(self, host_name=None):
+        """
+        Stops a host without closing its processors or releasing its leases.
+        """
+        host_name = host_name or sorted(self.hosts)[0]
+        host, task = self.hosts.pop(host_name)
+        for partition_id, pump in list(host.partition_manager.partition_pumps.items()):
+            pump.set_pump_status("Closed")
+            self.pump_stopped(partition_id, host_name)
+        host.partition_manager.cancellation_token.cancel()
+        for pump in host.partition_manager.partition_pumps.values():
+            if pump.run_task:
+                pump.run_task.cancel()
+        task.cancel()
+        self.lifetimes[host_name][1] = time.time()
+        logging.info("Simulated host crashed %s", host_name)
+        return host_name
+
+    def ownership(self):
+        """
+        Returns the number of unexpired leases held by each running host and the
+        number of partitions without such a lease.
+        """
+        counts = dict((name, 0) for name in self.hosts)
+        unowned = 0
+        with self.store.lock:
+            for partition_id in self.partition_ids:
+                lease = self.store.leases.get(partition_id)
+                if lease and not lease.is_expired() and lease.owner in counts:
+                    counts[lease.owner] += 1
+                else:
+                    unowned += 1
+        return counts, unowned
+
+    def is_balanced(self):
+        """
+        Every partition is owned by a running host and the counts differ by at most one.
+        """
+        counts, unowned = self.ownership()
+        return bool(counts) and unowned == 0 and max(counts.values()) - min(counts.values()) <= 1
+
+    async def wait_balanced_async(self, timeout):
+        """
+        Waits until ownership is balanced. Returns the seconds it took, or None on timeout.
+        """
+        start = time.time()
+        while time.time() - start < timeout:
+            if self.is_balanced():
+                return time.time() - start
+            await asyncio.sleep(0.05)
+        return None
+
+    async def run_async(self, hosts, duration, events=None):
+        """
+        Starts the initial hosts, applies the membership events [(at_seconds, action, count)]
+        with action "join" or "crash" and returns the report after duration seconds.
+        """
+        self.started = time.time()
+        schedule = [(0.0, "join", hosts)] + sorted(events or [])
+        for index, (at_seconds, action, count) in enumerate(schedule):
+            await asyncio.sleep(max(0.0, self.started + at_seconds - time.time()))
+            for _ in range(count):
+                self.add_host() if action == "join" else self.crash_host()
+            if index + 1 < len(schedule):
+                deadline = schedule[index + 1][0]
+            else:
+                deadline = duration
+            took = await self.wait_balanced_async(self.started + deadline - time.time())
+            self.balance_times.append({"at": at_seconds, "action": action, "count": count,
+                                       "seconds_to_balance": None if took is None else round(took, 3)})
+        await asyncio.sleep(max(0.0, self.started + duration - time.time()))
+        report = self.report()
+        tasks = [task for _, task in self.hosts.values()]
+        for host_name in list(self.hosts):
+            self.crash_host(host_name)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return report
+
+    def report(self):
+        """
+        Summarizes balancing, handoff gaps and store load.
+        """
+        now = time.time()
+        gaps = {}
+        with self.lock:
+            for partition_id, intervals in self.intervals.items():
+                ordered = sorted(intervals, key=lambda i: i[1])
+                covered_until = None
+                partition_gaps = []
+                for _, start, end in ordered:
+                    if covered_until is not None and start > covered_until:
+                        partition_gaps.append(start - covered_until)
+                    end = end or now
+                    covered_until = end if covered_until is None else max(covered_until, end)
+                gaps[partition_id] = partition_gaps
+        all_gaps = [g for pg in gaps.values() for g in pg]
+        operations = {}
+        for host_name, (joined, left) in self.lifetimes.items():
+            alive = max(1e-9, (left or now) - joined)
+            operations[host_name] = round(self.store.operations[host_name] / alive, 2)
+        counts, unowned = self.ownership()
+        return {
+            "partitions": len(self.partition_ids),
+            "lease_renew_interval": self.lease_renew_interval,
+            "lease_duration": self.lease_duration,
+            "lease_balancer": type(self.lease_balancer).__name__,
+            "pump_mode": self.pump_mode,
+            "membership_changes": self.balance_times,
+            "handoffs": len(all_gaps),
+            "max_partition_downtime": round(max(all_gaps), 3) if all_gaps else 0.0,
+            "mean_partition_downtime": round(sum(all_gaps) / len(all_gaps), 3) if all_gaps else 0.0,
+            "partition_downtime": dict((p, [round(g, 3) for g in pg]) for p, pg in gaps.items() if pg),
+            "store_operations_per_second": operations,
+            "final_ownership": counts,
+            "final_unowned": unowned
+        }
+
+def parse_event(action):
+    """
+    Parses "<seconds>:<count>" into an event tuple for the given action.
+    """
+    def parse(value):
+        at_seconds, count = value.split(":")
+        return (float(at_seconds), action, int(count))
+    return parse
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hosts", help="Hosts started at the beginning", type=int, default=2)
+    parser.add_argument("--partitions", help="Number of partitions", type=int, default=32)
+    parser.add_argument("--lease-renew-interval", type=float, default=1.0)
+    parser.add_argument("--lease-duration", type=float, default=3.0)
+    parser.add_argument("--event-interval", help="Seconds between simulated events", type=float, default=0.1)
+    parser.add_argument("--checkpoint-every", help="Checkpoint every N batches", type=int, default=10)
+    parser.add_argument("--join", help="<seconds>:<count> hosts joining", type=parse_event("join"),
+                        action="append", default=[])
+    parser.add_argument("--crash", help="<seconds>:<count> hosts crashing", type=parse_event("crash"),
+                        action="append", default=[])
+    parser.add_argument("--duration", help="Seconds to simulate", type=float, default=30.0)
+    parser.add_argument("--balancer", help="Lease balancing strategy", choices=sorted(BALANCERS),
+                        default="conservative")
+    parser.add_argument("--pump-mode", help="Run pumps in threads or on the host loop",
+                        choices=["thread", "loop"], default="thread")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    loop = asyncio.get_event_loop()
+    simulator = ClusterSimulator(args.partitions, args.lease_renew_interval, args.lease_duration,
+                                 args.event_interval, args.checkpoint_every, loop,
+                                 BALANCERS[args.balancer](), args.pump_mode)
+    report = loop.run_until_complete(simulator.run_async(args.hosts, args.duration,
+                                                         args.join + args.crash))
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,7 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # -----------------------------------------------------------------------------------
 
-import time
 import urllib
-import hmac
-import hashlib
-import base64
 
 class EventHubConfig:
     """
@@ -21,8 +17,24 @@ class EventHubConfig:
         self.policy = policy
         self.sas_key = sas_key
         self.consumer_group = consumer_group
+        from eventhubs import SasTokenProvider, TokenCache # loads proton, keep off module import
+        self.token_cache = TokenCache(SasTokenProvider(self.policy, self.sas_key))
         self.client_address = self.get_client_address()
-        self.rest_token = self.get_rest_token()
+        self.cbs_address = "amqps://{}.servicebus.windows.net:5671/{}".format(self.sb_name,
+                                                                              self.eh_name)
+
+    def __getstate__(self):
+        """
+        The token cache holds a lock, process pump workers build their own
+        """
+        state = self.__dict__.copy()
+        del state["token_cache"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        from eventhubs import SasTokenProvider, TokenCache
+        self.token_cache = TokenCache(SasTokenProvider(self.policy, self.sas_key))
 
     def get_client_address(self):
         """
@@ -34,14 +46,16 @@ class EventHubConfig:
 
     def get_rest_token(self):
         """
-        Returns an auth token for making calls to eventhub REST API.
-        """
-        uri = urllib.parse.quote_plus("https://{}.servicebus.windows.net/{}" \
-                                    .format(self.sb_name, self.eh_name))
-        sas = self.sas_key.encode('utf-8')
-        expiry = str(int(time.time() + 10000))
-        string_to_sign = ('{}\n{}'.format(uri,expiry)).encode('utf-8')
-        signed_hmac_sha256 = hmac.HMAC(sas, string_to_sign, hashlib.sha256)
-        signature = urllib.parse.quote(base64.b64encode(signed_hmac_sha256.digest()))
-        return 'SharedAccessSignature sr={}&sig={}&se={}&skn={}' \
-                .format(uri, signature, expiry, self.policy)
+        Returns an auth token for making calls to eventhub REST API. The token
+        comes from the token cache shared with the AMQP connections and is
+        renewed ahead of its expiry.
+        """
+        return self.token_cache.get_token("https://{}.servicebus.windows.net/{}" \
+                                          .format(self.sb_name, self.eh_name)).token
+
+    @property
+    def rest_token(self):
+        """
+        The current REST API auth token.
+        """
+        return self.get_rest_token()
@@ -3,11 +3,13 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # -----------------------------------------------------------------------------------
 
+import time
 import logging
 import asyncio
 from eventhubs import EventHubClient, Offset
 from eventhubs.async import AsyncReceiver
 from eventprocessorhost.partition_pump import PartitionPump
+from eventprocessorhost.keyed_dispatcher import KeyedDispatcher
 
 class EventHubPartitionPump(PartitionPump):
     """
@@ -42,8 +44,16 @@ class EventHubPartitionPump(PartitionPump):
 
         if self.pump_status == "Opening":
             self.set_pump_status("Running")
-            self.eh_client.run_daemon()
+            if not self.is_shared_client():
+                self.eh_client.run_daemon()
             await self.partition_receiver.run()
+            dispatcher = self.dispatcher
+            if dispatcher and not self.is_closing():
+                # The receiver ended by itself, the host will not close the workers
+                await dispatcher.close_async()
+            elif dispatcher:
+                # In the thread pump mode the workers run on this loop until the host closes them
+                await dispatcher.wait_closed_async()
 
         if self.pump_status == "OpenFailed":
             self.set_pump_status("Closing")
@@ -59,12 +69,38 @@ class EventHubPartitionPump(PartitionPump):
         # Create event hub client and receive handler and set options
         self.partition_receive_handler = AsyncReceiver(loop=self.loop,
                                                        prefetch=self.host.eph_options.prefetch_count)
-        self.eh_client = EventHubClient(self.host.eh_config.client_address) \
-                        .subscribe(self.partition_receive_handler,
-                                   self.partition_context.consumer_group_name,
-                                   self.partition_context.partition_id,
-                                   Offset(self.partition_context.offset))
+        if self.is_shared_client():
+            self.eh_client = self.get_shared_client()
+        else:
+            self.eh_client = EventHubClient(self.host.eh_config.cbs_address,
+                                            token_provider=self.host.eh_config.token_cache)
+        self.eh_client.subscribe(self.partition_receive_handler,
+                                 self.partition_context.consumer_group_name,
+                                 self.partition_context.partition_id,
+                                 Offset(self.partition_context.offset))
         self.partition_receiver = PartitionReceiver(self)
+        if self.host.eph_options.key_parallelism and not self.dispatcher:
+            self.dispatcher = KeyedDispatcher(self, self.host.eph_options.key_parallelism,
+                                              self.host.eph_options.event_key_function)
+            self.dispatcher.start()
+
+    def is_shared_client(self):
+        """
+        In the single loop pump mode all pumps of the host receive over one client
+        """
+        return self.host.eph_options.pump_mode == "loop"
+
+    def get_shared_client(self):
+        """
+        Returns the host wide client, the first pump starts its reactor thread.
+        Pumps attach and detach their receivers while it runs.
+        """
+        partition_manager = self.host.partition_manager
+        if not partition_manager.shared_client:
+            partition_manager.shared_client = EventHubClient(
+                self.host.eh_config.cbs_address,
+                token_provider=self.host.eh_config.token_cache).run_daemon()
+        return partition_manager.shared_client
 
     async def clean_up_clients_async(self):
         """
@@ -72,7 +108,10 @@ class EventHubPartitionPump(PartitionPump):
         """
         if self.partition_receiver:
             if self.eh_client:
-                self.eh_client.stop()
+                if self.is_shared_client():
+                    self.eh_client.unsubscribe(self.partition_receive_handler)
+                else:
+                    self.eh_client.stop()
                 self.partition_receiver = None
                 self.partition_receive_handler = None
                 self.eh_client = None
@@ -82,39 +121,154 @@ class EventHubPartitionPump(PartitionPump):
         Overides partition pump on cleasing
         """
         await self.clean_up_clients_async()
+        if self.dispatcher:
+            # The processor is closed and checkpoints after the running batches completed
+            await self.dispatcher.close_async()
+            self.dispatcher = None
 
 class PartitionReceiver:
     """
-    Recieves events from a async until lease is lost
+    Recieves events from a async until lease is lost. With a receive_queue_depth the
+    next batches are received while the processor works on the current one.
     """
     def __init__(self, eh_partition_pump):
         self.eh_partition_pump = eh_partition_pump
-        self.max_batch_size = self.eh_partition_pump.host.eph_options.max_batch_size
-        self.recieve_timeout = self.eh_partition_pump.host.eph_options.receive_timeout
-    
+        eph_options = self.eh_partition_pump.host.eph_options
+        self.max_batch_size = eph_options.max_batch_size
+        self.batch_size = eph_options.max_batch_size
+        self.batch_size_limit = max(eph_options.max_adaptive_batch_size or 0, self.max_batch_size)
+        self.min_batch_size = min(eph_options.min_batch_size, self.max_batch_size)
+        self.max_batch_wait = eph_options.max_batch_wait
+        self.queue_depth = eph_options.receive_queue_depth
+        self.recieve_timeout = eph_options.receive_timeout
+        self.ready_batches = None
+        self.queued_events = 0
+
+    def is_running(self):
+        """
+        Returns whether the pump still takes events
+        """
+        return (not self.eh_partition_pump.is_closing()) \
+               or self.eh_partition_pump.pump_status == "Errored"
+
     async def run(self):
         """
         Runs the async partion reciever event loop to retrive messages from the event queue
         """
-        # Implement pull max batch from queue instead of one message at a time
-        while (not self.eh_partition_pump.is_closing()) \
-              or self.eh_partition_pump.pump_status == "Errored":
+        if self.queue_depth:
+            await self.run_pipelined_async()
+            return
+        while self.is_running() and self.eh_partition_pump.partition_receive_handler:
+            await self.dispatch_async(await self.receive_async())
+
+    async def run_pipelined_async(self):
+        """
+        Processes the batches a receiving task queues, up to queue_depth batches are
+        received ahead of the processor
+        """
+        self.ready_batches = asyncio.Queue(maxsize=self.queue_depth, loop=self.eh_partition_pump.loop)
+        receiving = asyncio.ensure_future(self.receive_batches_async(), loop=self.eh_partition_pump.loop)
+        try:
+            while self.is_running():
+                batch = await self.ready_batches.get()
+                if isinstance(batch, tuple):
+                    self.queued_events -= len(batch[1])
+                if batch is None or not self.is_running():
+                    break
+                await self.dispatch_async(batch)
+        finally:
+            receiving.cancel()
+
+    async def receive_batches_async(self):
+        """
+        Receives batches into the queue until the pump or the receiver closes, then
+        queues None. A receive failure is queued for the processing side to raise.
+        """
+        try:
+            while self.is_running() and self.eh_partition_pump.partition_receive_handler:
+                batch = await self.receive_async()
+                if batch is None:
+                    break
+                if isinstance(batch, tuple):
+                    self.queued_events += len(batch[1])
+                await self.ready_batches.put(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            await self.ready_batches.put(err)
+        await self.ready_batches.put(None)
+
+    async def receive_async(self):
+        """
+        Receives the next batch of events, the batch size grows while a backlog is queued.
+        A batch smaller than min_batch_size is filled for up to max_batch_wait seconds.
+        (Returns) a tuple (time the first event was received, events), the TimeoutError if
+        none arrived within receive_timeout, or None if the receiver is closed
+        """
+        handler = self.eh_partition_pump.partition_receive_handler
+        try:
+            msgs = await asyncio.wait_for(handler.receive(self.batch_size),
+                                          self.recieve_timeout,
+                                          loop=self.eh_partition_pump.loop)
+        except asyncio.TimeoutError as err:
+            logging.info("No events received, queue size %d, delivered %d",
+                         handler.messages.qsize(), handler.delivered)
+            return err
+        if msgs is None:
+            return None
+        received_at = time.time()
+        if len(msgs) < self.min_batch_size:
+            await self.fill_batch_async(handler, msgs, received_at + self.max_batch_wait)
+        self.adapt_batch_size(len(msgs), handler.messages.qsize())
+        self.eh_partition_pump.partition_context.metrics.buffered_events = \
+            handler.messages.qsize() + self.queued_events + len(msgs)
+        return (received_at, msgs)
+
+    async def fill_batch_async(self, handler, msgs, deadline):
+        """
+        Adds events to msgs until it holds min_batch_size events or the deadline passed
+        """
+        while len(msgs) < self.min_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
             try:
-                if self.eh_partition_pump.partition_receive_handler:
-                    msgs = await asyncio.wait_for(self.eh_partition_pump.\
-                                                    partition_receive_handler. \
-                                                    receive(self.max_batch_size),
-                                                self.recieve_timeout,
-                                                loop=self.eh_partition_pump.loop)
-                    await self.process_events_async(msgs)
-            except asyncio.TimeoutError as err:
-                if self.eh_partition_pump.partition_receive_handler:
-                    logging.info("No events received, queue size %d, delivered %d",
-                                self.eh_partition_pump.partition_receive_handler.messages.qsize(),
-                                self.eh_partition_pump.partition_receive_handler.delivered)
-                if self.eh_partition_pump.host.eph_options.release_pump_on_timeout:
-                    await self.process_error_async(err)
-    
+                more = await asyncio.wait_for(handler.receive(self.batch_size - len(msgs)),
+                                              remaining, loop=self.eh_partition_pump.loop)
+            except asyncio.TimeoutError:
+                break
+            if not more:
+                break
+            msgs.extend(more)
+
+    def adapt_batch_size(self, received, backlog):
+        """
+        Doubles the batch size up to max_adaptive_batch_size while full batches leave events
+        queued, and halves it back towards max_batch_size when the backlog is gone
+        """
+        if received >= self.batch_size and backlog:
+            self.batch_size = min(self.batch_size * 2, self.batch_size_limit)
+        elif not backlog and received < self.batch_size:
+            self.batch_size = max(self.batch_size // 2, self.max_batch_size)
+
+    async def dispatch_async(self, batch):
+        """
+        Hands a received batch or receive timeout to the processor, raises receive failures
+        """
+        if isinstance(batch, asyncio.TimeoutError):
+            if self.eh_partition_pump.host.eph_options.release_pump_on_timeout:
+                await self.process_error_async(batch)
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        if batch:
+            received_at, msgs = batch
+            self.eh_partition_pump.partition_context.first_event_latency = time.time() - received_at
+            await self.process_events_async(msgs)
+        # Let the other pumps on the loop run between batches, receive returns
+        # without yielding while events are queued
+        await asyncio.sleep(0)
+
     async def process_events_async(self, events):
         """
         # This method is called on the thread that the EH client uses to run the pump.
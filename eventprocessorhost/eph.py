@@ -6,6 +6,7 @@
 import uuid
 import asyncio
 from eventprocessorhost.partition_manager import PartitionManager
+from eventprocessorhost.lease_balancer import ConservativeLeaseBalancer
 
 class EventProcessorHost:
     """
@@ -18,9 +19,10 @@ class EventProcessorHost:
         self.event_processor_params = ep_params
         self.eh_config = eh_config
         self.guid = str(uuid.uuid4())
-        self.host_name = "host" + str(self.guid)
         self.loop = loop or asyncio.get_event_loop()
         self.eph_options = eph_options or EPHOptions()
+        # A stable host name lets a restarted host reclaim the leases it still holds
+        self.host_name = self.eph_options.host_name or "host" + str(self.guid)
         self.partition_manager = PartitionManager(self)
         self.storage_manager = storage_manager
         if self.storage_manager:
@@ -39,6 +41,16 @@ class EventProcessorHost:
         Stops the host
         """
         await self.partition_manager.stop_async()
+
+    def get_partition_metrics(self):
+        """
+        Returns the metrics of the partitions this host processes, a dictionary of partition
+        id to a dictionary of events_per_second, bytes_per_second, batch_size,
+        processor_latency, checkpoint_latency, first_event_latency, buffered_events,
+        sequence_number, last_enqueued_sequence_number, last_enqueued_time_utc, lag and
+        runtime_info_age. Lag is known once the partition runtime info was read.
+        """
+        return self.partition_manager.get_partition_metrics()
         
 class EPHOptions:
     """
@@ -46,7 +58,24 @@ class EPHOptions:
     """
     def __init__(self):
         self.max_batch_size = 10
+        self.min_batch_size = 1
+        self.max_batch_wait = 0
+        self.max_adaptive_batch_size = None
+        self.receive_queue_depth = 0
+        self.key_parallelism = None
+        self.event_key_function = None
         self.prefetch_count = 300
         self.receive_timeout = 60
         self.release_pump_on_timeout = False
         self.initial_offset_provider = "-1"
+        self.host_name = None
+        self.release_leases_on_shutdown = True
+        self.max_concurrent_lease_operations = 16
+        self.partition_metadata_ttl = 300
+        self.runtime_info_interval = 30
+        self.load_metric = "events_per_second"
+        self.lease_balancer = ConservativeLeaseBalancer()
+        self.pump_mode = "thread"
+        self.worker_processes = None
+        self.lease_scan_interval = None
+        self.lease_renew_margin = None
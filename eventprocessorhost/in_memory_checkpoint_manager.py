@@ -0,0 +1,217 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import time
+import uuid
+import logging
+import threading
+from collections import Counter
+from eventprocessorhost.timed_lease import TimedLease
+from eventprocessorhost.checkpoint import Checkpoint
+from eventprocessorhost.abstract_lease_manager import AbstractLeaseManager
+from eventprocessorhost.abstract_checkpoint_manager import AbstractCheckpointManager
+
+class InMemoryLeaseStore:
+    """
+    Lease and checkpoint records shared by the InMemoryCheckpointLeaseManager of
+    every host in a process. Counts the store operations issued by each host.
+    """
+    def __init__(self):
+        self.leases = {}
+        self.operations = Counter()
+        self.lock = threading.Lock()
+
+class InMemoryCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeaseManager):
+    """
+    Manages checkpoints and leases in process memory with the same semantics as the
+    Azure Storage manager: a lease is held through a token until it expires, and
+    acquiring a lease owned by another host requires the token seen when scanning.
+    Hosts sharing an InMemoryLeaseStore compete for the same partitions, which makes
+    it suitable for tests and simulations.
+    """
+    def __init__(self, store=None, lease_renew_interval=10, lease_duration=30):
+        AbstractCheckpointManager.__init__(self)
+        AbstractLeaseManager.__init__(self, lease_renew_interval, lease_duration)
+        self.store = store or InMemoryLeaseStore()
+        self.host = None
+
+    def initialize(self, host):
+        """
+        Binds the manager to its EventProcessorHost
+        """
+        self.host = host
+
+    def _record(self, partition_id):
+        self.store.operations[self.host.host_name] += 1
+        return self.store.leases.get(partition_id)
+
+    @staticmethod
+    def _copy(lease):
+        copied = TimedLease()
+        copied.with_source(lease)
+        return copied
+
+    # Checkpoint Managment Methods
+
+    async def create_checkpoint_store_if_not_exists_async(self):
+        """
+        Create the checkpoint store if it doesn't exist. Do nothing if it does exist.
+        """
+        await self.create_lease_store_if_not_exists_async()
+
+    async def get_checkpoint_async(self, partition_id):
+        """
+        Get the checkpoint data associated with the given partition.
+        (Returns) Given partition checkpoint info, or null if none has been previously stored.
+        """
+        lease = await self.get_lease_async(partition_id)
+        checkpoint = None
+        if lease and lease.offset:
+            checkpoint = Checkpoint(partition_id, lease.offset, lease.sequence_number)
+        return checkpoint
+
+    async def create_checkpoint_if_not_exists_async(self, partition_id):
+        """
+        Create the given partition checkpoint if it doesn't exist.Do nothing if it does exist.
+        (Returns) The checkpoint for the given partition, whether newly created or already existing.
+        """
+        checkpoint = await self.get_checkpoint_async(partition_id)
+        if not checkpoint:
+            await self.create_lease_if_not_exists_async(partition_id)
+            checkpoint = Checkpoint(partition_id)
+        return checkpoint
+
+    async def update_checkpoint_async(self, lease, checkpoint):
+        """
+        Update the checkpoint in the store with the offset/sequenceNumber in the provided checkpoint
+        """
+        new_lease = self._copy(lease)
+        new_lease.offset = checkpoint.offset
+        new_lease.sequence_number = checkpoint.sequence_number
+        return await self.update_lease_async(new_lease)
+
+    async def delete_checkpoint_async(self, partition_id):
+        """
+        Checkpoints live in the lease, deleting them is a no-op.
+        """
+        return
+
+    # Lease Managment Methods
+
+    async def create_lease_store_if_not_exists_async(self):
+        """
+        The store is created with the manager.
+        """
+        return True
+
+    async def delete_lease_store_async(self):
+        """
+        Delete all leases in the store.
+        """
+        with self.store.lock:
+            self.store.leases.clear()
+        return True
+
+    async def get_lease_async(self, partition_id):
+        """
+        Return the lease info for the specified partition, or None.
+        """
+        with self.store.lock:
+            stored = self._record(partition_id)
+            return self._copy(stored) if stored else None
+
+    async def get_all_leases(self):
+        """
+        Return the lease info for all partitions.
+        (Returns) list of lease info.
+        """
+        partition_ids = await self.host.partition_manager.get_partition_ids_async()
+        return [self.get_lease_async(partition_id) for partition_id in partition_ids]
+
+    async def create_lease_if_not_exists_async(self, partition_id):
+        """
+        Create in the store the lease info for the given partition, if it does not exist.
+        (Returns) the existing or newly-created lease info for the partition
+        """
+        with self.store.lock:
+            stored = self._record(partition_id)
+            if not stored:
+                stored = TimedLease()
+                stored.partition_id = partition_id
+                self.store.leases[partition_id] = stored
+            return self._copy(stored)
+
+    async def delete_lease_async(self, lease):
+        """
+        Delete the lease info for the given partition from the store.
+        """
+        with self.store.lock:
+            self._record(lease.partition_id)
+            self.store.leases.pop(lease.partition_id, None)
+
+    async def acquire_lease_async(self, lease):
+        """
+        Acquire the lease on the desired partition for this EventProcessorHost.
+        (Returns) true if the lease was acquired successfully, false if not
+        """
+        with self.store.lock:
+            stored = self._record(lease.partition_id)
+            if not stored:
+                return False
+            if not stored.is_expired() and stored.token and stored.token != lease.token:
+                logging.info("Lease %s changed owner since it was read", lease.partition_id)
+                return False
+            stored.token = str(uuid.uuid4())
+            stored.owner = self.host.host_name
+            stored.increment_epoch()
+            stored.expiration = time.time() + self.lease_duration
+            lease.with_source(stored)
+            return True
+
+    async def renew_lease_async(self, lease):
+        """
+        Renew a lease currently held by this host.
+        (Returns) true if the lease was renewed successfully, false if not
+        """
+        with self.store.lock:
+            stored = self._record(lease.partition_id)
+            if not stored or not lease.token or stored.token != lease.token:
+                return False
+            stored.expiration = time.time() + self.lease_duration
+            lease.expiration = stored.expiration
+            return True
+
+    async def release_lease_async(self, lease):
+        """
+        Give up a lease currently held by this host.
+        (Returns) true if the lease was released successfully, false if not
+        """
+        with self.store.lock:
+            stored = self._record(lease.partition_id)
+            if not stored or not lease.token or stored.token != lease.token:
+                return False
+            stored.token = None
+            stored.owner = None
+            stored.load = 0
+            stored.expiration = 0.0
+            return True
+
+    async def update_lease_async(self, lease):
+        """
+        Update the store with the information in the provided lease. The lease is renewed
+        as part of the update.
+        (Returns) true if the updated was performed successfully, false if not.
+        """
+        if lease is None or not lease.token:
+            return False
+        with self.store.lock:
+            stored = self._record(lease.partition_id)
+            if not stored or stored.token != lease.token:
+                return False
+            stored.offset = lease.offset
+            stored.sequence_number = lease.sequence_number
+            stored.load = lease.load
+            stored.expiration = time.time() + self.lease_duration
+            return True
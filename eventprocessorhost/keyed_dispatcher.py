@@ -0,0 +1,161 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import time
+import asyncio
+import collections
+
+class OffsetTracker:
+    """
+    Tracks the events of a partition handed out for processing, in the order they were
+    received, and finds the last event before the first one not processed yet.
+    """
+    def __init__(self):
+        self.pending = collections.deque()
+        self.completed = set()
+        self.low_watermark = None
+        self.failed = False
+
+    def track(self, events):
+        """
+        Adds received events, in partition order
+        """
+        if not self.failed:
+            self.pending.extend(events)
+
+    def fail(self):
+        """
+        Freezes the low watermark before events whose processing failed, they are
+        received again from the last checkpoint when the partition is reopened
+        """
+        self.failed = True
+        self.pending.clear()
+        self.completed.clear()
+
+    def complete(self, events):
+        """
+        Marks events as processed.
+        (Returns) the last event such that it and every event before it were processed,
+        or None if there is no such event yet
+        """
+        if self.failed:
+            return self.low_watermark
+        self.completed.update(event.sequence_number for event in events)
+        while self.pending and self.pending[0].sequence_number in self.completed:
+            event = self.pending.popleft()
+            self.completed.discard(event.sequence_number)
+            self.low_watermark = event
+        return self.low_watermark
+
+class KeyedDispatcher:
+    """
+    Processes the events of a partition with several concurrent calls of the event processor.
+    Events with the same key go to the same worker, in order. Events without a key are spread
+    over the workers round-robin, so order is only guaranteed among events of the same key.
+    The partition context offset only advances to the low watermark of the OffsetTracker, so
+    a checkpoint never passes an event that is still being processed. Once a batch failed
+    the offset no longer advances, process_error_async decides how the partition goes on.
+    The processor must accept concurrent process_events_async calls for the same partition.
+    """
+    def __init__(self, pump, workers, key_function=None, queue_depth=2):
+        self.pump = pump
+        self.key_function = key_function or event_key
+        self.tracker = OffsetTracker()
+        # The dispatcher is created in a coroutine on the pump loop, the queues use that loop
+        self.queues = [asyncio.Queue(maxsize=queue_depth) for _ in range(workers)]
+        self.closed = asyncio.Event()
+        self.tasks = []
+        self.closing = False
+        self.next_worker = 0
+
+    def start(self):
+        """
+        Starts the workers on the pump loop
+        """
+        self.tasks = [asyncio.ensure_future(self.work_async(queue), loop=self.pump.loop)
+                      for queue in self.queues]
+
+    async def dispatch_async(self, events):
+        """
+        Splits a batch by key and queues the parts to their workers. Waits while
+        the queue of a worker is full.
+        """
+        if self.closing or not events:
+            return
+        batches = [[] for _ in self.queues]
+        for event in events:
+            key = self.key_function(event)
+            if key is None:
+                self.next_worker = (self.next_worker + 1) % len(self.queues)
+                batches[self.next_worker].append(event)
+            else:
+                batches[hash(key) % len(self.queues)].append(event)
+        self.tracker.track(events)
+        for queue, batch in zip(self.queues, batches):
+            if batch:
+                await queue.put(batch)
+
+    async def work_async(self, queue):
+        """
+        Processes the batches of one worker until None is queued
+        """
+        while True:
+            events = await queue.get()
+            if events is None:
+                break
+            try:
+                started = time.time()
+                await self.pump.processor.process_events_async(self.pump.partition_context, events)
+                self.pump.partition_context.metrics.record_batch(events, time.time() - started)
+            except Exception as err:
+                # A checkpoint must not pass the failed events
+                self.tracker.fail()
+                await self.pump.process_error_async(err)
+                continue
+            low_watermark = self.tracker.complete(events)
+            if low_watermark:
+                self.pump.partition_context.set_offset_and_sequence_number(low_watermark)
+
+    async def close_async(self):
+        """
+        Drops the queued batches and waits for the workers to finish the batches
+        they are processing. The offset stays before the dropped events. In the thread
+        pump mode the pump closes on the host loop, the workers are closed on the pump loop.
+        A second call waits until the first one finished.
+        """
+        if asyncio.get_event_loop() is not self.pump.loop:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.close_async(),
+                                                                       self.pump.loop))
+            return
+        if self.closing:
+            await self.closed.wait()
+            return
+        self.closing = True
+        for queue in self.queues:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        await asyncio.gather(*self.tasks)
+        self.tasks = []
+        self.closed.set()
+
+    async def wait_closed_async(self):
+        """
+        Waits on the pump loop until close_async finished
+        """
+        await self.closed.wait()
+
+def event_key(event):
+    """
+    The default key, the partition key of the event or None if it has none. Events
+    without a key are not ordered among each other.
+    """
+    try:
+        return event.partition_key
+    except (AttributeError, KeyError):
+        return None
+    except TypeError:
+        # The annotations of an EventData without any are None
+        return None
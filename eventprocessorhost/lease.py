@@ -13,6 +13,8 @@ class Lease:
         self.owner = None
         self.token = None
         self.epoch = 0
+        # Load the owner published for the partition, see EPHOptions.load_metric
+        self.load = 0
 
     def with_partition_id(self, partition_id):
         """
@@ -31,6 +33,7 @@ class Lease:
         self.epoch = lease.epoch
         self.owner = lease.owner
         self.token = lease.token
+        self.load = lease.load
 
     def is_expired(self):
         """
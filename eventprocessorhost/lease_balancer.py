@@ -0,0 +1,129 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+from collections import Counter, defaultdict
+from eventprocessorhost.abstract_lease_balancer import AbstractLeaseBalancer
+
+def is_free(lease):
+    """
+    A lease nobody holds can be taken without stealing it from a host
+    """
+    return not lease.owner or lease.is_expired()
+
+class ConservativeLeaseBalancer(AbstractLeaseBalancer):
+    """
+    Steals at most one lease per pass.
+    If the number of leases is a multiple of the number of hosts, then the desired
+    configuration is that all hosts own the name number of leases, and the
+    difference between the "biggest" owner and any other is 0.
+
+    If the number of leases is not a multiple of the number of hosts, then the most
+    even configurationpossible is for some hosts to have (self, leases/hosts) leases
+    and others to have (self, (self, leases/hosts) + 1). For example, for 16 partitions
+    distributed over five hosts, the distribution would be 4, 3, 3, 3, 3, or any of the
+    possible reorderings.
+
+    In either case, if the difference between this host and the biggest owner is 2 or more,
+    then thesystem is not in the most evenly-distributed configuration, so steal one lease
+    from the biggest. If there is a tie for biggest, we pick whichever appears first in the
+    list because it doesn't really matter which "biggest" is trimmed down.
+
+    Stealing one at a time prevents flapping because it reduces the difference between the
+    biggest and this host by two at a time. If the starting difference is two or greater,
+    then the difference cannot end up below 0. This host may become tied for biggest, but it
+    cannot become larger than the host that it is stealing from.
+    """
+    def leases_to_steal(self, host_name, stealable_leases, have_lease_count):
+        if not stealable_leases:
+            return []
+        counts_by_owner = Counter(l.owner for l in stealable_leases)
+        biggest_owner, biggest_count = max(counts_by_owner.items(), key=lambda kv: kv[1])
+        if biggest_count - have_lease_count >= 2:
+            return [[l for l in stealable_leases if l.owner == biggest_owner][0]]
+        return []
+
+class FastLeaseBalancer(AbstractLeaseBalancer):
+    """
+    Takes this host to its share of the leases in one pass. The share is the lease
+    count divided by the number of hosts that hold leases, this host included,
+    rounded up. Free (expired or unowned) leases are taken first, then leases are
+    stolen one by one from the biggest owner while it holds at least two more than
+    this host, the same rule that keeps the conservative balancer from flapping.
+
+    Hosts joining together do not see each other until they hold leases, so each may
+    aim for the share of the current owners. max_steals_per_pass bounds the leases
+    stolen from other hosts in one pass to limit that overshoot, None means no bound.
+    """
+    def __init__(self, max_steals_per_pass=None):
+        self.max_steals_per_pass = max_steals_per_pass
+
+    def leases_to_steal(self, host_name, stealable_leases, have_lease_count):
+        free = [l for l in stealable_leases if is_free(l)]
+        owned = [l for l in stealable_leases if not is_free(l) and l.owner != host_name]
+        counts_by_owner = Counter(l.owner for l in owned)
+        total = have_lease_count + len(stealable_leases)
+        share = -(-total // (len(counts_by_owner) + 1))
+        chosen = free[:max(0, share - have_lease_count)]
+        count = have_lease_count + len(chosen)
+        stolen = 0
+        while count < share and counts_by_owner:
+            if self.max_steals_per_pass is not None and stolen >= self.max_steals_per_pass:
+                break
+            biggest_owner, biggest_count = counts_by_owner.most_common(1)[0]
+            if biggest_count - count < 2:
+                break
+            lease = [l for l in owned if l.owner == biggest_owner and l not in chosen][0]
+            chosen.append(lease)
+            counts_by_owner[biggest_owner] -= 1
+            count += 1
+            stolen += 1
+        return chosen
+
+class LoadAwareLeaseBalancer(AbstractLeaseBalancer):
+    """
+    Evens out the load the hosts publish in their leases (see EPHOptions.load_metric)
+    instead of the lease count. Free leases are taken up to this host's share of the
+    lease count, like the fast balancer does. Then at most one lease per pass is stolen
+    from the most loaded host, if that host carries more than tolerance above the mean
+    load. The stolen lease is the busiest one that moves at most half the load difference,
+    so this host cannot end up more loaded than the host it stole from and leases do not
+    move back and forth. Load differences below min_load_difference are ignored, and
+    when the hosts report no load at all the leases are balanced by count like the
+    conservative balancer does.
+    """
+    def __init__(self, tolerance=0.2, min_load_difference=1.0):
+        self.tolerance = tolerance
+        self.min_load_difference = min_load_difference
+        self.count_balancer = ConservativeLeaseBalancer()
+
+    def leases_to_steal(self, host_name, stealable_leases, have_lease_count):
+        # Without the loads of our own leases only the count can be balanced
+        return self.count_balancer.leases_to_steal(host_name, stealable_leases, have_lease_count)
+
+    def choose_leases(self, host_name, stealable_leases, own_leases):
+        free = [l for l in stealable_leases if is_free(l)]
+        owned = [l for l in stealable_leases if not is_free(l) and l.owner != host_name]
+        if free:
+            owner_count = len(set(l.owner for l in owned))
+            share = -(-(len(own_leases) + len(stealable_leases)) // (owner_count + 1))
+            return free[:max(0, share - len(own_leases))]
+        load_by_owner = defaultdict(float)
+        for lease in owned:
+            load_by_owner[lease.owner] += lease.load
+        own_load = sum(l.load for l in own_leases)
+        if own_load + sum(load_by_owner.values()) < self.min_load_difference:
+            return self.count_balancer.leases_to_steal(host_name, stealable_leases, len(own_leases))
+        if not load_by_owner:
+            return []
+        mean_load = (own_load + sum(load_by_owner.values())) / (len(load_by_owner) + 1)
+        busiest_owner, busiest_load = max(load_by_owner.items(), key=lambda kv: kv[1])
+        if busiest_load <= mean_load * (1 + self.tolerance) \
+           or busiest_load - own_load < self.min_load_difference:
+            return []
+        limit = (busiest_load - own_load) / 2
+        candidates = [l for l in owned if l.owner == busiest_owner and 0 < l.load <= limit]
+        if not candidates:
+            return []
+        return [max(candidates, key=lambda l: l.load)]
@@ -2,9 +2,11 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # -----------------------------------------------------------------------------------
+import time
 import asyncio
 import logging
 from eventprocessorhost.checkpoint import Checkpoint
+from eventprocessorhost.partition_metrics import PartitionMetrics
 
 class PartitionContext:
     """
@@ -18,6 +20,10 @@ class PartitionContext:
         self.offset = "-1"
         self.sequence_number = 0
         self.lease = None
+        self.last_checkpoint = None
+        # Seconds the first event of the batch being processed waited in the pump
+        self.first_event_latency = None
+        self.metrics = PartitionMetrics()
         self.pump_loop = pump_loop or asyncio.get_event_loop()
 
     def set_offset_and_sequence_number(self, event_data):
@@ -77,6 +83,19 @@ class PartitionContext:
                                                        event_data.offset,
                                                        event_data.sequence_number))
 
+    def get_load(self):
+        """
+        Returns the load of the partition published in its lease, the EPHOptions.load_metric
+        of the partition metrics
+        """
+        return self.get_metrics()[self.host.eph_options.load_metric] or 0
+
+    def get_metrics(self):
+        """
+        Returns a snapshot of the partition metrics, lag is counted from the current sequence number
+        """
+        return self.metrics.snapshot(self.sequence_number, self.first_event_latency)
+
     def to_string(self):
         """
         Returns the parition context in the following format:
@@ -95,7 +114,9 @@ class PartitionContext:
                       self.host.guid, checkpoint.partition_id,
                       checkpoint.offset, checkpoint.sequence_number)
         try:
-            in_store_checkpoint = await self.host.storage_manager \
+            # Only this context writes the checkpoint while it holds the lease, the store
+            # is read once and the last persisted checkpoint is used after that
+            in_store_checkpoint = self.last_checkpoint or await self.host.storage_manager \
                                                  .get_checkpoint_async(checkpoint.partition_id)
             if not in_store_checkpoint \
                or checkpoint.sequence_number >= in_store_checkpoint.sequence_number:
@@ -104,9 +125,16 @@ class PartitionContext:
                     await self.host.storage_manager \
                               .create_checkpoint_if_not_exists_async(checkpoint.partition_id)
 
-                await self.host.storage_manager.update_checkpoint_async(self.lease, checkpoint)
+                # The checkpoint write publishes the partition load with the lease
+                self.lease.load = self.get_load()
+                started = time.time()
+                stored = await self.host.storage_manager.update_checkpoint_async(self.lease,
+                                                                                 checkpoint)
+                self.metrics.record_checkpoint(time.time() - started)
                 self.lease.offset = checkpoint.offset
                 self.lease.sequence_number = checkpoint.sequence_number
+                if stored is not False:
+                    self.last_checkpoint = checkpoint
             else:
                 msg = "Ignoring out of date checkpoint with offset %s/sequence number %s because \
                        current persisted checkpoint has higher offset %s/sequence number %s"
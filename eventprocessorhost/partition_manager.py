@@ -4,16 +4,12 @@
 # -----------------------------------------------------------------------------------
 
 import time
+import heapq
 import logging
 import asyncio
-import threading
-from queue import Queue
 import concurrent.futures
-from collections import Counter
-from bs4 import BeautifulSoup
-import requests
-from eventprocessorhost.eh_partition_pump import EventHubPartitionPump
 from eventprocessorhost.cancellation_token import CancellationToken
+from eventprocessorhost.partition_metadata_service import PartitionMetadataService
 
 class PartitionManager:
     """
@@ -25,36 +21,67 @@ class PartitionManager:
         self.partition_ids = None
         self.run_task = None
         self.pump_executor = None
+        # Futures of the pumps running in pump_executor
+        self.pump_futures = []
+        self.shared_client = None
+        self.worker_pool = None
+        self.owned_leases = {}
+        self.renewal_queue = []
         self.cancellation_token = CancellationToken()
+        self.metadata_service = PartitionMetadataService(host.eh_config,
+                                                         host.eph_options.partition_metadata_ttl)
+        self.metadata_service.add_listener(self.on_partitions_added_async)
 
     async def get_partition_ids_async(self):
         """
         Returns a list of all the event hub partition ids
         """
-        if not self.partition_ids:
-            try:
-                headers = {"Content-Type": "application/json;type=entry;charset=utf-8",
-                           "Authorization": self.host.eh_config.rest_token,
-                           "Host": "{}.servicebus.windows.net".format(self.host.eh_config.sb_name)
-                           }
-
-                res = requests.get('https://{}.servicebus.windows.net/{}?timeout=60& \
-                                    api-version=2014-01'.format(self.host.eh_config.sb_name,
-                                                                self.host.eh_config.eh_name),
-                                   headers=headers)
-                soup = BeautifulSoup(res.text, "lxml-xml") # process xml response
-                self.partition_ids = [pid.text for pid in soup.find("PartitionIds")]
-            except Exception as err:
-                raise Exception("failed to get partition ids", repr(err))
-
+        self.partition_ids = await self.metadata_service.get_partition_ids_async()
         return self.partition_ids
 
+    async def on_partitions_added_async(self, partition_ids):
+        """
+        Called by the metadata service when the event hub was scaled out. Creates the
+        checkpoints of the new partitions, the run loop picks up their leases.
+        """
+        logging.info("%s New partitions %s", self.host.guid, partition_ids)
+        retries = [self.retry_async(self.host.storage_manager.create_checkpoint_if_not_exists_async,
+                                    partition_id=p_id,
+                                    retry_message="Failure creating checkpoint for partition, retrying",
+                                    final_failure_message="Out of retries creating checkpoint blob for partition",
+                                    max_retries=5, host_id=self.host.guid)
+                   for p_id in partition_ids]
+        for result in await self.gather_bounded_async(retries):
+            if isinstance(result, Exception):
+                logging.error("Failed to create checkpoint %s", repr(result))
+        if self.pump_executor:
+            # Pumps hold their thread while they run, grow the pool for the new partitions.
+            # Pumps already running keep their threads in the previous pool, which is shut
+            # down once they closed. The listener runs before self.partition_ids is updated.
+            self.host.loop.create_task(self.retire_pump_executor_async(self.pump_executor,
+                                                                       self.pump_futures))
+            self.pump_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(self.metadata_service.partition_ids))
+            self.pump_futures = []
+
+    async def retire_pump_executor_async(self, executor, futures):
+        """
+        Shuts down a replaced pump executor once the pumps running in it closed
+        """
+        if futures:
+            await asyncio.wait(futures)
+        executor.shutdown(wait=True)
+
     async def start_async(self):
         """
         Intializes the partition checkpoint and lease store and then calls run async.
         """
         if self.run_task:
             raise Exception("A PartitionManager cannot be started multiple times.")
+        if self.host.eph_options.pump_mode == "process":
+            # Fail on open rather than when the first partition is handed to a worker
+            from eventprocessorhost.process_pump import WorkerSettings
+            WorkerSettings(self.host).check_picklable()
 
         partition_count = await self.initialize_stores_async()
         logging.info("%s PartitionCount: %s", self.host.guid, partition_count)
@@ -75,16 +102,35 @@ class PartitionManager:
         """
         Starts the run loop and manages exceptions and cleanup
         """
+        background_tasks = [self.host.loop.create_task(self.renew_loop_async()),
+                            self.host.loop.create_task(self.runtime_info_loop_async())]
         try:
             await self.run_loop_async()
         except Exception as err:
             logging.error("Run loop failed %s", repr(err))
+        finally:
+            for task in background_tasks:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
 
         try:
             logging.info("Shutting down all pumps %s", self.host.guid)
             await self.remove_all_pumps_async("Shutdown")
+            await self.host.storage_manager.flush_async()
+            if self.host.eph_options.release_leases_on_shutdown:
+                await self.release_all_leases_async()
         except Exception as err:
             raise Exception("failed to remove all pumps", repr(err))
+        finally:
+            if self.shared_client:
+                self.shared_client.stop()
+                self.shared_client = None
+            if self.worker_pool:
+                await self.worker_pool.stop_async()
+                self.worker_pool = None
 
     async def initialize_stores_async(self):
         """
@@ -94,27 +140,29 @@ class PartitionManager:
         """
         await self.host.storage_manager.create_checkpoint_store_if_not_exists_async()
         partition_ids = await self.get_partition_ids_async()
-        retry_threads = []
-        for p_id in partition_ids:
-            t = threading.Thread(target=self.retry, \
-                                 args=(self.host.storage_manager.create_checkpoint_if_not_exists_async,),\
-                                 kwargs={'partition_id': p_id, 
-                                         'retry_message': "Failure creating checkpoint for partition, retrying",
-                                         'final_failure_message':"Out of retries creating checkpoint blob for partition",
-                                         'max_retries':5, 'host_id': self.host.guid})
-            retry_threads.append(t)
-            t.start()
+        retries = [self.retry_async(self.host.storage_manager.create_checkpoint_if_not_exists_async,
+                                    partition_id=p_id,
+                                    retry_message="Failure creating checkpoint for partition, retrying",
+                                    final_failure_message="Out of retries creating checkpoint blob for partition",
+                                    max_retries=5, host_id=self.host.guid)
+                   for p_id in partition_ids]
         # Wait to create all checkpoints
-        [t.join() for t in retry_threads]
+        for result in await self.gather_bounded_async(retries):
+            if isinstance(result, Exception):
+                logging.error("Failed to create checkpoint %s", repr(result))
         return len(partition_ids)
 
-    def retry(self, func, partition_id, retry_message, final_failure_message, max_retries, host_id):
+    async def gather_bounded_async(self, coros):
         """
-        Make attempt_renew_lease async call sync
+        Runs the coroutines as tasks on the host loop with at most
+        eph_options.max_concurrent_lease_operations running at a time.
+        Returns their results in order, exceptions are returned instead of raised.
         """
-        loop = asyncio.new_event_loop()
-        loop.run_until_complete(self.retry_async(func, partition_id, retry_message,
-                                                 final_failure_message, max_retries, host_id))
+        semaphore = asyncio.Semaphore(self.host.eph_options.max_concurrent_lease_operations)
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+        return await asyncio.gather(*[bounded(coro) for coro in coros], return_exceptions=True)
 
     async def retry_async(self, func, partition_id, retry_message,
                           final_failure_message, max_retries, host_id):
@@ -135,67 +183,173 @@ class PartitionManager:
 
     async def run_loop_async(self):
         """
-        This is the main execution loop for allocating and manging pumps
+        This is the main execution loop for allocating and manging pumps. Leases we
+        own are renewed by renew_loop_async, this loop scans for expired and
+        stealable leases every lease_renew_interval, or every lease_scan_interval
+        if it is set
         """
         while not self.cancellation_token.is_cancelled:
             lease_manager = self.host.storage_manager
             # Inspect all leases.
             # Acquire any expired leases.
-            # Renew any leases that currently belong to us.
+            # Renew leases that belong to us but are not scheduled yet.
             getting_all_leases = await lease_manager.get_all_leases()
-            leases_owned_by_others_q = Queue()
-            possible_lease_threads = []
-            for get_lease_task in getting_all_leases:
-                t = threading.Thread(target=self.attempt_renew_lease, args=(get_lease_task,),\
-                                     kwargs={'owned_by_others_q': leases_owned_by_others_q, 
-                                             'lease_manager': lease_manager})
-                possible_lease_threads.append(t)
-                t.start()
-                
-            # Wait to calculate possible leases
-            [t.join() for t in possible_lease_threads]
-            # Extract all leasees leases_owned_by_others and our_lease_count from the
+            results = await self.gather_bounded_async(
+                [self.attempt_renew_lease_async(get_lease_task, lease_manager)
+                 for get_lease_task in getting_all_leases])
+            # Extract all leasees leases_owned_by_others and our_lease_count from the results
             all_leases = {}
             leases_owned_by_others = []
-            our_lease_count = 0
-            while not leases_owned_by_others_q.empty():
-                lease_owned_by_other = leases_owned_by_others_q.get()
+            our_leases = []
+            for result in results:
+                if not isinstance(result, tuple):
+                    continue
+                owned_by_other, lease = result
                 # Check if lease is owned by other and append
-                if lease_owned_by_other[0]:
-                    leases_owned_by_others.append(lease_owned_by_other[1])
+                if owned_by_other:
+                    leases_owned_by_others.append(lease)
                 else:
-                    our_lease_count += 1
-                all_leases[lease_owned_by_other[1].partition_id] = lease_owned_by_other[1]
+                    lease.load = self.get_partition_load(lease)
+                    our_leases.append(lease)
+                all_leases[lease.partition_id] = lease
 
             # Grab more leases if available and needed for load balancing
-            leases_owned_by_others_count = len(leases_owned_by_others)
-            if leases_owned_by_others_count > 0:
-                steal_this_lease = self.which_lease_to_steal(leases_owned_by_others,
-                                                            our_lease_count)
-                if steal_this_lease:
-                    try:
-                        logging.info("Lease to steal %s", str(steal_this_lease.serializable()))
-                        if await lease_manager.acquire_lease_async(steal_this_lease):
-                            logging.info("Stole lease sucessfully %s %s", self.host.guid,
-                                        steal_this_lease.partition_id)
-                        else:
-                            logging.info("Failed to steal lease for partition %s %s",
-                                        self.host.guid, steal_this_lease.partition_id)
-                    except Exception as err:
-                        logging.error("Failed to steal lease %s", repr(err))
+            if leases_owned_by_others:
+                steal_these_leases = self.host.eph_options.lease_balancer.choose_leases(
+                    self.host.host_name, leases_owned_by_others, our_leases)
+                await self.gather_bounded_async(
+                    [self.steal_lease_async(lease, lease_manager) for lease in steal_these_leases])
 
             for partition_id in all_leases:
                 try:
-                    updated_lease = all_leases[partition_id]
-                    if updated_lease.owner == self.host.host_name:
-                        logging.debug("Attempting to renew lease %s %s",
-                                      self.host.guid, partition_id)
-                        await self.check_and_add_pump_async(partition_id, updated_lease)
+                    if partition_id in self.owned_leases:
+                        await self.check_and_add_pump_async(partition_id,
+                                                            self.owned_leases[partition_id][0])
                     else:
                         await self.remove_pump_async(partition_id, "LeaseLost")
                 except Exception as err:
                     logging.error("failed to update lease %s", repr(err))
-            await asyncio.sleep(lease_manager.lease_renew_interval)
+            await asyncio.sleep(self.host.eph_options.lease_scan_interval or
+                                lease_manager.lease_renew_interval)
+
+    def renewal_delay(self):
+        """
+        Returns the time from a renewal to the next one, which is lease_duration less a
+        safety margin. The margin defaults to lease_duration - lease_renew_interval
+        """
+        lease_manager = self.host.storage_manager
+        margin = self.host.eph_options.lease_renew_margin
+        if margin is None:
+            margin = lease_manager.lease_duration - lease_manager.lease_renew_interval
+        return max(0.1, lease_manager.lease_duration - margin)
+
+    def schedule_renewal(self, lease, renewed_at):
+        """
+        Tracks a lease we own and queues its next renewal
+        """
+        deadline = renewed_at + self.renewal_delay()
+        self.owned_leases[lease.partition_id] = (lease, deadline)
+        heapq.heappush(self.renewal_queue, (deadline, lease.partition_id))
+
+    async def renew_loop_async(self):
+        """
+        Renews each lease we own when its deadline comes up, so renewals are spread
+        over time instead of all leases being renewed on the same tick
+        """
+        lease_manager = self.host.storage_manager
+        while not self.cancellation_token.is_cancelled:
+            due = []
+            now = time.time()
+            while self.renewal_queue and self.renewal_queue[0][0] <= now:
+                deadline, partition_id = heapq.heappop(self.renewal_queue)
+                owned = self.owned_leases.get(partition_id)
+                # Entries of released or rescheduled leases are left in the queue, skip them
+                if owned and owned[1] == deadline:
+                    due.append(owned[0])
+            if due:
+                await self.gather_bounded_async(
+                    [self.renew_owned_lease_async(lease, lease_manager) for lease in due])
+                continue
+            # A lease scheduled while we sleep is due renewal_delay() after now at the earliest
+            delay = self.renewal_delay()
+            if self.renewal_queue:
+                delay = min(delay, self.renewal_queue[0][0] - now)
+            await asyncio.sleep(delay)
+
+    async def renew_owned_lease_async(self, lease, lease_manager):
+        """
+        Renews a lease from the renewal queue and schedules its next renewal.
+        Stops the pump of the partition if the lease was lost
+        """
+        partition_id = lease.partition_id
+        renewed_at = time.time()
+        try:
+            logging.debug("Trying to renew lease %s %s", self.host.guid, partition_id)
+            renewed = await lease_manager.renew_lease_async(lease)
+        except Exception as err: #Update to LeaseLostException:
+            logging.error("Lease lost exception %s %s %s", repr(err), self.host.guid, partition_id)
+            renewed = False
+        owned = self.owned_leases.get(partition_id)
+        if not owned:
+            # The scan dropped the lease while it was renewed
+            return
+        if renewed:
+            # The scan may have replaced the lease while it was renewed, keep the fresher one
+            self.schedule_renewal(owned[0], renewed_at)
+        elif owned[0] is not lease:
+            # Renew the lease the scan replaced it with right away, unless the scan
+            # acquired it again and queued a later renewal already
+            if owned[1] <= time.time():
+                heapq.heappush(self.renewal_queue, (owned[1], partition_id))
+        else:
+            del self.owned_leases[partition_id]
+            try:
+                await self.remove_pump_async(partition_id, "LeaseLost")
+            except Exception as err:
+                logging.error("failed to update lease %s", repr(err))
+
+    async def runtime_info_loop_async(self):
+        """
+        Reads the runtime info of the partitions with a pump every runtime_info_interval
+        seconds, the partition metrics compute the lag from it
+        """
+        interval = self.host.eph_options.runtime_info_interval
+        while interval and not self.cancellation_token.is_cancelled:
+            await asyncio.sleep(interval)
+            await self.gather_bounded_async(
+                [self.refresh_runtime_info_async(partition_id, pump)
+                 for partition_id, pump in list(self.partition_pumps.items())])
+
+    async def refresh_runtime_info_async(self, partition_id, pump):
+        """
+        Stores the runtime info of a partition in the metrics of its pump
+        """
+        try:
+            runtime_info = await self.metadata_service.get_partition_runtime_info_async(
+                self.host.eh_config.consumer_group, partition_id)
+            if pump.partition_context:
+                pump.partition_context.metrics.set_runtime_info(runtime_info)
+        except Exception as err:
+            logging.warning("%s %s Failed to read partition runtime info %s",
+                            self.host.guid, partition_id, repr(err))
+
+    def get_partition_load(self, lease):
+        """
+        Returns the current load of a partition we own, the load published in its
+        lease until its pump reports one
+        """
+        pump = self.partition_pumps.get(lease.partition_id)
+        if pump and pump.partition_context:
+            return pump.partition_context.get_load()
+        return lease.load
+
+    def get_partition_metrics(self):
+        """
+        Returns a dictionary of partition id to the metrics of its pump
+        """
+        return dict((partition_id, pump.partition_context.get_metrics())
+                    for partition_id, pump in list(self.partition_pumps.items())
+                    if pump.partition_context)
 
     async def check_and_add_pump_async(self, partition_id, lease):
         """
@@ -221,12 +375,37 @@ class PartitionManager:
         """
         Create a new pump thread with a given lease
         """
-        partition_pump = EventHubPartitionPump(self.host, lease)
+        partition_pump = self.create_pump(lease)
         # Do the put after start, if the start fails then put doesn't happen
-        self.host.loop.run_in_executor(self.pump_executor, partition_pump.run)
+        if self.host.eph_options.pump_mode in ("loop", "process"):
+            partition_pump.run_task = self.host.loop.create_task(partition_pump.run_async())
+        else:
+            self.pump_futures = [future for future in self.pump_futures if not future.done()]
+            self.pump_futures.append(self.host.loop.run_in_executor(self.pump_executor,
+                                                                    partition_pump.run))
         self.partition_pumps[partition_id] = partition_pump
         logging.info("Created new partition pump %s %s", self.host.guid, partition_id)
 
+    def create_pump(self, lease):
+        """
+        Creates the pump for a leased partition. Override to pump from another source.
+        """
+        if self.host.eph_options.pump_mode == "process":
+            from eventprocessorhost.process_pump import ProcessPartitionPump
+            if not self.worker_pool:
+                self.worker_pool = self.create_worker_pool()
+                self.worker_pool.start()
+            return ProcessPartitionPump(self.host, lease, self.worker_pool)
+        from eventprocessorhost.eh_partition_pump import EventHubPartitionPump
+        return EventHubPartitionPump(self.host, lease)
+
+    def create_worker_pool(self):
+        """
+        Creates the worker processes of the process pump mode. Override to pump from another source.
+        """
+        from eventprocessorhost.process_pump import PartitionWorkerPool
+        return PartitionWorkerPool(self.host, self.host.eph_options.worker_processes)
+
     async def remove_pump_async(self, partition_id, reason):
         """
         Stops a single partiton pump
@@ -235,6 +414,9 @@ class PartitionManager:
             captured_pump = self.partition_pumps[partition_id]
             if not captured_pump.is_closing():
                 await captured_pump.close_async(reason)
+            if captured_pump.run_task:
+                # The closed pump may still wait for events on the host loop
+                captured_pump.run_task.cancel()
             #else, pump is already closing/closed, don't need to try to shut it down again
             del self.partition_pumps[partition_id] # remove pump
             logging.debug("Removed pump %s %s ", self.host.guid, partition_id)
@@ -247,90 +429,88 @@ class PartitionManager:
                           self.host.guid, partition_id)
 
     async def remove_all_pumps_async(self, reason):
-        """ 
-        Stops all partition pumps
-        (Note this might be wrong and need to await all tasks before returning done)
         """
-        for p_id in list(self.partition_pumps):
-            await self.remove_pump_async(p_id, reason)
-        return True
-
-    def which_lease_to_steal(self, stealable_leases, have_lease_count):
+        Stops all partition pumps concurrently and waits until they are closed
         """
-        Determines and return which lease to steal
-        If the number of leases is a multiple of the number of hosts, then the desired
-        configuration is that all hosts own the name number of leases, and the
-        difference between the "biggest" owner and any other is 0.
-
-        If the number of leases is not a multiple of the number of hosts, then the most
-        even configurationpossible is for some hosts to have (self, leases/hosts) leases
-        and others to have (self, (self, leases/hosts) + 1). For example, for 16 partitions
-        distributed over five hosts, the distribution would be 4, 3, 3, 3, 3, or any of the
-        possible reorderings.
-
-        In either case, if the difference between this host and the biggest owner is 2 or more,
-        then thesystem is not in the most evenly-distributed configuration, so steal one lease
-        from the biggest. If there is a tie for biggest, we pick whichever appears first in the
-        list because it doesn't really matter which "biggest" is trimmed down.
+        results = await self.gather_bounded_async(
+            [self.remove_pump_async(p_id, reason) for p_id in list(self.partition_pumps)])
+        for result in results:
+            if isinstance(result, Exception):
+                logging.error("%s Failed to remove pump %s", self.host.guid, repr(result))
+        return True
 
-        Stealing one at a time prevents flapping because it reduces the difference between the
-        biggest and this host by two at a time. If the starting difference is two or greater,
-        then the difference cannot end up below 0. This host may become tied for biggest, but it
-        cannot become larger than the host that it is stealing from.
+    async def release_all_leases_async(self):
         """
-        counts_by_owner = self.count_leases_by_owner(stealable_leases)
-        biggest_owner = (sorted(counts_by_owner.items(), key=lambda kv: kv[1])).pop()
-        steal_this_lease = None
-        if (biggest_owner[1] - have_lease_count) >= 2:
-            steal_this_lease = [l for l in stealable_leases if l.owner == biggest_owner[0]][0]
-
-        return steal_this_lease
-
-    def count_leases_by_owner(self, leases):
+        Releases the leases we own concurrently, so other hosts take the partitions
+        without waiting for the leases to expire
         """
-        Returns a dictionary of leases by current owner
+        lease_manager = self.host.storage_manager
+        leases = [lease for lease, _ in self.owned_leases.values()]
+        self.owned_leases = {}
+        results = await self.gather_bounded_async(
+            [lease_manager.release_lease_async(lease) for lease in leases])
+        released = len([result for result in results if result is True])
+        logging.info("%s Released %d of %d leases", self.host.guid, released, len(leases))
+
+    async def steal_lease_async(self, steal_this_lease, lease_manager):
         """
-        owners = [l.owner for l in leases]
-        return dict(Counter(owners))
-
-    def attempt_renew_lease(self, lease_task, owned_by_others_q, lease_manager):
+        Acquires a lease chosen by the lease balancer
         """
-        Make attempt_renew_lease async call sync
-        """
-        loop = asyncio.new_event_loop()
-        loop.run_until_complete(self.attempt_renew_lease_async(lease_task, owned_by_others_q, lease_manager))
+        try:
+            logging.info("Lease to steal %s", str(steal_this_lease.serializable()))
+            acquired_at = time.time()
+            if await lease_manager.acquire_lease_async(steal_this_lease):
+                self.schedule_renewal(steal_this_lease, acquired_at)
+                logging.info("Stole lease sucessfully %s %s", self.host.guid,
+                             steal_this_lease.partition_id)
+            else:
+                logging.info("Failed to steal lease for partition %s %s",
+                             self.host.guid, steal_this_lease.partition_id)
+        except Exception as err:
+            logging.error("Failed to steal lease %s", repr(err))
 
-    async def attempt_renew_lease_async(self, lease_task, owned_by_others_q, lease_manager):
+    async def attempt_renew_lease_async(self, lease_task, lease_manager):
         """
-        Attempts to renew a potential lease if possible and
-        marks in the queue as none adds to adds to the queue
+        Attempts to acquire a potential lease if possible. Leases we own are renewed by
+        the renewal queue, only those not scheduled yet are renewed here.
+        Returns a tuple (owned by others, lease), or None if the lease could not be read
         """
         try:
             possible_lease = await lease_task
+            partition_id = possible_lease.partition_id
+            owned = self.owned_leases.get(partition_id)
             if possible_lease.is_expired():
-                logging.info("Trying to aquire lease %s %s", self.host.guid,
-                            possible_lease.partition_id)
+                logging.info("Trying to aquire lease %s %s", self.host.guid, partition_id)
+                acquired_at = time.time()
                 if await lease_manager.acquire_lease_async(possible_lease):
-                    owned_by_others_q.put((False, possible_lease))
-                else:
-                    owned_by_others_q.put((True, possible_lease))
+                    self.schedule_renewal(possible_lease, acquired_at)
+                    return (False, possible_lease)
+                self.owned_leases.pop(partition_id, None)
+                return (True, possible_lease)
 
             elif possible_lease.owner == self.host.host_name:
+                if owned:
+                    # Keep the renewal deadline, use the fresher lease from now on
+                    self.owned_leases[partition_id] = (possible_lease, owned[1])
+                    return (False, possible_lease)
                 try:
-                    logging.debug("Trying to renew lease %s %s", self.host.guid,
-                                  possible_lease.partition_id)
+                    # After a restart with the same host_name the leases still recorded under
+                    # it are reclaimed here, without waiting for them to expire
+                    logging.debug("Trying to renew lease %s %s", self.host.guid, partition_id)
+                    renewed_at = time.time()
                     if await lease_manager.renew_lease_async(possible_lease):
-                        owned_by_others_q.put((False, possible_lease))
-                    else:
-                        owned_by_others_q.put((True, possible_lease))
+                        self.schedule_renewal(possible_lease, renewed_at)
+                        return (False, possible_lease)
+                    return (True, possible_lease)
                 except Exception as err: #Update to LeaseLostException:
                     logging.error("Lease lost exception %s %s %s", repr(err),
-                                self.host.guid, possible_lease.partition_id)
-                    owned_by_others_q.put((True, possible_lease))
+                                  self.host.guid, partition_id)
+                    return (True, possible_lease)
             else:
-                owned_by_others_q.put((True, possible_lease))
+                self.owned_leases.pop(partition_id, None)
+                return (True, possible_lease)
 
         except Exception as err:
             logging.error("Failure during getting/acquiring/renewing lease,\
                         skipping %s", repr(err))
-
+        return None
@@ -0,0 +1,127 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import time
+import logging
+import asyncio
+from xml.etree import ElementTree
+
+class PartitionMetadataService:
+    """
+    Reads the event hub description from the Event Hubs REST API and caches the
+    partition ids for ttl seconds. Listeners are awaited with the new partition ids
+    whenever a refresh finds partitions that were not there before.
+    """
+    def __init__(self, eh_config, ttl=300, request_timeout=60):
+        self.eh_config = eh_config
+        self.ttl = ttl
+        self.request_timeout = request_timeout
+        self.partition_ids = None
+        self.refreshed_at = 0
+        self.listeners = []
+        self.request_session = None
+
+    def add_listener(self, listener):
+        """
+        Registers a coroutine function called with the list of added partition ids
+        """
+        self.listeners.append(listener)
+
+    def get_request_session(self):
+        """
+        Returns the pooled keep-alive session used for all REST calls, requests is
+        slow to import so it is loaded on first use
+        """
+        if not self.request_session:
+            import requests
+            self.request_session = requests.Session()
+            self.request_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4,
+                                                                                 pool_maxsize=4))
+        return self.request_session
+
+    def fetch_description(self, path, names):
+        """
+        Gets https://<namespace>.servicebus.windows.net/<path> and streams the ATOM response
+        through an incremental parser. Stops reading once all the requested elements were seen.
+        (Returns) dictionary of element local name to its element
+        """
+        headers = {"Content-Type": "application/json;type=entry;charset=utf-8",
+                   "Authorization": self.eh_config.rest_token,
+                   "Host": "{}.servicebus.windows.net".format(self.eh_config.sb_name)}
+        url = "https://{}.servicebus.windows.net/{}?timeout={}&api-version=2014-01".format(
+            self.eh_config.sb_name, path, self.request_timeout)
+        with self.get_request_session().get(url, headers=headers, stream=True,
+                                            timeout=self.request_timeout) as res:
+            res.raise_for_status()
+            return parse_description(res.iter_content(chunk_size=4096), names)
+
+    async def get_partition_ids_async(self):
+        """
+        Returns the cached partition ids, refreshing them once they are older than ttl.
+        A failed refresh keeps the previous ids, the first read raises on failure.
+        """
+        if self.partition_ids and time.time() - self.refreshed_at < self.ttl:
+            return self.partition_ids
+        try:
+            loop = asyncio.get_event_loop()
+            found = await loop.run_in_executor(None, self.fetch_description,
+                                               self.eh_config.eh_name, ["PartitionIds"])
+            partition_ids = [pid.text for pid in found["PartitionIds"]]
+        except Exception as err:
+            if not self.partition_ids:
+                raise Exception("failed to get partition ids", repr(err))
+            logging.error("Failed to refresh partition ids %s", repr(err))
+            self.refreshed_at = time.time()
+            return self.partition_ids
+
+        added = [pid for pid in partition_ids if pid not in (self.partition_ids or [])]
+        first_read = self.partition_ids is None
+        self.partition_ids = partition_ids
+        self.refreshed_at = time.time()
+        if added and not first_read:
+            logging.info("Partitions added %s", added)
+            for listener in self.listeners:
+                try:
+                    await listener(added)
+                except Exception as err:
+                    logging.error("Partition listener failed %s", repr(err))
+        return self.partition_ids
+
+    async def get_partition_runtime_info_async(self, consumer_group, partition_id):
+        """
+        Reads the runtime information of a partition, which is not cached.
+        (Returns) dictionary with the last_enqueued_sequence_number, last_enqueued_offset
+        and last_enqueued_time_utc of the partition
+        """
+        loop = asyncio.get_event_loop()
+        path = "{}/consumergroups/{}/partitions/{}".format(self.eh_config.eh_name,
+                                                            consumer_group, partition_id)
+        found = await loop.run_in_executor(None, self.fetch_description, path,
+                                           ["EndSequenceNumber", "LastEnqueuedOffset",
+                                            "LastEnqueuedTimeUtc"])
+        return {"last_enqueued_sequence_number": int(found["EndSequenceNumber"].text),
+                "last_enqueued_offset": found["LastEnqueuedOffset"].text,
+                "last_enqueued_time_utc": found["LastEnqueuedTimeUtc"].text}
+
+def parse_description(chunks, names):
+    """
+    Feeds the response chunks to an XMLPullParser and collects the first element
+    with each of the local names, ignoring namespaces.
+    (Returns) dictionary of element local name to its element
+    """
+    parser = ElementTree.XMLPullParser(events=("end",))
+    found = {}
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, element in parser.read_events():
+            name = element.tag.rpartition("}")[2]
+            if name in names and name not in found:
+                found[name] = element
+        if len(found) == len(names):
+            break
+    missing = [name for name in names if name not in found]
+    if missing:
+        raise ValueError("Missing elements in description %s" % missing)
+    return found
@@ -0,0 +1,98 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import time
+import threading
+import collections
+
+class PartitionMetrics:
+    """
+    Processing statistics of a partition, kept by its PartitionContext. Rates and
+    averages cover the batches and checkpoints of the last window seconds. Pumps running
+    in threads update the metrics while the host reads them.
+    """
+    def __init__(self, window=60):
+        self.window = window
+        self.started_at = time.time()
+        self.batches = collections.deque()
+        self.checkpoints = collections.deque()
+        self.buffered_events = 0
+        self.last_enqueued_sequence_number = None
+        self.last_enqueued_offset = None
+        self.last_enqueued_time_utc = None
+        self.runtime_info_at = None
+        self.lock = threading.Lock()
+
+    def record_batch(self, events, processor_latency):
+        """
+        Records a batch handed to the event processor and the seconds the processor took
+        """
+        now = time.time()
+        with self.lock:
+            self.batches.append((now, len(events), sum(event_size(e) for e in events),
+                                 processor_latency))
+            self._trim(self.batches, now)
+
+    def record_checkpoint(self, latency):
+        """
+        Records the seconds a checkpoint took to persist
+        """
+        now = time.time()
+        with self.lock:
+            self.checkpoints.append((now, latency))
+            self._trim(self.checkpoints, now)
+
+    def set_runtime_info(self, runtime_info):
+        """
+        Stores the last enqueued event of the partition read from the partition runtime info
+        """
+        self.last_enqueued_sequence_number = runtime_info["last_enqueued_sequence_number"]
+        self.last_enqueued_offset = runtime_info["last_enqueued_offset"]
+        self.last_enqueued_time_utc = runtime_info["last_enqueued_time_utc"]
+        self.runtime_info_at = time.time()
+
+    def snapshot(self, sequence_number, first_event_latency=None):
+        """
+        Summarizes the metrics, lag is counted from the given last processed sequence number.
+        (Returns) dictionary of metric name to value, None where nothing was recorded yet
+        """
+        now = time.time()
+        with self.lock:
+            self._trim(self.batches, now)
+            self._trim(self.checkpoints, now)
+            batches = list(self.batches)
+            checkpoints = list(self.checkpoints)
+        seconds = max(1e-3, min(self.window, now - self.started_at))
+        events = sum(b[1] for b in batches)
+        lag = None
+        if self.last_enqueued_sequence_number is not None and sequence_number is not None:
+            lag = max(0, self.last_enqueued_sequence_number - int(sequence_number))
+        return {
+            "events_per_second": events / seconds,
+            "bytes_per_second": sum(b[2] for b in batches) / seconds,
+            "batch_size": events / len(batches) if batches else None,
+            "processor_latency": sum(b[3] for b in batches) / len(batches) if batches else None,
+            "checkpoint_latency": (sum(c[1] for c in checkpoints) / len(checkpoints)
+                                   if checkpoints else None),
+            "first_event_latency": first_event_latency,
+            "buffered_events": self.buffered_events,
+            "sequence_number": sequence_number,
+            "last_enqueued_sequence_number": self.last_enqueued_sequence_number,
+            "last_enqueued_time_utc": self.last_enqueued_time_utc,
+            "lag": lag,
+            "runtime_info_age": None if self.runtime_info_at is None else now - self.runtime_info_at}
+
+    def _trim(self, records, now):
+        while records and records[0][0] < now - self.window:
+            records.popleft()
+
+def event_size(event):
+    """
+    The body size of an event in bytes, 0 if it has no sized body
+    """
+    try:
+        return len(event.body)
+    except (AttributeError, TypeError):
+        return 0
@@ -4,6 +4,7 @@
 # ---------------------
 
 from abc import  abstractmethod
+import time
 import logging
 import asyncio
 from eventprocessorhost.partition_context import PartitionContext
@@ -19,6 +20,8 @@ class PartitionPump():
         self.partition_context = None
         self.processor = None
         self.loop = None
+        self.run_task = None
+        self.dispatcher = None
 
     def run(self):
         """
@@ -27,6 +30,13 @@ class PartitionPump():
         self.loop = asyncio.new_event_loop()
         self.loop.run_until_complete(self.open_async())
 
+    async def run_async(self):
+        """
+        Runs the pump as a task on the host event loop
+        """
+        self.loop = self.host.loop
+        await self.open_async()
+
     def set_pump_status(self, status):
         """
         Updates pump status and logs update to console
@@ -39,6 +49,10 @@ class PartitionPump():
         Sets a new partition lease to be processed by the pump
         """
         if self.partition_context:
+            if self.partition_context.lease and \
+               self.partition_context.lease.token != new_lease.token:
+                # The lease was acquired again, another host may have checkpointed meanwhile
+                self.partition_context.last_checkpoint = None
             self.partition_context.lease = new_lease
 
     async def open_async(self):
@@ -97,6 +111,13 @@ class PartitionPump():
                           self.partition_context.partition_id, repr(err))
             raise err
 
+        try:
+            # Checkpoints the manager held back are written while the lease may still be held
+            await self.host.storage_manager.flush_async(self.lease.partition_id)
+        except Exception as err:
+            logging.error("%s %s Failed to flush checkpoints %s", self.host.guid,
+                          self.lease.partition_id, repr(err))
+
         if reason == "LeaseLost":
             try:
                 logging.info("Lease Lost releasing ownership")
@@ -119,7 +140,9 @@ class PartitionPump():
         """
         Process pump events.
         """
-        if events:
+        if events and self.dispatcher:
+            await self.dispatcher.dispatch_async(events)
+        elif events:
             # Synchronize to serialize calls to the processor. The handler is not installed until
             # after OpenAsync returns, so ProcessEventsAsync cannot conflict with OpenAsync. There
             # could be a conflict between ProcessEventsAsync and CloseAsync, however. All calls to
@@ -128,7 +151,9 @@ class PartitionPump():
                 last = events[-1]
                 if last != None:
                     self.partition_context.set_offset_and_sequence_number(last)
+                    started = time.time()
                     await self.processor.process_events_async(self.partition_context, events)
+                    self.partition_context.metrics.record_batch(events, time.time() - started)
             except Exception as err:
                 await self.process_error_async(err)
 
@@ -0,0 +1,373 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+"""
+Runs the partitions owned by a host in worker processes (EPHOptions.pump_mode = "process").
+The host keeps the leases and the run loop. Every worker runs its partitions as tasks on
+its own event loop, over its own EventHubClient and with its own event processor
+instances. Checkpoints made in a worker are forwarded to the host, which stores them
+with the lease it holds, and so are the partition metrics every metrics_interval
+seconds, the loads the host publishes for the LoadAwareLeaseBalancer lag by up to that
+much. The event processor class, its params and the host config
+are pickled to start the workers, so EPHOptions.event_key_function must be a module
+level function, not a lambda or a closure.
+"""
+
+import uuid
+import pickle
+import asyncio
+import logging
+import multiprocessing
+from eventprocessorhost.lease import Lease
+from eventprocessorhost.checkpoint import Checkpoint
+from eventprocessorhost.partition_context import PartitionContext
+from eventprocessorhost.partition_pump import PartitionPump
+from eventprocessorhost.abstract_checkpoint_manager import AbstractCheckpointManager
+
+class ProcessPartitionPump(PartitionPump):
+    """
+    Host side of a partition processed in a worker. Holds the lease and the partition
+    context the forwarded checkpoints are persisted with, no processor runs here.
+    """
+    def __init__(self, host, lease, worker_pool):
+        PartitionPump.__init__(self, host, lease)
+        self.worker_pool = worker_pool
+
+    async def open_async(self):
+        """
+        Reads the initial offset and hands the partition to a worker
+        """
+        self.set_pump_status("Opening")
+        self.partition_context = ForwardedPartitionContext(self.host, self.lease.partition_id,
+                                                           self.host.eh_config.client_address,
+                                                           self.host.eh_config.consumer_group,
+                                                           self.loop)
+        self.partition_context.lease = self.lease
+        await self.on_open_async()
+
+    async def on_open_async(self):
+        await self.partition_context.get_initial_offset_async()
+        self.set_pump_status("Running")
+        self.worker_pool.open(self)
+
+    async def on_closing_async(self, reason):
+        await self.worker_pool.close_async(self.lease.partition_id, reason)
+
+    async def process_error_async(self, error):
+        """
+        Worker errors are handled by the processor in the worker, only log them here
+        """
+        logging.error("%s %s Partition worker error %s", self.host.guid,
+                      self.lease.partition_id, repr(error))
+
+class ForwardedPartitionContext(PartitionContext):
+    """
+    Partition context of a ProcessPartitionPump, its metrics are the last ones the
+    worker forwarded
+    """
+    def __init__(self, host, partition_id, eh_path, consumer_group_name, pump_loop=None):
+        PartitionContext.__init__(self, host, partition_id, eh_path, consumer_group_name,
+                                  pump_loop)
+        self.forwarded_metrics = None
+
+    def get_metrics(self):
+        if self.forwarded_metrics is None:
+            return PartitionContext.get_metrics(self)
+        return self.forwarded_metrics
+
+class PartitionWorkerPool:
+    """
+    Starts the worker processes, assigns partitions to the least loaded worker and
+    persists the checkpoints and metrics the workers forward.
+    """
+    def __init__(self, host, processes=None, pump_factory=None, close_timeout=30,
+                 metrics_interval=5):
+        self.host = host
+        self.processes = processes or multiprocessing.cpu_count()
+        self.pump_factory = pump_factory
+        self.close_timeout = close_timeout
+        self.metrics_interval = metrics_interval
+        self.context = multiprocessing.get_context("spawn")
+        self.results = None
+        self.workers = []
+        self.pumps = {}
+        self.closing = {}
+        self.dispatch_task = None
+
+    def start(self):
+        """
+        Starts the workers and the task dispatching their messages
+        """
+        settings = WorkerSettings(self.host, self.pump_factory, self.metrics_interval)
+        settings.check_picklable()
+        self.results = self.context.Queue()
+        for index in range(self.processes):
+            commands = self.context.Queue()
+            process = self.context.Process(target=run_worker,
+                                           args=(index, settings, commands, self.results),
+                                           name="eph-worker-%d" % index, daemon=True)
+            process.start()
+            self.workers.append((process, commands, set()))
+        self.dispatch_task = self.host.loop.create_task(self.dispatch_async())
+        logging.info("%s Started %d partition workers", self.host.guid, self.processes)
+
+    def open(self, pump):
+        """
+        Starts processing the partition of the pump in the least loaded worker
+        """
+        partition_id = pump.lease.partition_id
+        _, commands, partition_ids = min(self.workers, key=lambda w: len(w[2]))
+        partition_ids.add(partition_id)
+        self.pumps[partition_id] = pump
+        commands.put(("open", partition_id, pump.partition_context.offset,
+                      pump.partition_context.sequence_number))
+
+    async def close_async(self, partition_id, reason):
+        """
+        Stops processing the partition and waits until the worker closed its processor,
+        so the checkpoints it made while closing are persisted with the lease still held
+        """
+        for _, commands, partition_ids in self.workers:
+            if partition_id in partition_ids:
+                partition_ids.discard(partition_id)
+                closed = self.host.loop.create_future()
+                self.closing[partition_id] = closed
+                commands.put(("close", partition_id, reason))
+                try:
+                    await asyncio.wait_for(closed, self.close_timeout)
+                except asyncio.TimeoutError:
+                    logging.error("%s %s Partition worker did not close in time",
+                                  self.host.guid, partition_id)
+                finally:
+                    self.closing.pop(partition_id, None)
+        self.pumps.pop(partition_id, None)
+
+    async def dispatch_async(self):
+        """
+        Handles the messages of all workers in the order they were sent
+        """
+        while True:
+            message = await self.host.loop.run_in_executor(None, self.results.get)
+            if message is None:
+                break
+            kind, partition_id = message[0], message[1]
+            pump = self.pumps.get(partition_id)
+            if kind == "checkpoint" and pump:
+                try:
+                    await pump.partition_context.persist_checkpoint_async(
+                        Checkpoint(partition_id, message[2], message[3]))
+                except Exception as err:
+                    logging.error("%s %s Failed to persist forwarded checkpoint %s",
+                                  self.host.guid, partition_id, repr(err))
+            elif kind == "metrics" and pump:
+                pump.partition_context.forwarded_metrics = message[2]
+            elif kind == "error" and pump:
+                await pump.process_error_async(message[2])
+                # The run loop replaces errored pumps
+                pump.set_pump_status("Errored")
+            elif kind == "closed" and partition_id in self.closing:
+                self.closing[partition_id].set_result(None)
+
+    async def stop_async(self):
+        """
+        Stops the workers, their partitions are closed with reason Shutdown. The workers
+        are joined on the default executor, the host loop keeps running meanwhile.
+        """
+        for _, commands, _ in self.workers:
+            commands.put(("stop",))
+        await asyncio.gather(*[self.host.loop.run_in_executor(None, process.join, self.close_timeout)
+                               for process, _, _ in self.workers])
+        for process, _, _ in self.workers:
+            if process.is_alive():
+                process.terminate()
+        self.workers = []
+        if self.results:
+            self.results.put(None)
+        if self.dispatch_task:
+            await self.dispatch_task
+            self.dispatch_task = None
+
+class WorkerSettings:
+    """
+    The picklable part of the host a worker needs
+    """
+    def __init__(self, host, pump_factory=None, metrics_interval=5):
+        self.eh_config = host.eh_config
+        self.eph_options = host.eph_options
+        self.event_processor = host.event_processor
+        self.event_processor_params = host.event_processor_params
+        self.guid = host.guid
+        self.host_name = host.host_name
+        self.pump_factory = pump_factory
+        self.metrics_interval = metrics_interval
+
+    def check_picklable(self):
+        """
+        Raises ValueError if the settings cannot be sent to the workers
+        """
+        if self.eph_options.event_key_function:
+            try:
+                pickle.dumps(self.eph_options.event_key_function)
+            except (pickle.PicklingError, AttributeError, TypeError) as err:
+                raise ValueError("EPHOptions.event_key_function must be a module level function "
+                                 "in the process pump mode: {}".format(repr(err)))
+        try:
+            pickle.dumps(self)
+        except (pickle.PicklingError, AttributeError, TypeError) as err:
+            raise ValueError("The event processor, its params and the EPHOptions must be "
+                             "picklable in the process pump mode: {}".format(repr(err)))
+
+class ForwardingCheckpointManager(AbstractCheckpointManager):
+    """
+    Checkpoint manager of a worker. Starts from the checkpoint the host sent with the
+    partition and forwards every update to the host.
+    """
+    def __init__(self, results):
+        AbstractCheckpointManager.__init__(self)
+        self.results = results
+        self.checkpoints = {}
+
+    async def create_checkpoint_store_if_not_exists_async(self):
+        return True
+
+    async def get_checkpoint_async(self, partition_id):
+        return self.checkpoints.get(partition_id)
+
+    async def create_checkpoint_if_not_exists_async(self, partition_id):
+        if partition_id not in self.checkpoints:
+            self.checkpoints[partition_id] = Checkpoint(partition_id)
+        return self.checkpoints[partition_id]
+
+    async def update_checkpoint_async(self, lease, checkpoint):
+        self.checkpoints[checkpoint.partition_id] = checkpoint
+        self.results.put(("checkpoint", checkpoint.partition_id, checkpoint.offset,
+                          checkpoint.sequence_number))
+
+    async def delete_checkpoint_async(self, partition_id):
+        return
+
+    async def release_lease_async(self, lease):
+        """
+        The host releases the lease it holds
+        """
+        return True
+
+class WorkerHost:
+    """
+    Stands in for EventProcessorHost in a worker. Its pumps run on the worker loop
+    and share one EventHubClient.
+    """
+    def __init__(self, index, settings, results, loop):
+        self.eh_config = settings.eh_config
+        self.eph_options = settings.eph_options
+        self.eph_options.pump_mode = "loop"
+        self.event_processor = settings.event_processor
+        self.event_processor_params = settings.event_processor_params
+        self.guid = "{}-worker{}".format(settings.guid, index)
+        self.host_name = settings.host_name
+        self.loop = loop
+        self.pump_factory = settings.pump_factory
+        self.metrics_interval = settings.metrics_interval
+        self.results = results
+        self.storage_manager = ForwardingCheckpointManager(results)
+        self.partition_manager = self
+        self.partition_pumps = {}
+        self.shared_client = None
+
+    def create_pump(self, lease):
+        """
+        Creates the pump of a partition assigned to this worker
+        """
+        if self.pump_factory:
+            return self.pump_factory(self, lease)
+        from eventprocessorhost.eh_partition_pump import EventHubPartitionPump
+        return EventHubPartitionPump(self, lease)
+
+    def open_partition(self, partition_id, offset, sequence_number):
+        """
+        Starts a pump from the offset the host read from its checkpoint store
+        """
+        self.storage_manager.checkpoints[partition_id] = Checkpoint(partition_id, offset,
+                                                                    sequence_number)
+        lease = Lease()
+        lease.with_partition_id(partition_id)
+        lease.owner = self.host_name
+        lease.token = str(uuid.uuid4())
+        pump = self.create_pump(lease)
+        self.partition_pumps[partition_id] = pump
+        pump.run_task = self.loop.create_task(pump.run_async())
+        pump.run_task.add_done_callback(lambda task: self.on_pump_done(partition_id, pump))
+
+    def on_pump_done(self, partition_id, pump):
+        """
+        A pump that ends without being closed failed, the host replaces it
+        """
+        if self.partition_pumps.get(partition_id) is pump:
+            del self.partition_pumps[partition_id]
+            self.results.put(("error", partition_id,
+                              "Partition pump stopped with status {}".format(pump.pump_status)))
+
+    async def close_partition_async(self, partition_id, reason):
+        """
+        Closes the pump and its processor and tells the host
+        """
+        pump = self.partition_pumps.pop(partition_id, None)
+        if pump:
+            try:
+                if not pump.is_closing():
+                    await pump.close_async(reason)
+            except Exception as err:
+                logging.error("%s %s Failed to close pump %s", self.guid, partition_id, repr(err))
+            pump.run_task.cancel()
+        self.results.put(("closed", partition_id))
+
+    async def forward_metrics_async(self):
+        """
+        Sends the metrics of the partitions to the host every metrics_interval
+        """
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            for partition_id, pump in list(self.partition_pumps.items()):
+                if pump.partition_context:
+                    self.results.put(("metrics", partition_id,
+                                      pump.partition_context.get_metrics()))
+
+    async def run_async(self, commands):
+        """
+        Executes the host commands until told to stop
+        """
+        forwarding = self.loop.create_task(self.forward_metrics_async())
+        try:
+            await self.run_commands_async(commands)
+        finally:
+            forwarding.cancel()
+
+    async def run_commands_async(self, commands):
+        """
+        Executes the host commands until told to stop
+        """
+        while True:
+            command = await self.loop.run_in_executor(None, commands.get)
+            if command[0] == "open":
+                self.open_partition(*command[1:])
+            elif command[0] == "close":
+                await self.close_partition_async(*command[1:])
+            elif command[0] == "stop":
+                for partition_id in list(self.partition_pumps):
+                    await self.close_partition_async(partition_id, "Shutdown")
+                if self.shared_client:
+                    self.shared_client.stop()
+                return
+
+def run_worker(index, settings, commands, results):
+    """
+    Entry point of a worker process
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(WorkerHost(index, settings, results, loop).run_async(commands))
+    finally:
+        loop.close()
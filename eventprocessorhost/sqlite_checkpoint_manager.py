@@ -0,0 +1,287 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import concurrent.futures
+from eventprocessorhost.timed_lease import TimedLease
+from eventprocessorhost.checkpoint import Checkpoint
+from eventprocessorhost.abstract_lease_manager import AbstractLeaseManager
+from eventprocessorhost.abstract_checkpoint_manager import AbstractCheckpointManager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    consumer_group TEXT NOT NULL,
+    partition_id TEXT NOT NULL,
+    owner TEXT,
+    token TEXT,
+    epoch INTEGER NOT NULL DEFAULT 0,
+    expiration REAL NOT NULL DEFAULT 0,
+    checkpoint_offset TEXT,
+    checkpoint_sequence_number INTEGER,
+    load REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (consumer_group, partition_id)
+)
+"""
+
+COLUMNS = ("partition_id, owner, token, epoch, expiration, checkpoint_offset, checkpoint_sequence_number, "
+           "load")
+
+class SqliteCheckpointLeaseManager(AbstractCheckpointManager, AbstractLeaseManager):
+    """
+    Manages checkpoints and leases in a local SQLite database, for single machine and
+    edge deployments without a storage account. Leases have the same semantics as the
+    Azure Storage manager: a lease is held through a token until it expires, and acquiring
+    a lease owned by another host requires the token seen when scanning. Hosts in several
+    processes can share the database file, SQLite file locks serialize their updates.
+    The database runs in WAL mode with synchronous=FULL so a stored checkpoint survives
+    a power loss. Each manager runs its queries on its own thread.
+    """
+    def __init__(self, database_path, lease_renew_interval=10, lease_duration=30, busy_timeout=10):
+        AbstractCheckpointManager.__init__(self)
+        AbstractLeaseManager.__init__(self, lease_renew_interval, lease_duration)
+        self.database_path = database_path
+        self.busy_timeout = busy_timeout
+        self.host = None
+        self.consumer_group = None
+        self.connection = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def initialize(self, host):
+        """
+        Binds the manager to its EventProcessorHost
+        """
+        self.host = host
+        self.consumer_group = host.eh_config.consumer_group
+
+    async def run_query_async(self, func, *args):
+        """
+        Runs func(connection, *args) on the manager thread, which owns the connection
+        (Returns) the result of func
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self.run_query, func, args)
+
+    def run_query(self, func, args):
+        if not self.connection:
+            self.connection = sqlite3.connect(self.database_path, timeout=self.busy_timeout,
+                                              isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=FULL")
+            self.connection.execute(SCHEMA)
+        return func(self.connection, *args)
+
+    def close(self):
+        """
+        Closes the database connection and stops its thread, the manager cannot be
+        used afterwards
+        """
+        def close_connection():
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+        self.executor.submit(close_connection).result()
+        self.executor.shutdown(wait=True)
+
+    def select(self, connection, partition_id):
+        row = connection.execute("SELECT " + COLUMNS + " FROM leases WHERE consumer_group = ? "
+                                 "AND partition_id = ?", (self.consumer_group, partition_id)).fetchone()
+        return to_lease(row) if row else None
+
+    def update(self, connection, assignments, values, lease):
+        """
+        Updates the row of the lease if the lease token still matches.
+        (Returns) true if the row was updated
+        """
+        cursor = connection.execute("UPDATE leases SET " + assignments + " WHERE consumer_group = ? "
+                                    "AND partition_id = ? AND token = ?",
+                                    tuple(values) + (self.consumer_group, lease.partition_id,
+                                                     lease.token))
+        return cursor.rowcount == 1
+
+    # Checkpoint Managment Methods
+
+    async def create_checkpoint_store_if_not_exists_async(self):
+        """
+        Create the checkpoint store if it doesn't exist. Do nothing if it does exist.
+        """
+        await self.create_lease_store_if_not_exists_async()
+
+    async def get_checkpoint_async(self, partition_id):
+        """
+        Get the checkpoint data associated with the given partition.
+        (Returns) Given partition checkpoint info, or null if none has been previously stored.
+        """
+        lease = await self.get_lease_async(partition_id)
+        checkpoint = None
+        if lease and lease.offset:
+            checkpoint = Checkpoint(partition_id, lease.offset, lease.sequence_number)
+        return checkpoint
+
+    async def create_checkpoint_if_not_exists_async(self, partition_id):
+        """
+        Create the given partition checkpoint if it doesn't exist. Do nothing if it does exist.
+        (Returns) The checkpoint for the given partition, whether newly created or already existing.
+        """
+        checkpoint = await self.get_checkpoint_async(partition_id)
+        if not checkpoint:
+            await self.create_lease_if_not_exists_async(partition_id)
+            checkpoint = Checkpoint(partition_id)
+        return checkpoint
+
+    async def update_checkpoint_async(self, lease, checkpoint):
+        """
+        Update the checkpoint in the store with the offset/sequenceNumber in the provided checkpoint.
+        One statement checks the lease token and writes the checkpoint.
+        (Returns) true if the checkpoint was stored, false if the lease was lost
+        """
+        return await self.run_query_async(
+            self.update, "checkpoint_offset = ?, checkpoint_sequence_number = ?, load = ?",
+            (checkpoint.offset, checkpoint.sequence_number, lease.load), lease)
+
+    async def delete_checkpoint_async(self, partition_id):
+        """
+        Checkpoints live in the lease, deleting them is a no-op.
+        """
+        return
+
+    # Lease Managment Methods
+
+    async def create_lease_store_if_not_exists_async(self):
+        """
+        The table is created with the connection.
+        """
+        await self.run_query_async(lambda connection: None)
+        return True
+
+    async def delete_lease_store_async(self):
+        """
+        Delete all leases of the consumer group.
+        """
+        await self.run_query_async(lambda connection: connection.execute(
+            "DELETE FROM leases WHERE consumer_group = ?", (self.consumer_group,)))
+        return True
+
+    async def get_lease_async(self, partition_id):
+        """
+        Return the lease info for the specified partition, or None.
+        """
+        return await self.run_query_async(self.select, partition_id)
+
+    async def get_all_leases(self):
+        """
+        Return the lease info for all partitions, read with a single query.
+        (Returns) list of lease info.
+        """
+        partition_ids = await self.host.partition_manager.get_partition_ids_async()
+        rows = await self.run_query_async(lambda connection: connection.execute(
+            "SELECT " + COLUMNS + " FROM leases WHERE consumer_group = ?",
+            (self.consumer_group,)).fetchall())
+        leases = dict((row[0], to_lease(row)) for row in rows)
+        return [completed(leases.get(partition_id)) for partition_id in partition_ids]
+
+    async def create_lease_if_not_exists_async(self, partition_id):
+        """
+        Create in the store the lease info for the given partition, if it does not exist.
+        (Returns) the existing or newly-created lease info for the partition
+        """
+        def create(connection):
+            connection.execute("INSERT OR IGNORE INTO leases (consumer_group, partition_id) "
+                               "VALUES (?, ?)", (self.consumer_group, partition_id))
+            return self.select(connection, partition_id)
+        return await self.run_query_async(create)
+
+    async def delete_lease_async(self, lease):
+        """
+        Delete the lease info for the given partition from the store.
+        """
+        await self.run_query_async(lambda connection: connection.execute(
+            "DELETE FROM leases WHERE consumer_group = ? AND partition_id = ?",
+            (self.consumer_group, lease.partition_id)))
+
+    async def acquire_lease_async(self, lease):
+        """
+        Acquire the lease on the desired partition for this EventProcessorHost.
+        (Returns) true if the lease was acquired successfully, false if not
+        """
+        def acquire(connection):
+            # IMMEDIATE takes the write lock before reading, no other process can
+            # acquire the lease between the check and the update
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                stored = self.select(connection, lease.partition_id)
+                if not stored:
+                    return False
+                if not stored.is_expired() and stored.token and stored.token != lease.token:
+                    logging.info("Lease %s changed owner since it was read", lease.partition_id)
+                    return False
+                stored.token = str(uuid.uuid4())
+                stored.owner = self.host.host_name
+                stored.increment_epoch()
+                stored.expiration = time.time() + self.lease_duration
+                connection.execute("UPDATE leases SET owner = ?, token = ?, epoch = ?, expiration = ? "
+                                   "WHERE consumer_group = ? AND partition_id = ?",
+                                   (stored.owner, stored.token, stored.epoch, stored.expiration,
+                                    self.consumer_group, stored.partition_id))
+                connection.execute("COMMIT")
+                lease.with_source(stored)
+                return True
+            finally:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+        return await self.run_query_async(acquire)
+
+    async def renew_lease_async(self, lease):
+        """
+        Renew a lease currently held by this host.
+        (Returns) true if the lease was renewed successfully, false if not
+        """
+        if not lease.token:
+            return False
+        expiration = time.time() + self.lease_duration
+        if await self.run_query_async(self.update, "expiration = ?", (expiration,), lease):
+            lease.expiration = expiration
+            return True
+        return False
+
+    async def release_lease_async(self, lease):
+        """
+        Give up a lease currently held by this host.
+        (Returns) true if the lease was released successfully, false if not
+        """
+        if not lease.token:
+            return False
+        return await self.run_query_async(self.update, "owner = NULL, token = NULL, expiration = 0, load = 0",
+                                          (), lease)
+
+    async def update_lease_async(self, lease):
+        """
+        Update the store with the information in the provided lease. The lease is renewed
+        as part of the update.
+        (Returns) true if the updated was performed successfully, false if not.
+        """
+        if lease is None or not lease.token:
+            return False
+        return await self.run_query_async(
+            self.update, "checkpoint_offset = ?, checkpoint_sequence_number = ?, load = ?, expiration = ?",
+            (lease.offset, lease.sequence_number, lease.load, time.time() + self.lease_duration), lease)
+
+def to_lease(row):
+    """
+    Builds a lease from a row of the leases table
+    """
+    lease = TimedLease()
+    (lease.partition_id, lease.owner, lease.token, lease.epoch, lease.expiration,
+     lease.offset, lease.sequence_number, lease.load) = row
+    return lease
+
+async def completed(value):
+    """
+    Wraps a value already read in the coroutine get_all_leases returns for each partition
+    """
+    return value
@@ -0,0 +1,46 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import asyncio
+import unittest
+from eventprocessorhost.eph import EPHOptions
+
+class MockConfig:
+    """
+    The config attributes used by the lease managers
+    """
+    consumer_group = "$default"
+
+class MockPartitionManager:
+    """
+    Partition ids for get_all_leases
+    """
+    async def get_partition_ids_async(self):
+        return ["0", "1"]
+
+class MockHost:
+    """
+    The host attributes used by the lease managers and the partition context
+    """
+    def __init__(self, host_name, storage_manager=None):
+        self.host_name = host_name
+        self.guid = host_name
+        self.eh_config = MockConfig()
+        self.eph_options = EPHOptions()
+        self.partition_manager = MockPartitionManager()
+        self.storage_manager = storage_manager
+
+class EventLoopTestCase(unittest.TestCase):
+    """
+    Runs each test with a new event loop
+    """
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self._loop.close()
+
+    def _run(self, coro):
+        return self._loop.run_until_complete(coro)
@@ -0,0 +1,143 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import json
+import unittest
+import threading
+import concurrent.futures
+from types import SimpleNamespace
+from mock_host import MockHost, EventLoopTestCase
+from eventprocessorhost.checkpoint import Checkpoint
+from eventprocessorhost.azure_storage_checkpoint_manager import AzureStorageCheckpointLeaseManager
+
+class FakeBlockBlobService:
+    """
+    In-memory stand-in for the BlockBlobService calls of the lease manager, with the
+    lease id and ETag conditions of the storage service
+    """
+    def __init__(self):
+        self.blobs = {}
+        self.etags = 0
+        self.lock = threading.Lock()
+
+    def _etag(self):
+        self.etags += 1
+        return str(self.etags)
+
+    def _check_lease(self, blob, lease_id):
+        if blob["lease_id"] and blob["lease_id"] != lease_id:
+            raise Exception("LeaseIdMismatchWithLeaseOperation")
+
+    def _read(self, name):
+        blob = self.blobs[name]
+        lease = SimpleNamespace(state="leased" if blob["lease_id"] else "available")
+        return SimpleNamespace(name=name, content=blob["content"], metadata=dict(blob["metadata"]),
+                               properties=SimpleNamespace(etag=blob["etag"], lease=lease))
+
+    def create_blob_from_text(self, container, name, text, metadata=None, lease_id=None,
+                              if_match=None):
+        with self.lock:
+            blob = self.blobs.setdefault(name, {"lease_id": None, "etag": None})
+            self._check_lease(blob, lease_id)
+            if if_match and if_match != blob["etag"]:
+                raise Exception("ConditionNotMet")
+            blob.update(content=text, metadata=metadata or {}, etag=self._etag())
+            return SimpleNamespace(etag=blob["etag"])
+
+    def get_blob_to_text(self, container, name):
+        with self.lock:
+            return self._read(name)
+
+    def get_blob_properties(self, container, name):
+        with self.lock:
+            return self._read(name)
+
+    def list_blobs(self, container, include=None):
+        with self.lock:
+            return [self._read(name) for name in sorted(self.blobs)]
+
+    def acquire_blob_lease(self, container, name, lease_duration, proposed_lease_id):
+        with self.lock:
+            if self.blobs[name]["lease_id"]:
+                raise Exception("LeaseAlreadyPresent")
+            self.blobs[name]["lease_id"] = proposed_lease_id
+            return proposed_lease_id
+
+    def change_blob_lease(self, container, name, lease_id, proposed_lease_id):
+        with self.lock:
+            if self.blobs[name]["lease_id"] != lease_id:
+                raise Exception("LeaseIdMismatchWithLeaseOperation")
+            self.blobs[name]["lease_id"] = proposed_lease_id
+
+    def renew_blob_lease(self, container, name, lease_id, timeout=None):
+        with self.lock:
+            if self.blobs[name]["lease_id"] != lease_id:
+                raise Exception("LeaseIdMismatchWithLeaseOperation")
+
+    def release_blob_lease(self, container, name, lease_id):
+        with self.lock:
+            if self.blobs[name]["lease_id"] != lease_id:
+                raise Exception("LeaseIdMismatchWithLeaseOperation")
+            self.blobs[name]["lease_id"] = None
+
+class AzureBlobLeaseOperationsTestCase(EventLoopTestCase):
+    """Tests for the lease operations of `azure_storage_checkpoint_manager.py`."""
+
+    def setUp(self):
+        EventLoopTestCase.setUp(self)
+        self._storage = FakeBlockBlobService()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self._first = self._manager("first")
+        self._second = self._manager("second")
+        self._third = self._manager("third")
+
+    def tearDown(self):
+        self._executor.shutdown()
+        EventLoopTestCase.tearDown(self)
+
+    def _manager(self, host_name):
+        # initialize would connect to the storage account, set what it sets instead
+        manager = AzureStorageCheckpointLeaseManager("account", "key", "leases")
+        manager.host = MockHost(host_name)
+        manager.storage_client = self._storage
+        manager.storage_executor = self._executor
+        return manager
+
+    def _stored(self, partition_id):
+        return json.loads(self._storage.blobs[partition_id]["content"])
+
+    def test_steal_fails_after_owner_change(self):
+        """
+        Test that a steal fails when the lease changed hands after the scan
+        """
+        lease = self._run(self._first.create_lease_if_not_exists_async("0"))
+        self.assertTrue(self._run(self._first.acquire_lease_async(lease)))
+        scanned_by_second = self._run(self._second.get_lease_async("0"))
+        scanned_by_third = self._run(self._third.get_lease_async("0"))
+        self.assertTrue(self._run(self._second.acquire_lease_async(scanned_by_second)))
+        self.assertFalse(self._run(self._third.acquire_lease_async(scanned_by_third)))
+        self.assertEqual(self._stored("0")["owner"], "second")
+        self.assertEqual(self._stored("0")["epoch"], 2)
+        self.assertTrue(self._run(self._second.renew_lease_async(scanned_by_second)))
+
+    def test_release_keeps_checkpoint(self):
+        """
+        Test that releasing a lease read from the listing keeps the stored checkpoint
+        """
+        lease = self._run(self._first.create_lease_if_not_exists_async("0"))
+        self.assertTrue(self._run(self._first.acquire_lease_async(lease)))
+        self._run(self._first.update_checkpoint_async(lease, Checkpoint("0", "12345", 99)))
+        listed = self._run(self._first.get_listed_lease_async("0", self._storage.list_blobs("leases")[0]))
+        self.assertIsNone(listed.offset)
+        self.assertTrue(self._run(self._first.release_lease_async(listed)))
+        stored = self._stored("0")
+        self.assertEqual((stored["offset"], stored["sequence_number"]), ("12345", 99))
+        self.assertIsNone(stored["owner"])
+        self.assertIsNone(self._storage.blobs["0"]["lease_id"])
+        checkpoint = self._run(self._second.get_checkpoint_async("0"))
+        self.assertEqual((checkpoint.offset, checkpoint.sequence_number), ("12345", 99))
+
+if __name__ == '__main__':
+    unittest.main()
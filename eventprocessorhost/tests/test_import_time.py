@@ -0,0 +1,55 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+IMPORT_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+import eventprocessorhost.eph
+import eventprocessorhost.eh_config
+import eventprocessorhost.partition_manager
+import eventprocessorhost.partition_metadata_service
+import eventprocessorhost.azure_storage_checkpoint_manager
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "modules": list(sys.modules)}))
+"""
+
+class ImportTimeTestCase(unittest.TestCase):
+    """Guards the import cost of `eventprocessorhost`."""
+
+    # Generous budget, a regression pulling in the storage SDK or proton costs far more.
+    MAX_IMPORT_SECONDS = 1.0
+    HEAVY_MODULES = ["bs4", "lxml", "requests", "azure", "proton", "eventhubs"]
+
+    def _import(self):
+        output = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT], cwd=REPO_ROOT)
+        return json.loads(output.decode("utf-8"))
+
+    def test_no_heavy_imports(self):
+        """
+        Test that importing the host modules does not load the heavy dependencies
+        """
+        modules = self._import()["modules"]
+        for name in self.HEAVY_MODULES:
+            loaded = [m for m in modules if m == name or m.startswith(name + ".")]
+            self.assertEqual(loaded, [], "%s imported eagerly" % name)
+
+    def test_import_time(self):
+        """
+        Test that importing the host modules stays within the time budget
+        """
+        elapsed = min(self._import()["elapsed"] for _ in range(3))
+        self.assertLess(elapsed, self.MAX_IMPORT_SECONDS,
+                        "Import took %.1f ms" % (elapsed * 1000))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import time
+import asyncio
+import unittest
+from mock_host import MockHost, EventLoopTestCase
+from eventprocessorhost.checkpoint import Checkpoint
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryCheckpointLeaseManager
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryLeaseStore
+from eventprocessorhost.cluster_simulator import ClusterSimulator, SimulatedConfig
+from eventprocessorhost.partition_manager import PartitionManager
+
+class InMemoryCheckpointLeaseManagerTestCase(EventLoopTestCase):
+    """Tests for `in_memory_checkpoint_manager.py`."""
+
+    def setUp(self):
+        EventLoopTestCase.setUp(self)
+        self._store = InMemoryLeaseStore()
+        self._first = InMemoryCheckpointLeaseManager(self._store, 1, 0.5)
+        self._first.initialize(MockHost("first"))
+        self._second = InMemoryCheckpointLeaseManager(self._store, 1, 0.5)
+        self._second.initialize(MockHost("second"))
+
+    def test_acquire_and_renew(self):
+        """
+        Test that an acquired lease can only be renewed by its owner
+        """
+        lease = self._run(self._first.create_lease_if_not_exists_async("0"))
+        self.assertTrue(lease.is_expired())
+        self.assertTrue(self._run(self._first.acquire_lease_async(lease)))
+        self.assertEqual(lease.owner, "first")
+        self.assertEqual(lease.epoch, 1)
+        self.assertFalse(lease.is_expired())
+        self.assertTrue(self._run(self._first.renew_lease_async(lease)))
+        other = self._run(self._second.get_lease_async("0"))
+        other.token = "not the owner"
+        self.assertFalse(self._run(self._second.renew_lease_async(other)))
+
+    def test_steal_requires_scanned_token(self):
+        """
+        Test that stealing fails when the lease changed hands after it was read
+        """
+        lease = self._run(self._first.create_lease_if_not_exists_async("0"))
+        self._run(self._first.acquire_lease_async(lease))
+        scanned = self._run(self._second.get_lease_async("0"))
+        self._run(self._first.acquire_lease_async(lease))
+        self.assertFalse(self._run(self._second.acquire_lease_async(scanned)))
+        scanned = self._run(self._second.get_lease_async("0"))
+        self.assertTrue(self._run(self._second.acquire_lease_async(scanned)))
+        self.assertFalse(self._run(self._first.renew_lease_async(lease)))
+
+    def test_expiry(self):
+        """
+        Test that an expired lease can be acquired without its token
+        """
+        lease = self._run(self._first.create_lease_if_not_exists_async("0"))
+        self._run(self._first.acquire_lease_async(lease))
+        time.sleep(0.6)
+        stale = self._run(self._second.get_lease_async("0"))
+        stale.token = None
+        self.assertTrue(stale.is_expired())
+        self.assertTrue(self._run(self._second.acquire_lease_async(stale)))
+
+    def test_checkpoint(self):
+        """
+        Test that checkpoints are stored in the lease by its owner only
+        """
+        self._run(self._first.create_checkpoint_if_not_exists_async("0"))
+        self.assertIsNone(self._run(self._first.get_checkpoint_async("0")))
+        lease = self._run(self._first.get_lease_async("0"))
+        self._run(self._first.acquire_lease_async(lease))
+        self.assertTrue(self._run(self._first.update_checkpoint_async(lease, Checkpoint("0", "42", 7))))
+        checkpoint = self._run(self._second.get_checkpoint_async("0"))
+        self.assertEqual((checkpoint.offset, checkpoint.sequence_number), ("42", 7))
+        lease.token = "stale"
+        self.assertFalse(self._run(self._first.update_checkpoint_async(lease, Checkpoint("0", "50", 9))))
+
+class MockPartitionManagerHost(MockHost):
+    """
+    The host attributes used by the partition manager
+    """
+    def __init__(self, host_name, storage_manager, loop):
+        MockHost.__init__(self, host_name, storage_manager)
+        self.eh_config = SimulatedConfig()
+        self.loop = loop
+        storage_manager.initialize(self)
+
+class LeaseRenewalTestCase(EventLoopTestCase):
+    """Tests for the lease renewal queue of `partition_manager.py`."""
+
+    def setUp(self):
+        EventLoopTestCase.setUp(self)
+        self._store = InMemoryLeaseStore()
+        self._host = MockPartitionManagerHost("first", InMemoryCheckpointLeaseManager(self._store, 0.2, 1),
+                                              self._loop)
+        self._manager = PartitionManager(self._host)
+
+    def _acquire(self, partition_id):
+        lease_manager = self._host.storage_manager
+        self._loop.run_until_complete(lease_manager.create_lease_if_not_exists_async(partition_id))
+        return self._loop.run_until_complete(self._manager.attempt_renew_lease_async(
+            lease_manager.get_lease_async(partition_id), lease_manager))
+
+    def test_renewal_follows_acquisition(self):
+        """
+        Test that each lease is renewed lease_renew_interval after it was acquired or renewed
+        """
+        self.assertFalse(self._acquire("0")[0])
+        time.sleep(0.1)
+        self._acquire("1")
+        deadlines = dict((partition_id, deadline) for deadline, partition_id in self._manager.renewal_queue)
+        self.assertAlmostEqual(deadlines["1"] - deadlines["0"], 0.1, delta=0.05)
+        self.assertAlmostEqual(deadlines["0"] - time.time(), 0.1, delta=0.05)
+        renewing = self._loop.create_task(self._manager.renew_loop_async())
+        self._loop.run_until_complete(asyncio.sleep(1.5))
+        self._manager.cancellation_token.cancel()
+        self._loop.run_until_complete(renewing)
+        # Create, read and acquire, then one renewal per lease_renew_interval for each lease
+        self.assertAlmostEqual(self._store.operations["first"], 2 * (3 + 7), delta=4)
+        self.assertFalse(self._store.leases["0"].is_expired())
+        self.assertFalse(self._store.leases["1"].is_expired())
+
+    def test_lost_lease_dropped(self):
+        """
+        Test that a lease another host took is no longer renewed
+        """
+        self._acquire("0")
+        self._store.leases["0"].token = "other"
+        self._store.leases["0"].owner = "second"
+        renewing = self._loop.create_task(self._manager.renew_loop_async())
+        self._loop.run_until_complete(asyncio.sleep(0.4))
+        self._manager.cancellation_token.cancel()
+        self._loop.run_until_complete(renewing)
+        self.assertNotIn("0", self._manager.owned_leases)
+        self.assertEqual(self._store.leases["0"].owner, "second")
+
+    def test_scan_during_renewal(self):
+        """
+        Test that a lease the scan replaces while it is being renewed stays scheduled
+        """
+        lease_manager = self._host.storage_manager
+        renew_lease_async = lease_manager.renew_lease_async
+        scans = []
+        async def renew_while_scanning_async(lease):
+            if not scans:
+                # The scan reads the lease again while its first renewal is in flight
+                scans.append(await self._manager.attempt_renew_lease_async(
+                    lease_manager.get_lease_async(lease.partition_id), lease_manager))
+            return await renew_lease_async(lease)
+        lease_manager.renew_lease_async = renew_while_scanning_async
+        self._acquire("0")
+        renewing = self._loop.create_task(self._manager.renew_loop_async())
+        self._loop.run_until_complete(asyncio.sleep(1.5))
+        self._manager.cancellation_token.cancel()
+        self._loop.run_until_complete(renewing)
+        self.assertEqual(len(scans), 1)
+        _, deadline = self._manager.owned_leases["0"]
+        self.assertIn((deadline, "0"), self._manager.renewal_queue)
+        self.assertFalse(self._store.leases["0"].is_expired())
+
+    def test_restart_reclaims_leases(self):
+        """
+        Test that a host restarted with the same host name renews its leases right away
+        and that releasing them frees the partitions for other hosts
+        """
+        self._acquire("0")
+        self._acquire("1")
+        self._host = MockPartitionManagerHost("first", InMemoryCheckpointLeaseManager(self._store, 0.2, 1),
+                                              self._loop)
+        self._manager = PartitionManager(self._host)
+        self.assertFalse(self._acquire("0")[0])
+        self.assertFalse(self._acquire("1")[0])
+        self.assertEqual(sorted(self._manager.owned_leases), ["0", "1"])
+        self.assertEqual(self._store.leases["0"].epoch, 1)
+        self._loop.run_until_complete(self._manager.release_all_leases_async())
+        self.assertEqual(self._manager.owned_leases, {})
+        self.assertTrue(self._store.leases["0"].is_expired())
+        self.assertIsNone(self._store.leases["1"].owner)
+
+class ClusterSimulatorTestCase(unittest.TestCase):
+    """Tests for `cluster_simulator.py`."""
+
+    def test_hosts_balance(self):
+        """
+        Test that simulated hosts share the partitions evenly after a join and a crash
+        """
+        loop = asyncio.new_event_loop()
+        simulator = ClusterSimulator(partition_count=4, lease_renew_interval=0.2,
+                                     lease_duration=0.6, event_interval=0.05, loop=loop)
+        report = loop.run_until_complete(simulator.run_async(2, 6.0, [(2.0, "join", 1),
+                                                                       (4.0, "crash", 1)]))
+        self.assertEqual(report["final_unowned"], 0)
+        self.assertEqual(sorted(report["final_ownership"].values()), [2, 2])
+        self.assertTrue(all(change["seconds_to_balance"] is not None
+                            for change in report["membership_changes"]))
+
+    def test_hosts_balance_single_loop(self):
+        """
+        Test that pumps running as tasks on the host loop process and hand off partitions
+        """
+        loop = asyncio.new_event_loop()
+        simulator = ClusterSimulator(partition_count=8, lease_renew_interval=0.2,
+                                     lease_duration=0.6, event_interval=0.05, loop=loop,
+                                     pump_mode="loop")
+        report = loop.run_until_complete(simulator.run_async(2, 4.0, [(2.0, "join", 1)]))
+        loop.close()
+        self.assertEqual(report["final_unowned"], 0)
+        self.assertEqual(sorted(report["final_ownership"].values()), [2, 3, 3])
+        self.assertTrue(all(intervals for intervals in simulator.intervals.values()))
+
+if __name__ == '__main__':
+    unittest.main()
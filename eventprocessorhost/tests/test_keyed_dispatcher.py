@@ -0,0 +1,246 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import random
+import asyncio
+import unittest
+import threading
+from mock_host import MockHost, EventLoopTestCase
+from eventprocessorhost.partition_context import PartitionContext
+from eventprocessorhost.keyed_dispatcher import KeyedDispatcher, OffsetTracker, event_key
+from eventprocessorhost.cluster_simulator import SimulatedEvent
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryCheckpointLeaseManager
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryLeaseStore
+
+class KeyedEvent(SimulatedEvent):
+    """
+    Simulated event with a partition key
+    """
+    def __init__(self, sequence_number, partition_key):
+        SimulatedEvent.__init__(self, sequence_number)
+        self.partition_key = partition_key
+
+class CheckingCheckpointManager(InMemoryCheckpointLeaseManager):
+    """
+    Fails the test when a checkpoint passes an event that was not processed
+    """
+    def __init__(self, store, processed):
+        InMemoryCheckpointLeaseManager.__init__(self, store, 1, 60)
+        self.processed = processed
+        self.checkpoints = []
+
+    async def update_checkpoint_async(self, lease, checkpoint):
+        unprocessed = [s for s in range(1, checkpoint.sequence_number + 1) if s not in self.processed]
+        assert not unprocessed, "Checkpoint {} passes {}".format(checkpoint.sequence_number, unprocessed)
+        self.checkpoints.append(checkpoint.sequence_number)
+        return await InMemoryCheckpointLeaseManager.update_checkpoint_async(self, lease, checkpoint)
+
+class SlowEventProcessor:
+    """
+    Takes a random time per batch and checkpoints after every batch
+    """
+    def __init__(self, processed, seen_by_key):
+        self.processed = processed
+        self.seen_by_key = seen_by_key
+
+    async def process_events_async(self, context, events):
+        await asyncio.sleep(random.uniform(0, 0.01) * len(events))
+        for event in events:
+            self.seen_by_key.setdefault(event.partition_key, []).append(event.sequence_number)
+            self.processed.add(event.sequence_number)
+        await context.checkpoint_async()
+
+class FailingEventProcessor(SlowEventProcessor):
+    """
+    Fails the batches containing the given sequence number
+    """
+    def __init__(self, processed, seen_by_key, failing):
+        SlowEventProcessor.__init__(self, processed, seen_by_key)
+        self.failing = failing
+
+    async def process_events_async(self, context, events):
+        if any(event.sequence_number == self.failing for event in events):
+            raise ValueError("Failed {}".format(self.failing))
+        await SlowEventProcessor.process_events_async(self, context, events)
+
+class MockPump:
+    """
+    The pump attributes used by the dispatcher
+    """
+    def __init__(self, processor, partition_context, loop):
+        self.processor = processor
+        self.partition_context = partition_context
+        self.loop = loop
+        self.errors = []
+
+    async def process_error_async(self, error):
+        self.errors.append(error)
+
+class KeyedDispatcherTestCase(EventLoopTestCase):
+    """Tests for `keyed_dispatcher.py`."""
+
+    def setUp(self):
+        EventLoopTestCase.setUp(self)
+        self._processed = set()
+        self._seen_by_key = {}
+        self._manager = CheckingCheckpointManager(InMemoryLeaseStore(), self._processed)
+        host = MockHost("first", self._manager)
+        self._manager.initialize(host)
+        context = PartitionContext(host, "0", "hub", "$default", self._loop)
+        context.lease = self._run(self._manager.create_lease_if_not_exists_async("0"))
+        self._run(self._manager.acquire_lease_async(context.lease))
+        self._pump = MockPump(SlowEventProcessor(self._processed, self._seen_by_key), context,
+                              self._loop)
+
+    def test_offset_tracker(self):
+        """
+        Test that the low watermark stops at the first event not processed
+        """
+        tracker = OffsetTracker()
+        events = [SimulatedEvent(s) for s in range(1, 6)]
+        tracker.track(events)
+        self.assertIsNone(tracker.complete([events[1], events[3]]))
+        self.assertEqual(tracker.complete([events[0]]).sequence_number, 2)
+        self.assertEqual(tracker.complete([events[2], events[4]]).sequence_number, 5)
+
+    def test_checkpoint_never_passes_unprocessed(self):
+        """
+        Test that checkpoints only cover processed events and events keep their order per key
+        """
+        random.seed(7)
+        async def run():
+            dispatcher = KeyedDispatcher(self._pump, 4)
+            dispatcher.start()
+            sequence_number = 0
+            for _ in range(50):
+                batch = []
+                for _ in range(random.randint(1, 10)):
+                    sequence_number += 1
+                    # A hot key gets most of the events
+                    key = "hot" if random.random() < 0.5 else "key%d" % random.randint(0, 9)
+                    batch.append(KeyedEvent(sequence_number, key))
+                await dispatcher.dispatch_async(batch)
+            while dispatcher.tracker.pending:
+                await asyncio.sleep(0.01)
+            await dispatcher.close_async()
+            return sequence_number
+        last = self._run(run())
+        self.assertEqual(len(self._processed), last)
+        self.assertEqual(self._pump.partition_context.sequence_number, last)
+        self.assertGreater(len(self._manager.checkpoints), 50)
+        for sequence_numbers in self._seen_by_key.values():
+            self.assertEqual(sequence_numbers, sorted(sequence_numbers))
+        self.assertEqual(self._pump.errors, [])
+
+    def test_close_drops_queued(self):
+        """
+        Test that closing keeps the offset before the batches that were not processed
+        """
+        async def run():
+            dispatcher = KeyedDispatcher(self._pump, 2, key_function=lambda event: event.sequence_number)
+            dispatcher.start()
+            await dispatcher.dispatch_async([KeyedEvent(s, None) for s in range(1, 5)])
+            await dispatcher.dispatch_async([KeyedEvent(s, None) for s in range(5, 9)])
+            await dispatcher.close_async()
+            await dispatcher.dispatch_async([KeyedEvent(9, None)])
+        self._run(run())
+        self.assertLess(len(self._processed), 9)
+        self.assertNotIn(9, self._processed)
+        self.assertEqual(self._pump.partition_context.sequence_number,
+                         max(s for s in range(0, 9) if all(p in self._processed for p in range(1, s + 1))))
+
+    def test_keyless_events_spread(self):
+        """
+        Test that events without a key are processed by every worker
+        """
+        workers = []
+        async def run():
+            dispatcher = KeyedDispatcher(self._pump, 4)
+            dispatcher.start()
+            process_events_async = self._pump.processor.process_events_async
+            async def record_worker_async(context, events):
+                workers.append(asyncio.current_task())
+                await process_events_async(context, events)
+            self._pump.processor.process_events_async = record_worker_async
+            await dispatcher.dispatch_async([KeyedEvent(s, None) for s in range(1, 9)])
+            while dispatcher.tracker.pending:
+                await asyncio.sleep(0.01)
+            await dispatcher.close_async()
+        self._run(run())
+        self.assertEqual(len(self._processed), 8)
+        self.assertEqual(len(set(workers)), 4)
+
+    def test_close_from_host_loop(self):
+        """
+        Test that a dispatcher running on a pump thread is closed from the host loop
+        """
+        pump_loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=pump_loop.run_forever)
+        thread.start()
+        self._pump.loop = pump_loop
+        async def start():
+            dispatcher = KeyedDispatcher(self._pump, 2)
+            dispatcher.start()
+            await dispatcher.dispatch_async([KeyedEvent(s, "key%d" % s) for s in range(1, 5)])
+            return dispatcher
+        try:
+            dispatcher = asyncio.run_coroutine_threadsafe(start(), pump_loop).result(5)
+            self._run(asyncio.wait_for(dispatcher.close_async(), 5))
+            self.assertTrue(dispatcher.closed.is_set())
+            self.assertEqual(dispatcher.tasks, [])
+            asyncio.run_coroutine_threadsafe(dispatcher.wait_closed_async(), pump_loop).result(5)
+        finally:
+            pump_loop.call_soon_threadsafe(pump_loop.stop)
+            thread.join()
+            pump_loop.close()
+        self.assertEqual(self._pump.errors, [])
+
+    def test_close_twice(self):
+        """
+        Test that a pump closing its dispatcher while the host closes it waits for the first close
+        """
+        async def run():
+            dispatcher = KeyedDispatcher(self._pump, 2)
+            dispatcher.start()
+            await dispatcher.dispatch_async([KeyedEvent(s, "key%d" % s) for s in range(1, 5)])
+            await asyncio.gather(dispatcher.close_async(), dispatcher.close_async())
+            return dispatcher
+        dispatcher = self._run(run())
+        self.assertTrue(dispatcher.closed.is_set())
+        self.assertEqual(dispatcher.tasks, [])
+
+    def test_failed_batch_stops_offset(self):
+        """
+        Test that the offset does not pass a failed batch while later batches are processed
+        """
+        self._pump.processor = FailingEventProcessor(self._processed, self._seen_by_key, 3)
+        async def run():
+            dispatcher = KeyedDispatcher(self._pump, 4)
+            dispatcher.start()
+            for s in range(1, 9):
+                await dispatcher.dispatch_async([KeyedEvent(s, "key%d" % s)])
+            while len(self._processed) < 7:
+                await asyncio.sleep(0.01)
+            await dispatcher.close_async()
+        self._run(run())
+        self.assertNotIn(3, self._processed)
+        self.assertLessEqual(self._pump.partition_context.sequence_number, 2)
+        self.assertEqual(len(self._pump.errors), 1)
+
+    def test_event_key_without_annotations(self):
+        """
+        Test that an event whose annotations are None has no key
+        """
+        class Message:
+            annotations = None
+        class Event:
+            message = Message()
+            @property
+            def partition_key(self):
+                return self.message.annotations[b"x-opt-partition-key"]
+        self.assertIsNone(event_key(Event()))
+
+if __name__ == '__main__':
+    unittest.main()
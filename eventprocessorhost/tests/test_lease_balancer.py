@@ -0,0 +1,114 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import asyncio
+import unittest
+from eventprocessorhost.lease import Lease
+from eventprocessorhost.lease_balancer import ConservativeLeaseBalancer, FastLeaseBalancer
+from eventprocessorhost.lease_balancer import LoadAwareLeaseBalancer
+from eventprocessorhost.cluster_simulator import ClusterSimulator
+
+def make_leases(owners, loads=None):
+    """
+    Builds unexpired leases with the given owners, None for unowned, and loads
+    """
+    leases = []
+    for partition_id, owner in enumerate(owners):
+        lease = Lease()
+        lease.with_partition_id(str(partition_id))
+        lease.owner = owner
+        lease.load = loads[partition_id] if loads else 0
+        leases.append(lease)
+    return leases
+
+class LeaseBalancerTestCase(unittest.TestCase):
+    """Tests for `lease_balancer.py`."""
+
+    def test_conservative_steals_one(self):
+        """
+        Test that the conservative balancer steals one lease from the biggest owner
+        """
+        balancer = ConservativeLeaseBalancer()
+        leases = make_leases(["a"] * 8 + ["b"] * 4)
+        stolen = balancer.leases_to_steal("me", leases, 0)
+        self.assertEqual([l.owner for l in stolen], ["a"])
+        self.assertEqual(balancer.leases_to_steal("me", make_leases(["a"] * 4), 3), [])
+
+    def test_fast_reaches_share(self):
+        """
+        Test that the fast balancer takes free leases first and stops at its share
+        """
+        balancer = FastLeaseBalancer()
+        leases = make_leases([None, None] + ["a"] * 30)
+        stolen = balancer.leases_to_steal("me", leases, 0)
+        self.assertEqual(len(stolen), 16)
+        self.assertEqual([l.owner for l in stolen[:2]], [None, None])
+        self.assertTrue(all(l.owner == "a" for l in stolen[2:]))
+
+    def test_fast_does_not_flap(self):
+        """
+        Test that the fast balancer leaves a balanced or nearly balanced cluster alone
+        """
+        balancer = FastLeaseBalancer()
+        self.assertEqual(balancer.leases_to_steal("me", make_leases(["a"] * 11 + ["b"] * 11), 10), [])
+        stolen = balancer.leases_to_steal("me", make_leases(["a"] * 12 + ["b"] * 10), 9)
+        self.assertEqual([l.owner for l in stolen], ["a"])
+
+    def test_fast_steal_bound(self):
+        """
+        Test that max_steals_per_pass bounds the leases stolen from other hosts
+        """
+        balancer = FastLeaseBalancer(max_steals_per_pass=3)
+        leases = make_leases([None] + ["a"] * 31)
+        stolen = balancer.leases_to_steal("me", leases, 0)
+        self.assertEqual(len(stolen), 4)
+
+    def test_fast_simulated_join(self):
+        """
+        Test that a joining host reaches its share within a few renew intervals
+        """
+        loop = asyncio.new_event_loop()
+        simulator = ClusterSimulator(partition_count=16, lease_renew_interval=0.2,
+                                     lease_duration=0.6, event_interval=0.05, loop=loop,
+                                     lease_balancer=FastLeaseBalancer())
+        report = loop.run_until_complete(simulator.run_async(1, 3.0, [(1.0, "join", 1)]))
+        loop.close()
+        self.assertEqual(sorted(report["final_ownership"].values()), [8, 8])
+        self.assertLess(report["membership_changes"][1]["seconds_to_balance"], 1.0)
+
+    def test_load_steals_from_hot_host(self):
+        """
+        Test that the load aware balancer moves load, not leases, to an idle host
+        """
+        balancer = LoadAwareLeaseBalancer()
+        mine = make_leases(["me"] * 4, [1, 1, 1, 1])
+        others = make_leases(["a"] * 4, [100, 60, 30, 10])
+        stolen = balancer.choose_leases("me", others, mine)
+        # 60 is the busiest lease that moves at most half of the 196 difference
+        self.assertEqual([l.load for l in stolen], [60])
+
+    def test_load_hysteresis(self):
+        """
+        Test that the load aware balancer leaves loads within the tolerance alone
+        """
+        balancer = LoadAwareLeaseBalancer(tolerance=0.2)
+        mine = make_leases(["me"] * 2, [50, 45])
+        self.assertEqual(balancer.choose_leases("me", make_leases(["a"] * 2, [60, 50]), mine), [])
+        # Moving the only hot lease would make this host the hot one
+        mine = make_leases(["me"], [10])
+        self.assertEqual(balancer.choose_leases("me", make_leases(["a"], [100]), mine), [])
+
+    def test_load_without_load_counts(self):
+        """
+        Test that the load aware balancer takes free leases and balances counts when idle
+        """
+        balancer = LoadAwareLeaseBalancer()
+        stolen = balancer.choose_leases("me", make_leases([None, None] + ["a"] * 4), [])
+        self.assertEqual([l.owner for l in stolen], [None, None])
+        stolen = balancer.choose_leases("me", make_leases(["a"] * 6), make_leases(["me"] * 2))
+        self.assertEqual([l.owner for l in stolen], ["a"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import unittest
+from mock_host import MockHost, EventLoopTestCase
+from eventprocessorhost.checkpoint import Checkpoint
+from eventprocessorhost.partition_context import PartitionContext
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryCheckpointLeaseManager
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryLeaseStore
+
+class PartitionContextTestCase(EventLoopTestCase):
+    """Tests for `partition_context.py`."""
+
+    def setUp(self):
+        EventLoopTestCase.setUp(self)
+        self._store = InMemoryLeaseStore()
+        manager = InMemoryCheckpointLeaseManager(self._store, 1, 5)
+        self._host = MockHost("first", manager)
+        manager.initialize(self._host)
+        self._context = PartitionContext(self._host, "0", "hub", "$default", self._loop)
+        self._context.lease = self._run(manager.create_lease_if_not_exists_async("0"))
+        self._run(manager.acquire_lease_async(self._context.lease))
+
+    def test_store_read_once(self):
+        """
+        Test that the persisted checkpoint is compared against the cached one
+        """
+        self._run(self._context.persist_checkpoint_async(Checkpoint("0", "10", 1)))
+        operations = self._store.operations["first"]
+        self._run(self._context.persist_checkpoint_async(Checkpoint("0", "20", 2)))
+        self.assertEqual(self._store.operations["first"], operations + 1)
+        self.assertEqual(self._store.leases["0"].offset, "20")
+        with self.assertRaises(Exception):
+            self._run(self._context.persist_checkpoint_async(Checkpoint("0", "5", 0)))
+
+    def test_lost_lease_not_cached(self):
+        """
+        Test that a checkpoint the store refused is not used for the next comparison
+        """
+        self._context.lease.token = "stale"
+        self._run(self._context.persist_checkpoint_async(Checkpoint("0", "10", 1)))
+        self.assertIsNone(self._context.last_checkpoint)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import asyncio
+import unittest
+import threading
+import concurrent.futures
+from mock_host import MockHost
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryCheckpointLeaseManager
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryLeaseStore
+from eventprocessorhost.partition_manager import PartitionManager
+from eventprocessorhost.partition_metadata_service import PartitionMetadataService
+from eventprocessorhost.partition_metadata_service import parse_description
+
+DESCRIPTION = """<entry xmlns="http://www.w3.org/2005/Atom"><content type="application/xml">
+<EventHubDescription xmlns="http://schemas.microsoft.com/netservices/2010/10/servicebus/connect"
+ xmlns:i="http://www.w3.org/2001/XMLSchema-instance"><MessageRetentionInDays>1</MessageRetentionInDays>
+<PartitionCount>4</PartitionCount><PartitionIds xmlns:d3p1="http://schemas.microsoft.com/2003/10/Serialization/Arrays">
+<d3p1:string>0</d3p1:string><d3p1:string>1</d3p1:string><d3p1:string>2</d3p1:string>
+<d3p1:string>3</d3p1:string></PartitionIds></EventHubDescription></content></entry>"""
+
+class MockConfig:
+    """
+    The config attributes read before the REST call
+    """
+    eh_name = "hub"
+
+PARTITION_DESCRIPTION = b"""<entry xmlns="http://www.w3.org/2005/Atom"><content type="application/xml">
+<PartitionDescription xmlns="http://schemas.microsoft.com/netservices/2010/10/servicebus/connect">
+<SizeInBytes>1024</SizeInBytes><BeginSequenceNumber>0</BeginSequenceNumber>
+<EndSequenceNumber>1500</EndSequenceNumber><LastEnqueuedOffset>98304</LastEnqueuedOffset>
+<LastEnqueuedTimeUtc>2017-06-01T10:00:00.123Z</LastEnqueuedTimeUtc>
+</PartitionDescription></content></entry>"""
+
+class MockMetadataService(PartitionMetadataService):
+    """
+    Serves descriptions with a growing partition count instead of calling the REST API
+    """
+    def __init__(self, ttl):
+        PartitionMetadataService.__init__(self, MockConfig(), ttl)
+        self.partition_count = 2
+        self.fetches = 0
+
+    def fetch_description(self, path, names):
+        self.fetches += 1
+        if path.startswith("hub/consumergroups/$default/partitions/"):
+            return parse_description([PARTITION_DESCRIPTION], names)
+        ids = "".join("<string>%d</string>" % p for p in range(self.partition_count))
+        return parse_description([b"<e><PartitionIds>" + ids.encode() + b"</PartitionIds></e>"], names)
+
+class PartitionMetadataServiceTestCase(unittest.TestCase):
+    """Tests for `partition_metadata_service.py`."""
+
+    def setUp(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+    def tearDown(self):
+        self._loop.close()
+
+    def test_parse_chunked_description(self):
+        """
+        Test that the partition ids are found across chunk boundaries and namespaces
+        """
+        data = DESCRIPTION.encode("utf-8")
+        chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+        found = parse_description(chunks, ["PartitionIds", "PartitionCount"])
+        self.assertEqual([e.text for e in found["PartitionIds"]], ["0", "1", "2", "3"])
+        self.assertEqual(found["PartitionCount"].text, "4")
+        with self.assertRaises(ValueError):
+            parse_description([b"<entry></entry>"], ["PartitionIds"])
+
+    def test_ttl_and_added_partitions(self):
+        """
+        Test that ids are cached for the ttl and listeners hear about new partitions
+        """
+        added = []
+        async def listener(partition_ids):
+            added.extend(partition_ids)
+        service = MockMetadataService(ttl=60)
+        service.add_listener(listener)
+        run = self._loop.run_until_complete
+        self.assertEqual(run(service.get_partition_ids_async()), ["0", "1"])
+        service.partition_count = 4
+        self.assertEqual(run(service.get_partition_ids_async()), ["0", "1"])
+        self.assertEqual(service.fetches, 1)
+        service.refreshed_at -= 61
+        self.assertEqual(run(service.get_partition_ids_async()), ["0", "1", "2", "3"])
+        self.assertEqual(added, ["2", "3"])
+
+    def test_partition_runtime_info(self):
+        """
+        Test that the last enqueued event is read from the partition description
+        """
+        service = MockMetadataService(ttl=60)
+        runtime_info = self._loop.run_until_complete(
+            service.get_partition_runtime_info_async("$default", "1"))
+        self.assertEqual(runtime_info, {"last_enqueued_sequence_number": 1500,
+                                        "last_enqueued_offset": "98304",
+                                        "last_enqueued_time_utc": "2017-06-01T10:00:00.123Z"})
+
+class ScaleOutTestCase(unittest.TestCase):
+    """Tests for the handling of added partitions in `partition_manager.py`."""
+
+    def test_pump_executor_grows(self):
+        """
+        Test that the pump pool is sized for the new partition count and the previous
+        pool is shut down once its pumps closed
+        """
+        loop = asyncio.new_event_loop()
+        host = MockHost("first", InMemoryCheckpointLeaseManager(InMemoryLeaseStore(), 1, 5))
+        host.loop = loop
+        host.storage_manager.initialize(host)
+        manager = PartitionManager(host)
+        manager.metadata_service = MockMetadataService(0)
+        manager.metadata_service.add_listener(manager.on_partitions_added_async)
+        loop.run_until_complete(manager.get_partition_ids_async())
+        previous = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        pump_closed = threading.Event()
+        manager.pump_executor = previous
+        manager.pump_futures = [loop.run_in_executor(previous, pump_closed.wait)]
+        manager.metadata_service.partition_count = 4
+        loop.run_until_complete(manager.get_partition_ids_async())
+        self.assertEqual(manager.pump_executor._max_workers, 4)
+        loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertFalse(previous._shutdown)
+        pump_closed.set()
+        loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertTrue(previous._shutdown)
+        manager.pump_executor.shutdown()
+        loop.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import time
+import unittest
+from eventprocessorhost.partition_metrics import PartitionMetrics
+
+class SizedEvent:
+    """
+    Event with a body
+    """
+    def __init__(self, body):
+        self.body = body
+
+class PartitionMetricsTestCase(unittest.TestCase):
+    """Tests for `partition_metrics.py`."""
+
+    def test_rates_and_averages(self):
+        """
+        Test that rates cover the window and averages the recorded batches
+        """
+        metrics = PartitionMetrics(window=10)
+        metrics.started_at -= 20
+        metrics.record_batch([SizedEvent(b"abcd")] * 30, 0.2)
+        metrics.record_batch([SizedEvent(b"ab"), object()], 0.4)
+        metrics.record_checkpoint(0.05)
+        snapshot = metrics.snapshot(100, first_event_latency=0.3)
+        self.assertAlmostEqual(snapshot["events_per_second"], 3.2)
+        self.assertAlmostEqual(snapshot["bytes_per_second"], 12.2)
+        self.assertEqual(snapshot["batch_size"], 16)
+        self.assertAlmostEqual(snapshot["processor_latency"], 0.3)
+        self.assertAlmostEqual(snapshot["checkpoint_latency"], 0.05)
+        self.assertEqual(snapshot["first_event_latency"], 0.3)
+        self.assertIsNone(snapshot["lag"])
+
+    def test_window(self):
+        """
+        Test that batches older than the window are dropped
+        """
+        metrics = PartitionMetrics(window=10)
+        metrics.record_batch([SizedEvent(b"a")], 0.1)
+        metrics.batches[0] = (time.time() - 11,) + metrics.batches[0][1:]
+        snapshot = metrics.snapshot(1)
+        self.assertEqual(snapshot["events_per_second"], 0)
+        self.assertIsNone(snapshot["batch_size"])
+
+    def test_lag(self):
+        """
+        Test that lag is counted from the last enqueued sequence number of the runtime info
+        """
+        metrics = PartitionMetrics()
+        metrics.set_runtime_info({"last_enqueued_sequence_number": 1500,
+                                  "last_enqueued_offset": "98304",
+                                  "last_enqueued_time_utc": "2017-06-01T10:00:00.123Z"})
+        self.assertEqual(metrics.snapshot("1200")["lag"], 300)
+        self.assertEqual(metrics.snapshot(1600)["lag"], 0)
+        self.assertLess(metrics.snapshot(1)["runtime_info_age"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
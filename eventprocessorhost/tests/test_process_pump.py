@@ -0,0 +1,120 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import os
+import asyncio
+import unittest
+from eventprocessorhost.abstract_event_processor import AbstractEventProcessor
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryCheckpointLeaseManager
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryLeaseStore
+from eventprocessorhost.partition_manager import PartitionManager
+from eventprocessorhost.partition_pump import PartitionPump
+from eventprocessorhost.process_pump import PartitionWorkerPool
+from eventprocessorhost.cluster_simulator import SimulatedConfig, SimulatedEvent
+from eventprocessorhost.eph import EventProcessorHost, EPHOptions
+
+class CountingEventProcessor(AbstractEventProcessor):
+    """
+    Checkpoints every batch and records the worker process in the offset
+    """
+    async def open_async(self, context):
+        pass
+
+    async def close_async(self, context, reason):
+        await context.checkpoint_async()
+
+    async def process_events_async(self, context, messages):
+        context.offset = "{}@{}".format(context.sequence_number, os.getpid())
+        await context.checkpoint_async()
+
+    async def process_error_async(self, context, error):
+        pass
+
+class CountingPartitionPump(PartitionPump):
+    """
+    Produces an event every 20 ms until closed
+    """
+    async def on_open_async(self):
+        await self.partition_context.get_initial_offset_async()
+        sequence_number = int(self.partition_context.sequence_number or 0)
+        self.set_pump_status("Running")
+        while not self.is_closing():
+            await asyncio.sleep(0.02)
+            sequence_number += 1
+            await self.process_events_async([SimulatedEvent(sequence_number)])
+
+    async def on_closing_async(self, reason):
+        pass
+
+def create_counting_pump(host, lease):
+    return CountingPartitionPump(host, lease)
+
+class CountingPartitionManager(PartitionManager):
+    """
+    Four partitions processed by counting pumps in two workers
+    """
+    async def get_partition_ids_async(self):
+        return ["0", "1", "2", "3"]
+
+    def create_worker_pool(self):
+        return PartitionWorkerPool(self.host, 2, create_counting_pump, metrics_interval=0.5)
+
+class ProcessPumpTestCase(unittest.TestCase):
+    """Tests for `process_pump.py`."""
+
+    def test_checkpoints_forwarded(self):
+        """
+        Test that partitions are processed in the workers and their checkpoints and metrics
+        are forwarded to the host
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        store = InMemoryLeaseStore()
+        eph_options = EPHOptions()
+        eph_options.pump_mode = "process"
+        host = EventProcessorHost(CountingEventProcessor, SimulatedConfig(),
+                                  InMemoryCheckpointLeaseManager(store, 0.2, 1),
+                                  eph_options=eph_options, loop=loop)
+        host.partition_manager = CountingPartitionManager(host)
+        async def run():
+            running = loop.create_task(host.open_async())
+            await asyncio.sleep(5)
+            metrics = host.get_partition_metrics()
+            host.partition_manager.cancellation_token.cancel()
+            await running
+            return metrics
+        metrics = loop.run_until_complete(run())
+        loop.close()
+        self.assertEqual(sorted(metrics), ["0", "1", "2", "3"])
+        for partition_metrics in metrics.values():
+            self.assertGreater(partition_metrics["events_per_second"], 0)
+        workers = set()
+        for partition_id in ["0", "1", "2", "3"]:
+            lease = store.leases[partition_id]
+            self.assertGreater(int(lease.sequence_number), 10)
+            sequence_number, pid = lease.offset.split("@")
+            self.assertEqual(int(sequence_number), int(lease.sequence_number))
+            self.assertNotEqual(int(pid), os.getpid())
+            workers.add(pid)
+        self.assertEqual(len(workers), 2)
+
+    def test_unpicklable_key_function(self):
+        """
+        Test that opening the host rejects a key function the workers cannot receive
+        """
+        loop = asyncio.new_event_loop()
+        eph_options = EPHOptions()
+        eph_options.pump_mode = "process"
+        eph_options.key_parallelism = 2
+        eph_options.event_key_function = lambda event: event.partition_key
+        host = EventProcessorHost(CountingEventProcessor, SimulatedConfig(),
+                                  InMemoryCheckpointLeaseManager(InMemoryLeaseStore(), 0.2, 1),
+                                  eph_options=eph_options, loop=loop)
+        with self.assertRaisesRegex(ValueError, "event_key_function"):
+            loop.run_until_complete(host.open_async())
+        loop.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from mock_host import MockHost, EventLoopTestCase
+from eventprocessorhost.checkpoint import Checkpoint
+from eventprocessorhost.sqlite_checkpoint_manager import SqliteCheckpointLeaseManager
+
+class SqliteCheckpointLeaseManagerTestCase(EventLoopTestCase):
+    """Tests for `sqlite_checkpoint_manager.py`."""
+
+    def setUp(self):
+        EventLoopTestCase.setUp(self)
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, "leases.db")
+        self._first = self._manager("first")
+        self._second = self._manager("second")
+
+    def tearDown(self):
+        self._first.close()
+        self._second.close()
+        EventLoopTestCase.tearDown(self)
+        shutil.rmtree(self._directory)
+
+    def _manager(self, host_name):
+        manager = SqliteCheckpointLeaseManager(self._path, 1, 0.5)
+        manager.initialize(MockHost(host_name))
+        return manager
+
+    def test_acquire_and_renew(self):
+        """
+        Test that an acquired lease can only be renewed by its owner
+        """
+        lease = self._run(self._first.create_lease_if_not_exists_async("0"))
+        self.assertTrue(lease.is_expired())
+        self.assertTrue(self._run(self._first.acquire_lease_async(lease)))
+        self.assertEqual(lease.owner, "first")
+        self.assertEqual(lease.epoch, 1)
+        self.assertFalse(lease.is_expired())
+        self.assertTrue(self._run(self._first.renew_lease_async(lease)))
+        other = self._run(self._second.get_lease_async("0"))
+        self.assertEqual(other.owner, "first")
+        other.token = "not the owner"
+        self.assertFalse(self._run(self._second.renew_lease_async(other)))
+
+    def test_steal_requires_scanned_token(self):
+        """
+        Test that stealing fails when the lease changed hands after it was read
+        """
+        lease = self._run(self._first.create_lease_if_not_exists_async("0"))
+        self._run(self._first.acquire_lease_async(lease))
+        scanned = self._run(self._second.get_lease_async("0"))
+        self._run(self._first.acquire_lease_async(lease))
+        self.assertFalse(self._run(self._second.acquire_lease_async(scanned)))
+        scanned = self._run(self._second.get_lease_async("0"))
+        self.assertTrue(self._run(self._second.acquire_lease_async(scanned)))
+        self.assertFalse(self._run(self._first.renew_lease_async(lease)))
+
+    def test_expiry(self):
+        """
+        Test that an expired lease can be acquired without its token
+        """
+        lease = self._run(self._first.create_lease_if_not_exists_async("0"))
+        self._run(self._first.acquire_lease_async(lease))
+        time.sleep(0.6)
+        stale = self._run(self._second.get_lease_async("0"))
+        stale.token = None
+        self.assertTrue(stale.is_expired())
+        self.assertTrue(self._run(self._second.acquire_lease_async(stale)))
+
+    def test_checkpoint_durable(self):
+        """
+        Test that checkpoints are stored by the lease owner only and survive a new connection
+        """
+        self._run(self._first.create_checkpoint_if_not_exists_async("0"))
+        self.assertIsNone(self._run(self._first.get_checkpoint_async("0")))
+        lease = self._run(self._first.get_lease_async("0"))
+        self._run(self._first.acquire_lease_async(lease))
+        self.assertTrue(self._run(self._first.update_checkpoint_async(lease, Checkpoint("0", "42", 7))))
+        lease.token = "stale"
+        self.assertFalse(self._run(self._first.update_checkpoint_async(lease, Checkpoint("0", "50", 9))))
+        reopened = self._manager("third")
+        checkpoint = self._run(reopened.get_checkpoint_async("0"))
+        reopened.close()
+        self.assertEqual((checkpoint.offset, checkpoint.sequence_number), ("42", 7))
+
+    def test_load_published(self):
+        """
+        Test that the load is stored with the checkpoint and cleared on release
+        """
+        lease = self._run(self._first.create_lease_if_not_exists_async("0"))
+        self._run(self._first.acquire_lease_async(lease))
+        lease.load = 12.5
+        self._run(self._first.update_checkpoint_async(lease, Checkpoint("0", "42", 7)))
+        self.assertEqual(self._run(self._second.get_lease_async("0")).load, 12.5)
+        self._run(self._first.release_lease_async(lease))
+        self.assertEqual(self._run(self._second.get_lease_async("0")).load, 0)
+
+    def test_get_all_leases(self):
+        """
+        Test that all leases are read, missing ones as None
+        """
+        self._run(self._first.create_lease_if_not_exists_async("1"))
+        leases = [self._run(lease) for lease in self._run(self._first.get_all_leases())]
+        self.assertIsNone(leases[0])
+        self.assertEqual(leases[1].partition_id, "1")
+
+if __name__ == '__main__':
+    unittest.main()
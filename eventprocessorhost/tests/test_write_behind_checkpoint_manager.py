@@ -0,0 +1,134 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import asyncio
+import unittest
+from mock_host import MockHost, EventLoopTestCase
+from eventprocessorhost.checkpoint import Checkpoint
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryCheckpointLeaseManager
+from eventprocessorhost.in_memory_checkpoint_manager import InMemoryLeaseStore
+from eventprocessorhost.write_behind_checkpoint_manager import WriteBehindCheckpointManager
+
+class FailingCheckpointManager(InMemoryCheckpointLeaseManager):
+    """
+    Fails the given number of checkpoint writes, calling on_failure before each failure
+    """
+    def __init__(self, store, failures):
+        InMemoryCheckpointLeaseManager.__init__(self, store, 1, 5)
+        self.failures = failures
+        self.on_failure = lambda: None
+
+    async def update_checkpoint_async(self, lease, checkpoint):
+        if self.failures:
+            self.failures -= 1
+            self.on_failure()
+            raise IOError("Storage unavailable")
+        return await InMemoryCheckpointLeaseManager.update_checkpoint_async(self, lease, checkpoint)
+
+class WriteBehindCheckpointManagerTestCase(EventLoopTestCase):
+    """Tests for `write_behind_checkpoint_manager.py`."""
+
+    def setUp(self):
+        EventLoopTestCase.setUp(self)
+        self._store = InMemoryLeaseStore()
+        self._manager = WriteBehindCheckpointManager(InMemoryCheckpointLeaseManager(self._store, 1, 5),
+                                                     flush_interval=60, flush_count=3)
+        self._manager.initialize(MockHost("first"))
+        self._lease = self._run(self._manager.create_lease_if_not_exists_async("0"))
+        self._run(self._manager.acquire_lease_async(self._lease))
+
+    def _stored(self):
+        lease = self._store.leases["0"]
+        return (lease.offset, lease.sequence_number)
+
+    def test_flush_count(self):
+        """
+        Test that checkpoints are held back until flush_count updates
+        """
+        self._run(self._manager.update_checkpoint_async(self._lease, Checkpoint("0", "10", 1)))
+        self._run(self._manager.update_checkpoint_async(self._lease, Checkpoint("0", "20", 2)))
+        self.assertEqual(self._stored(), (None, None))
+        checkpoint = self._run(self._manager.get_checkpoint_async("0"))
+        self.assertEqual((checkpoint.offset, checkpoint.sequence_number), ("20", 2))
+        self._run(self._manager.update_checkpoint_async(self._lease, Checkpoint("0", "30", 3)))
+        self.assertEqual(self._stored(), ("30", 3))
+
+    def test_monotonic(self):
+        """
+        Test that an older checkpoint is rejected without a store read
+        """
+        self._run(self._manager.update_checkpoint_async(self._lease, Checkpoint("0", "20", 2)))
+        operations = self._store.operations["first"]
+        with self.assertRaises(ValueError):
+            self._run(self._manager.update_checkpoint_async(self._lease, Checkpoint("0", "10", 1)))
+        self.assertEqual(self._store.operations["first"], operations)
+
+    def test_flush_on_release(self):
+        """
+        Test that the pending checkpoint is written before the lease is released
+        """
+        self._run(self._manager.update_checkpoint_async(self._lease, Checkpoint("0", "10", 1)))
+        self.assertTrue(self._run(self._manager.release_lease_async(self._lease)))
+        self.assertEqual(self._stored(), ("10", 1))
+        self.assertIsNone(self._store.leases["0"].owner)
+
+    def test_failed_flush_is_retried(self):
+        """
+        Test that a checkpoint that failed to write stays pending unless a newer one replaced it
+        """
+        manager = WriteBehindCheckpointManager(FailingCheckpointManager(self._store, 2),
+                                               flush_interval=60, flush_count=1)
+        manager.initialize(MockHost("first"))
+        self._run(manager.update_checkpoint_async(self._lease, Checkpoint("0", "10", 1)))
+        self.assertEqual(self._stored(), (None, None))
+        self._run(manager.flush_async())
+        self.assertEqual(self._stored(), (None, None))
+        self._run(manager.flush_async())
+        self.assertEqual(self._stored(), ("10", 1))
+        # A newer checkpoint arriving while the write fails is kept instead of the failed one
+        manager.manager.failures = 1
+        manager.manager.on_failure = lambda: manager.pending.__setitem__(
+            "0", (self._lease, Checkpoint("0", "30", 3), 1))
+        self._run(manager.update_checkpoint_async(self._lease, Checkpoint("0", "20", 2)))
+        self.assertEqual(manager.pending["0"][1].sequence_number, 3)
+        self._run(manager.flush_async("0"))
+        self.assertEqual(self._stored(), ("30", 3))
+
+    def test_flushes_serialized(self):
+        """
+        Test that a flush waits for the running flush of the partition, so writes stay in order
+        """
+        manager = WriteBehindCheckpointManager(FailingCheckpointManager(self._store, 0),
+                                               flush_interval=60, flush_count=100)
+        manager.initialize(MockHost("first"))
+        written = []
+        update_checkpoint_async = manager.manager.update_checkpoint_async
+        async def slow_update_checkpoint_async(lease, checkpoint):
+            if checkpoint.sequence_number == 1:
+                await asyncio.sleep(0.05)
+            written.append(checkpoint.sequence_number)
+            return await update_checkpoint_async(lease, checkpoint)
+        manager.manager.update_checkpoint_async = slow_update_checkpoint_async
+        async def run():
+            await manager.update_checkpoint_async(self._lease, Checkpoint("0", "10", 1))
+            first = asyncio.ensure_future(manager.flush_async("0"))
+            await asyncio.sleep(0.01)
+            await manager.update_checkpoint_async(self._lease, Checkpoint("0", "20", 2))
+            await asyncio.gather(first, manager.flush_async("0"))
+        self._run(run())
+        self.assertEqual(written, [1, 2])
+        self.assertEqual(self._stored(), ("20", 2))
+
+    def test_acquire_drops_pending(self):
+        """
+        Test that a checkpoint left from a lost lease is not written after the lease is acquired again
+        """
+        self._run(self._manager.update_checkpoint_async(self._lease, Checkpoint("0", "10", 1)))
+        self.assertTrue(self._run(self._manager.acquire_lease_async(self._lease)))
+        self._run(self._manager.flush_async())
+        self.assertEqual(self._stored(), (None, None))
+
+if __name__ == '__main__':
+    unittest.main()
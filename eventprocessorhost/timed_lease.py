@@ -0,0 +1,42 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import time
+from eventprocessorhost.lease import Lease
+
+class TimedLease(Lease):
+    """
+    Lease for stores without native leases. It carries the partition checkpoint and
+    expires at a wall clock time (seconds since the epoch).
+    """
+
+    def __init__(self):
+        """
+        Init Timed Lease
+        """
+        Lease.__init__(self)
+        self.offset = None
+        self.expiration = 0.0
+
+    def serializable(self):
+        """
+        Returns Serialiazble instance of __dict__
+        """
+        return self.__dict__.copy()
+
+    def with_source(self, lease):
+        """
+        Init Timed Lease from existing
+        """
+        super().with_source(lease)
+        self.offset = lease.offset
+        self.sequence_number = lease.sequence_number
+        self.expiration = getattr(lease, "expiration", 0.0)
+
+    def is_expired(self):
+        """
+        Check whether the lease expiration time has passed
+        """
+        return time.time() >= self.expiration
@@ -0,0 +1,210 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# -----------------------------------------------------------------------------------
+
+import time
+import asyncio
+import logging
+import threading
+from eventprocessorhost.abstract_lease_manager import AbstractLeaseManager
+from eventprocessorhost.abstract_checkpoint_manager import AbstractCheckpointManager
+
+class WriteBehindCheckpointManager(AbstractCheckpointManager, AbstractLeaseManager):
+    """
+    Wraps a checkpoint and lease manager and keeps the latest checkpoint of every
+    partition in memory. A partition is written to the wrapped manager once flush_count
+    checkpoints are pending or its last write is flush_interval seconds old, when its
+    pump closes (lease lost or shutdown) and when its lease is released. Checkpoints are
+    read back from memory, so the sequence number check of a checkpoint is local.
+    Checkpoints not yet written are lost if the process dies.
+    """
+    def __init__(self, manager, flush_interval=10, flush_count=100):
+        AbstractCheckpointManager.__init__(self)
+        AbstractLeaseManager.__init__(self, manager.lease_renew_interval, manager.lease_duration)
+        self.manager = manager
+        self.flush_interval = flush_interval
+        self.flush_count = flush_count
+        self.host = None
+        self.checkpoints = {}
+        self.pending = {}
+        self.flushing = set()
+        self.written = {}
+        self.flushed_at = {}
+        self.flush_task = None
+        self.lock = threading.Lock()
+
+    def initialize(self, host):
+        """
+        Initializes the wrapped manager with the host
+        """
+        self.host = host
+        self.manager.initialize(host)
+
+    # Checkpoint Managment Methods
+
+    async def create_checkpoint_store_if_not_exists_async(self):
+        """
+        Create the checkpoint store if it doesn't exist and start flushing in the background.
+        """
+        result = await self.manager.create_checkpoint_store_if_not_exists_async()
+        if not self.flush_task:
+            self.flush_task = asyncio.get_event_loop().create_task(self.flush_loop_async())
+        return result
+
+    async def get_checkpoint_async(self, partition_id):
+        """
+        Get the latest checkpoint of the partition, from memory once it has been read or updated.
+        (Returns) Given partition checkpoint info, or null if none has been previously stored.
+        """
+        with self.lock:
+            if partition_id in self.checkpoints:
+                return self.checkpoints[partition_id]
+        checkpoint = await self.manager.get_checkpoint_async(partition_id)
+        with self.lock:
+            return self.checkpoints.setdefault(partition_id, checkpoint)
+
+    async def create_checkpoint_if_not_exists_async(self, partition_id):
+        """
+        Create the given partition checkpoint if it doesn't exist. Do nothing if it does exist.
+        (Returns) The checkpoint for the given partition, whether newly created or already existing.
+        """
+        with self.lock:
+            if self.checkpoints.get(partition_id):
+                return self.checkpoints[partition_id]
+        return await self.manager.create_checkpoint_if_not_exists_async(partition_id)
+
+    async def update_checkpoint_async(self, lease, checkpoint):
+        """
+        Holds the checkpoint back and writes it if the flush policy says so.
+        Throws if the sequence number is older than the latest checkpoint.
+        """
+        with self.lock:
+            latest = self.checkpoints.get(checkpoint.partition_id)
+            if latest and latest.sequence_number is not None \
+               and checkpoint.sequence_number < latest.sequence_number:
+                raise ValueError("Checkpoint sequence number %s is older than %s" %
+                                 (checkpoint.sequence_number, latest.sequence_number))
+            count = self.pending[checkpoint.partition_id][2] + 1 \
+                    if checkpoint.partition_id in self.pending else 1
+            self.checkpoints[checkpoint.partition_id] = checkpoint
+            self.pending[checkpoint.partition_id] = (lease, checkpoint, count)
+            flushed_at = self.flushed_at.setdefault(checkpoint.partition_id, time.time())
+        if count >= self.flush_count or time.time() - flushed_at >= self.flush_interval:
+            await self.flush_async(checkpoint.partition_id)
+
+    async def delete_checkpoint_async(self, partition_id):
+        """
+        Delete the stored checkpoint for the given partition.
+        """
+        with self.lock:
+            self.checkpoints.pop(partition_id, None)
+            self.pending.pop(partition_id, None)
+        return await self.manager.delete_checkpoint_async(partition_id)
+
+    async def flush_async(self, partition_id=None):
+        """
+        Writes the pending checkpoint of the partition, or of all partitions, to the
+        wrapped manager. Flushes of a partition run one at a time, pump and host loops
+        wait for each other, so the stored checkpoint never moves backwards. A checkpoint
+        that fails to write is pending again, unless a newer one replaced it meanwhile,
+        and is retried after flush_interval.
+        """
+        if partition_id is None:
+            with self.lock:
+                partition_ids = list(self.pending)
+            for p_id in partition_ids:
+                await self.flush_async(p_id)
+            return
+        while True:
+            with self.lock:
+                if partition_id not in self.flushing:
+                    self.flushing.add(partition_id)
+                    break
+            await asyncio.sleep(0.01)
+        try:
+            await self.write_pending_async(partition_id)
+        finally:
+            with self.lock:
+                self.flushing.discard(partition_id)
+
+    async def write_pending_async(self, partition_id):
+        """
+        Writes the pending checkpoint of the partition, the caller holds its flushing slot
+        """
+        with self.lock:
+            if partition_id not in self.pending:
+                return
+            lease, checkpoint, count = self.pending.pop(partition_id)
+            self.flushed_at[partition_id] = time.time()
+        try:
+            await self.manager.update_checkpoint_async(lease, checkpoint)
+            with self.lock:
+                self.written[partition_id] = checkpoint.sequence_number
+            logging.debug("Flushed checkpoint %s %s after %d updates", partition_id,
+                          checkpoint.sequence_number, count)
+        except Exception as err:
+            logging.error("Failed to flush checkpoint %s %s", partition_id, repr(err))
+            with self.lock:
+                written = self.written.get(partition_id)
+                if written is None or checkpoint.sequence_number is None \
+                   or checkpoint.sequence_number > written:
+                    self.pending.setdefault(partition_id, (lease, checkpoint, count))
+
+    async def flush_loop_async(self):
+        """
+        Writes checkpoints of partitions whose pumps stopped updating them
+        """
+        while not self.host.partition_manager.cancellation_token.is_cancelled:
+            await asyncio.sleep(self.flush_interval)
+            now = time.time()
+            with self.lock:
+                due = [p_id for p_id in self.pending
+                       if now - self.flushed_at.get(p_id, 0) >= self.flush_interval]
+            for partition_id in due:
+                await self.flush_async(partition_id)
+
+    # Lease Managment Methods
+
+    async def create_lease_store_if_not_exists_async(self):
+        return await self.manager.create_lease_store_if_not_exists_async()
+
+    async def delete_lease_store_async(self):
+        return await self.manager.delete_lease_store_async()
+
+    async def get_lease_async(self, partition_id):
+        return await self.manager.get_lease_async(partition_id)
+
+    async def get_all_leases(self):
+        return await self.manager.get_all_leases()
+
+    async def create_lease_if_not_exists_async(self, partition_id):
+        return await self.manager.create_lease_if_not_exists_async(partition_id)
+
+    async def delete_lease_async(self, lease):
+        return await self.manager.delete_lease_async(lease)
+
+    async def acquire_lease_async(self, lease):
+        """
+        Acquires the lease, the checkpoint is read again from the store because
+        another host may have moved it. A checkpoint still pending from an earlier
+        lease is dropped, it would overwrite the progress of the hosts in between.
+        """
+        with self.lock:
+            self.checkpoints.pop(lease.partition_id, None)
+            self.pending.pop(lease.partition_id, None)
+            self.written.pop(lease.partition_id, None)
+        return await self.manager.acquire_lease_async(lease)
+
+    async def renew_lease_async(self, lease):
+        return await self.manager.renew_lease_async(lease)
+
+    async def release_lease_async(self, lease):
+        """
+        Writes the pending checkpoint while the lease is still held, then releases it
+        """
+        await self.flush_async(lease.partition_id)
+        return await self.manager.release_lease_async(lease)
+
+    async def update_lease_async(self, lease):
+        return await self.manager.update_lease_async(lease)
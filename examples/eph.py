@@ -8,6 +8,7 @@ import asyncio
 import sys
 from eventprocessorhost.abstract_event_processor import AbstractEventProcessor
 from eventprocessorhost.azure_storage_checkpoint_manager import AzureStorageCheckpointLeaseManager
+from eventprocessorhost.write_behind_checkpoint_manager import WriteBehindCheckpointManager
 from eventprocessorhost.eh_config import EventHubConfig
 from eventprocessorhost.eph import EventProcessorHost
 
@@ -61,8 +62,11 @@ try:
     # Eventhub config and storage manager 
     EH_CONFIG = EventHubConfig('<mynamespace>', '<myeventhub>','<SAS-policy>', 
                                '<SAS-key>', consumer_group="$default")
-    STORAGE_MANAGER = AzureStorageCheckpointLeaseManager(STORAGE_ACCOUNT_NAME, STORAGE_KEY,
-                                                         LEASE_CONTAINER_NAME)
+    # Checkpoints are written every 10 seconds or 100 batches instead of after every batch
+    STORAGE_MANAGER = WriteBehindCheckpointManager(
+        AzureStorageCheckpointLeaseManager(STORAGE_ACCOUNT_NAME, STORAGE_KEY,
+                                           LEASE_CONTAINER_NAME),
+        flush_interval=10, flush_count=100)
     #Event loop and host
     LOOP = asyncio.get_event_loop()
     HOST = EventProcessorHost(EventProcessor, EH_CONFIG, STORAGE_MANAGER,
@@ -8,10 +8,13 @@ Setup the eventhubs module.
 
 """
 
+import re
 import sys
-import eventhubs
 from setuptools import setup
 
+with open("eventhubs/__init__.py") as init_file:
+    VERSION = re.search(r'^__version__ = "(.*)"', init_file.read(), re.M).group(1)
+
 def find_packages():
     """Return packages based on sys version."""
     if sys.version_info[0] >= 3:
@@ -19,7 +22,7 @@ def find_packages():
     return ['eventhubs']
 
 setup(name='eventhubs',
-      version=eventhubs.__version__,
+      version=VERSION,
       description='Python client library for Azure Event Hubs',
       url='http://github.com/azure/azure-event-hubs-python',
       author='microsoft',
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+Throughput and latency benchmark of the send and receive paths. Sweeps payload
+size, in-flight window, prefetch and partition count over the scenarios
+  send           Sender.send, one blocking send per partition thread
+  transfer       Sender.transfer keeping <window> events in flight per partition
+  async_send     AsyncSender with <window> concurrent sends per partition
+  receive        Receiver.on_event_data callbacks
+  async_receive  AsyncReceiver.receive batches
+and prints one JSON record per run with events/s, MB/s, p50/p99/p999 latency in
+milliseconds and CPU microseconds per event.
+
+Send latency is submit to acknowledgement. Receive latency is broker enqueue to
+delivery while a producer on a separate connection feeds the partitions.
+
+Without an address the runs go against tests/broker.py started in this process;
+its CPU time is then included in the per-event figure. For CPU numbers start the
+broker in another process and pass its address:
+  python broker.py --partitions 8 myeventhub &
+  python benchmark.py --partitions 1,4,8 amqp://localhost:5672/myeventhub
+"""
+
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import importlib
+import itertools
+import threading
+from eventhubs import EventHubClient, Sender, Receiver, EventData, Offset
+from broker import LocalBroker
+
+logger = logging.getLogger("eventhubs")
+
+# Transfers still in flight after this many seconds of no completions fail the run
+TRANSFER_TIMEOUT = 60
+
+def async_module():
+    """
+    Imports eventhubs.async for the async scenarios only. async is a keyword since
+    Python 3.7, so the module name cannot appear in an import statement there and
+    the sync scenarios must not depend on it.
+    """
+    return importlib.import_module("eventhubs.async")
+
+class Run(object):
+    """
+    Collects the measurements of one benchmark run.
+    """
+    def __init__(self, scenario, params):
+        self.scenario = scenario
+        self.params = params
+        self.events = 0
+        self.bytes = 0
+        self.latencies = []
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.start_cpu = None
+        self.elapsed = 0.0
+        self.cpu = 0.0
+
+    def start(self):
+        self.start_time = time.time()
+        self.start_cpu = time.process_time()
+
+    def stop(self):
+        self.elapsed = time.time() - self.start_time
+        self.cpu = time.process_time() - self.start_cpu
+
+    def record(self, size, latency):
+        with self.lock:
+            self.events += 1
+            self.bytes += size
+            self.latencies.append(latency)
+
+    def result(self):
+        ordered = sorted(self.latencies)
+        def percentile(fraction):
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000.0, 3)
+        elapsed = self.elapsed or 1e-9
+        result = {"scenario": self.scenario}
+        result.update(self.params)
+        result.update({
+            "events": self.events,
+            "seconds": round(self.elapsed, 3),
+            "events_per_sec": round(self.events / elapsed, 1),
+            "mb_per_sec": round(self.bytes / elapsed / (1024 * 1024), 3),
+            "p50_ms": percentile(0.5),
+            "p99_ms": percentile(0.99),
+            "p999_ms": percentile(0.999),
+            "cpu_us_per_event": round(self.cpu / self.events * 1e6, 2) if self.events else None
+        })
+        return result
+
+def bench_send(address, run, count, payload, partitions, **_):
+    senders = [Sender() for _ in range(partitions)]
+    client = EventHubClient(address)
+    for pid, sender in enumerate(senders):
+        client.publish(sender, str(pid))
+    client.run_daemon()
+    def send_loop(sender):
+        for _ in range(count // partitions):
+            started = time.time()
+            sender.send(EventData(b"D" * payload))
+            run.record(payload, time.time() - started)
+    threads = [threading.Thread(target=send_loop, args=(s,)) for s in senders]
+    run.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    run.stop()
+    client.stop()
+
+def bench_transfer(address, run, count, payload, window, partitions, **_):
+    client = EventHubClient(address)
+    done = threading.Event()
+    remaining = [count // partitions * partitions]
+    if not remaining[0]:
+        raise ValueError("count {} is less than the {} partitions".format(count, partitions))
+    senders = [Sender() for _ in range(partitions)]
+    for pid, sender in enumerate(senders):
+        client.publish(sender, str(pid))
+    client.run_daemon()
+    per_sender = dict((s, count // partitions) for s in senders)
+    def transfer(sender):
+        if per_sender[sender] <= 0:
+            return
+        per_sender[sender] -= 1
+        event_data = EventData(b"T" * payload)
+        event_data.started = time.time()
+        sender.transfer(event_data, lambda d, e: completed(sender, d, e))
+    def completed(sender, event_data, error):
+        if error:
+            logger.error("transfer failed %s", error)
+        run.record(payload, time.time() - event_data.started)
+        progress.set()
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            done.set()
+        else:
+            transfer(sender)
+    progress = threading.Event()
+    run.start()
+    for sender in senders:
+        for _ in range(window):
+            transfer(sender)
+    while not done.is_set():
+        progress.clear()
+        if not progress.wait(TRANSFER_TIMEOUT) and not done.is_set():
+            client.stop()
+            raise RuntimeError("{} transfers not completed after {} seconds".format(
+                remaining[0], TRANSFER_TIMEOUT))
+    run.stop()
+    client.stop()
+
+def bench_async_send(address, run, count, payload, window, partitions, **_):
+    loop = asyncio.new_event_loop()
+    senders = [async_module().AsyncSender(loop=loop) for _ in range(partitions)]
+    client = EventHubClient(address)
+    for pid, sender in enumerate(senders):
+        client.publish(sender, str(pid))
+    client.run_daemon()
+    async def send_loop(sender, total):
+        for _ in range(total):
+            started = time.time()
+            await sender.send(EventData(b"A" * payload))
+            run.record(payload, time.time() - started)
+    per_task = max(1, count // (partitions * window))
+    run.start()
+    loop.run_until_complete(asyncio.gather(*[send_loop(s, per_task) for s in senders for _ in range(window)],
+                                           loop=loop))
+    run.stop()
+    client.stop()
+    loop.close()
+
+def start_producer(address, payload, partitions):
+    """ Feeds the partitions from a separate connection until stopped. """
+    client = EventHubClient(address)
+    senders = [Sender() for _ in range(partitions)]
+    for pid, sender in enumerate(senders):
+        client.publish(sender, str(pid))
+    client.run_daemon()
+    def produce(sender):
+        if not client.stopped:
+            sender.transfer(EventData(b"R" * payload), lambda d, e: produce(sender))
+    for sender in senders:
+        for _ in range(64):
+            produce(sender)
+    return client
+
+def enqueue_latency(event_data):
+    enqueued = event_data.message.annotations["x-opt-enqueued-time"]
+    return time.time() - enqueued / 1000.0
+
+class BenchReceiver(Receiver):
+    """ Records every event until the run has seen the target count. """
+    def __init__(self, run, target, done, prefetch):
+        super(BenchReceiver, self).__init__(prefetch)
+        self.run = run
+        self.target = target
+        self.done = done
+
+    def on_event_data(self, event_data):
+        if self.run.events < self.target:
+            self.run.record(len(event_data.body), enqueue_latency(event_data))
+        elif not self.done.is_set():
+            self.done.set()
+
+def bench_receive(address, run, count, payload, prefetch, partitions, **_):
+    done = threading.Event()
+    client = EventHubClient(address)
+    for pid in range(partitions):
+        client.subscribe(BenchReceiver(run, count, done, prefetch), "$default", str(pid), Offset("@latest"))
+    client.run_daemon()
+    producer = start_producer(address, payload, partitions)
+    run.start()
+    done.wait()
+    run.stop()
+    producer.stop()
+    client.stop()
+
+def bench_async_receive(address, run, count, payload, prefetch, partitions, **_):
+    loop = asyncio.new_event_loop()
+    client = EventHubClient(address)
+    receivers = [async_module().AsyncReceiver(prefetch=prefetch, loop=loop) for _ in range(partitions)]
+    for pid, receiver in enumerate(receivers):
+        client.subscribe(receiver, "$default", str(pid), Offset("@latest"))
+    client.run_daemon()
+    producer = start_producer(address, payload, partitions)
+    async def pump(receiver):
+        while run.events < count:
+            batch = await receiver.receive(100)
+            for event_data in batch or []:
+                run.record(len(event_data.body), enqueue_latency(event_data))
+    run.start()
+    loop.run_until_complete(asyncio.gather(*[pump(r) for r in receivers], loop=loop))
+    run.stop()
+    producer.stop()
+    client.stop()
+    loop.close()
+
+SCENARIOS = {
+    "send": (bench_send, ("payload", "partitions")),
+    "transfer": (bench_transfer, ("payload", "window", "partitions")),
+    "async_send": (bench_async_send, ("payload", "window", "partitions")),
+    "receive": (bench_receive, ("payload", "prefetch", "partitions")),
+    "async_receive": (bench_async_receive, ("payload", "prefetch", "partitions"))
+}
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("localhost", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", help="Comma separated scenarios", default=",".join(sorted(SCENARIOS)))
+    parser.add_argument("--count", help="Events per run", type=int, default=10000)
+    parser.add_argument("--payloads", help="Payload sizes in bytes", type=int_list, default=[128, 1024])
+    parser.add_argument("--windows", help="In-flight sends per partition", type=int_list, default=[1, 32])
+    parser.add_argument("--prefetch", help="Receiver prefetch counts", type=int_list, default=[300])
+    parser.add_argument("--partitions", help="Partition counts", type=int_list, default=[1, 4])
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("address", help="Address of the event hub, a local broker is started if omitted", nargs="?")
+    args = parser.parse_args()
+    if args.count < max(args.partitions):
+        parser.error("--count must be at least the largest partition count")
+
+    broker = None
+    address = args.address
+    if not address:
+        broker = LocalBroker(partitions=max(args.partitions), port=free_port()).run_daemon()
+        address = broker.url
+        time.sleep(0.5)
+
+    values = {"payload": args.payloads, "window": args.windows,
+              "prefetch": args.prefetch, "partitions": args.partitions}
+    results = []
+    try:
+        for name in args.scenarios.split(","):
+            func, dimensions = SCENARIOS[name]
+            for combination in itertools.product(*[values[d] for d in dimensions]):
+                params = dict(zip(dimensions, combination))
+                run = Run(name, params)
+                func(address, run, args.count, **params)
+                result = run.result()
+                results.append(result)
+                print(json.dumps(result))
+                sys.stdout.flush()
+    finally:
+        if broker:
+            broker.stop()
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
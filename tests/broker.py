@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+"""
+An in-process stand-in for an Event Hubs namespace, built on proton's container.
+It keeps per-partition event logs in memory and serves the same addresses as
+the service:
+  <hub>                                           gateway target (send)
+  <hub>/Partitions/<pid>                          partition target (send)
+  <hub>/ConsumerGroups/<cg>/Partitions/<pid>      partition source (receive)
+  $cbs                                            put-token requests
+
+Received events carry x-opt-offset, x-opt-sequence-number and x-opt-enqueued-time
+annotations and receivers honor the offset and enqueued-time selector filters
+created by eventhubs.Offset. Accept latency and link detaches can be injected to
+test recovery paths.
+
+Proton's built-in SASL only offers PLAIN on the server side when it is built with
+Cyrus SASL, so use an address without credentials (ANONYMOUS) against it, e.g.
+  python broker.py --port 5672 --partitions 4 myeventhub
+  python send.py amqp://localhost:5672/myeventhub
+"""
+
+import re
+import time
+import zlib
+import logging
+import argparse
+import threading
+from proton import Message, Condition, symbol, timestamp
+from proton.handlers import MessagingHandler
+from proton.reactor import Container, ApplicationEvent
+from eventhubs import EventInjector
+
+log = logging.getLogger("eventhubs.broker")
+
+TARGET = re.compile(r"^/?(?P<hub>[^/]+)(/Partitions/(?P<partition>[^/]+))?$", re.I)
+SOURCE = re.compile(r"^/?(?P<hub>[^/]+)/ConsumerGroups/(?P<group>[^/]+)/Partitions/(?P<partition>[^/]+)$", re.I)
+SELECTOR = re.compile(r"x-opt-(?P<field>offset|enqueued-time)\s*(?P<op>>=|>)\s*'(?P<value>[^']*)'")
+
+class PartitionLog(object):
+    """
+    The in-memory event log of a partition.
+    """
+    def __init__(self, partition):
+        self.partition = partition
+        self.events = []
+        self.next_offset = 0
+
+    def append(self, message):
+        """ Stores a copy of the message with the service annotations and returns it. """
+        annotations = dict(message.annotations or {})
+        annotations[symbol("x-opt-sequence-number")] = len(self.events)
+        annotations[symbol("x-opt-offset")] = str(self.next_offset)
+        annotations[symbol("x-opt-enqueued-time")] = timestamp(int(time.time() * 1000))
+        event = Message(body=message.body, properties=message.properties, annotations=annotations)
+        self.next_offset += len(event.encode())
+        self.events.append(event)
+        return event
+
+    def position(self, selector):
+        """ Returns the index of the first event matching an Offset selector expression. """
+        match = SELECTOR.search(selector or "")
+        if not match:
+            return 0
+        value = match.group("value")
+        if match.group("field") == "enqueued-time":
+            key, threshold = "x-opt-enqueued-time", int(value)
+        elif value == "@latest":
+            return len(self.events)
+        else:
+            key, threshold = "x-opt-offset", int(value)
+        for index, event in enumerate(self.events):
+            current = int(event.annotations[symbol(key)])
+            if current > threshold or (match.group("op") == ">=" and current == threshold):
+                return index
+        return len(self.events)
+
+class LocalBroker(MessagingHandler):
+    """
+    The broker handler. Run it with run() or run_daemon() and stop it with stop().
+    """
+    def __init__(self, hub="myeventhub", partitions=4, host="localhost", port=5672, latency=0.0):
+        super(LocalBroker, self).__init__(prefetch=300, auto_accept=False)
+        self.hub = hub
+        self.address = "%s:%d" % (host, port)
+        self.latency = latency
+        self.logs = dict((str(p), PartitionLog(str(p))) for p in range(partitions))
+        self.subscribers = dict((p, {}) for p in self.logs)
+        self.cbs_replies = {}
+        self.round_robin = 0
+        self.injector = EventInjector()
+        self.container = Container(self)
+        self.container.container_id = "eventhubs.broker"
+        self.container.allow_insecure_mechs = True
+        self.container.allowed_mechs = "ANONYMOUS PLAIN"
+        self.container.selectable(self.injector)
+        self.acceptor = None
+        self.daemon = None
+
+    @property
+    def url(self):
+        """ The address to hand to EventHubClient. """
+        return "amqp://%s/%s" % (self.address, self.hub)
+
+    def preload(self, partition, count, payload=b"D"):
+        """ Appends events to a partition. Only call it before the broker is started. """
+        for _ in range(count):
+            self.logs[partition].append(Message(body=payload))
+
+    def run(self):
+        """ Runs the broker in the calling thread. """
+        self.container.run()
+
+    def run_daemon(self):
+        """ Runs the broker in a daemon thread. """
+        self.daemon = threading.Thread(target=self.run)
+        self.daemon.daemon = True
+        self.daemon.start()
+        return self
+
+    def stop(self):
+        """ Stops the broker and closes all connections. """
+        self.injector.trigger(ApplicationEvent("broker_stop"))
+        if self.daemon is not None:
+            self.daemon.join()
+
+    def detach(self, partition=None, condition="amqp:link:detach-forced"):
+        """ Detaches the receiver links of a partition (all partitions if None). """
+        self.injector.trigger(ApplicationEvent("broker_detach", subject=(partition, condition)))
+
+    def stats(self):
+        """ Returns the number of stored events per partition. """
+        return dict((p, len(l.events)) for p, l in self.logs.items())
+
+    def on_start(self, event):
+        self.acceptor = event.container.listen(self.address)
+        log.info("broker listening on %s hub=%s partitions=%d", self.address, self.hub, len(self.logs))
+
+    def on_broker_stop(self, event):
+        if self.acceptor:
+            self.acceptor.close()
+            self.acceptor = None
+        for partition in self.subscribers:
+            for link in list(self.subscribers[partition]):
+                link.connection.close()
+        self.injector.close()
+
+    def on_broker_detach(self, event):
+        partition, condition = event.subject
+        for pid in self.subscribers:
+            if partition is None or pid == partition:
+                for link in list(self.subscribers[pid]):
+                    link.condition = Condition(condition, "detached by the local broker")
+                    link.close()
+                    del self.subscribers[pid][link]
+
+    def on_link_opening(self, event):
+        link = event.link
+        if link.is_sender:
+            address = link.remote_source.address or ""
+            if address == "$cbs":
+                link.source.address = address
+                self.cbs_replies[(link.connection, link.remote_target.address)] = link
+                return
+            match = SOURCE.match(address)
+            if not self._check(link, address, match):
+                return
+            link.source.address = address
+            selector = self._selector(link)
+            partition_log = self.logs[match.group("partition")]
+            self.subscribers[partition_log.partition][link] = partition_log.position(selector)
+        else:
+            address = link.remote_target.address or ""
+            if address != "$cbs":
+                match = TARGET.match(address)
+                if not self._check(link, address, match):
+                    return
+            link.target.address = address
+
+    def on_sendable(self, event):
+        self._deliver(event.link)
+
+    def on_message(self, event):
+        link = event.link
+        if link.target.address == "$cbs":
+            self._put_token(event)
+            return
+        match = TARGET.match(link.target.address)
+        partition = match.group("partition") or self._route(event.message)
+        stored = self.logs[partition].append(event.message)
+        if self.latency:
+            self.container.schedule(self.latency, _Accept(self, event.delivery))
+        else:
+            self.accept(event.delivery)
+        log.debug("stored partition=%s sn=%s", partition, stored.annotations[symbol("x-opt-sequence-number")])
+        for subscriber in list(self.subscribers[partition]):
+            self._deliver(subscriber)
+
+    def on_link_closing(self, event):
+        self._forget(event.link)
+
+    def on_connection_closing(self, event):
+        for partition in self.subscribers:
+            for link in list(self.subscribers[partition]):
+                if link.connection == event.connection:
+                    self._forget(link)
+
+    def on_disconnected(self, event):
+        self.on_connection_closing(event)
+
+    def _check(self, link, address, match):
+        if match and match.group("hub").lower() == self.hub.lower() \
+           and match.group("partition") in (None,) + tuple(self.logs):
+            return True
+        link.condition = Condition("amqp:not-found", "no such entity %s" % address)
+        link.close()
+        return False
+
+    def _selector(self, link):
+        filters = link.remote_source.filter.get_object() or {}
+        for key in filters:
+            if str(key) == "selector":
+                return str(getattr(filters[key], "value", filters[key]))
+        return None
+
+    def _route(self, message):
+        key = (message.annotations or {}).get(symbol("x-opt-partition-key"))
+        if key is not None:
+            return str(zlib.crc32(str(key).encode("utf-8")) % len(self.logs))
+        self.round_robin += 1
+        return str(self.round_robin % len(self.logs))
+
+    def _deliver(self, link):
+        for partition in self.subscribers:
+            if link in self.subscribers[partition]:
+                events = self.logs[partition].events
+                position = self.subscribers[partition][link]
+                while link.credit and position < len(events):
+                    link.send(events[position])
+                    position += 1
+                self.subscribers[partition][link] = position
+                return
+
+    def _forget(self, link):
+        for partition in self.subscribers:
+            self.subscribers[partition].pop(link, None)
+        for key in [k for k, v in self.cbs_replies.items() if v == link]:
+            del self.cbs_replies[key]
+
+    def _put_token(self, event):
+        request = event.message
+        self.accept(event.delivery)
+        reply_link = self.cbs_replies.get((event.connection, request.reply_to))
+        if reply_link is None:
+            return
+        reply = Message(correlation_id=request.correlation_id)
+        reply.properties = {"status-code": 202, "status-description": "Accepted"}
+        reply_link.send(reply)
+
+class _Accept(object):
+    """ Accepts a delivery when its timer fires. """
+    def __init__(self, broker, delivery):
+        self.broker = broker
+        self.delivery = delivery
+
+    def on_timer_task(self, event):
+        self.broker.accept(self.delivery)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", help="Host name to listen on", default="localhost")
+    parser.add_argument("--port", help="Port to listen on", type=int, default=5672)
+    parser.add_argument("--partitions", help="Number of partitions", type=int, default=4)
+    parser.add_argument("--latency", help="Seconds to delay accepting sent events", type=float, default=0.0)
+    parser.add_argument("hub", help="Event hub name", nargs="?", default="myeventhub")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        LocalBroker(args.hub, args.partitions, args.host, args.port, args.latency).run()
+    except KeyboardInterrupt:
+        pass